@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+"""Headless benchmark of the WorkflowOrganizer hot paths.
+
+The benchmark runs with a plain Python interpreter: the slicer, qt, ctk and
+vtk modules imported by WorkflowOrganizer.py are replaced by minimal stubs.
+It generates synthetic module trees and workflow files, times
+makeExtensionList, onLoad, makeButtons, onApplyListButton, makeFile and
+repeated onNext cycles, and writes the results as JSON. The results of the
+operations are checked too (modules found, steps built, cache hits), so a
+failed check makes the benchmark fail, e.g. when ctest runs it with --quick.
+
+Usage:
+  python WorkflowOrganizerBenchmark.py [--module-counts 100,1000,5000,20000]
+      [--workflow-sizes 10,100,1000] [--repeat 3] [--output results.json] [--quick]
+      [--verbose]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import types
+import random
+import shutil
+import platform
+import tempfile
+import optparse
+
+#
+# Stubs of the Qt, CTK and Slicer APIs used by the module
+#
+
+def noop(*args, **kwargs):
+  return None
+
+class QObject(object):
+  def __init__(self, *args, **kwargs):
+    self.connections = {}
+
+  def connect(self, signal, slot):
+    self.connections.setdefault(signal, []).append(slot)
+
+  def emit(self, signal, *args):
+    for slot in self.connections.get(signal, []):
+      slot(*args)
+
+  def __getattr__(self, name):
+    # Any other method is a no-op
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return noop
+
+class QWidget(QObject):
+  def __init__(self, *args, **kwargs):
+    QObject.__init__(self)
+    self.widgetLayout = None
+    self.enabled = True
+    self.visible = True
+    self.toolTip = ""
+
+  def setLayout(self, layout):
+    self.widgetLayout = layout
+
+  def layout(self):
+    return self.widgetLayout
+
+class QLayout(QObject):
+  def __init__(self, parent=None):
+    QObject.__init__(self)
+    self.widgets = []
+    if parent is not None:
+      parent.setLayout(self)
+
+  def addWidget(self, widget, *args):
+    self.widgets.append(widget)
+
+  def insertWidget(self, index, widget, *args):
+    self.widgets.insert(index, widget)
+
+  def removeWidget(self, widget):
+    if widget in self.widgets:
+      self.widgets.remove(widget)
+
+  def addRow(self, *args):
+    self.widgets.append(args[-1])
+
+class QPushButton(QWidget):
+  def __init__(self, text="", *args):
+    QWidget.__init__(self)
+    self.text = text
+    self.checked = False
+
+  def setChecked(self, checked):
+    self.checked = checked
+
+  def click(self):
+    self.emit('clicked()')
+
+class QCheckBox(QPushButton):
+  pass
+
+class QLabel(QWidget):
+  def __init__(self, text="", *args):
+    QWidget.__init__(self)
+    self.text = text
+
+class QLineEdit(QLabel):
+  pass
+
+class QSpinBox(QWidget):
+  def __init__(self, *args):
+    QWidget.__init__(self)
+    self.value = 0
+    self.minimum = 0
+    self.maximum = 99
+
+class QStringListModel(QObject):
+  def __init__(self, *args):
+    QObject.__init__(self)
+    self.strings = []
+
+  def setStringList(self, strings):
+    self.strings = list(strings)
+
+  def index(self, row, column=0):
+    return QModelIndex(row)
+
+class QModelIndex(object):
+  def __init__(self, row=-1):
+    self.rowNumber = row
+
+  def row(self):
+    return self.rowNumber
+
+  def isValid(self):
+    return self.rowNumber >= 0
+
+class QRegExp(object):
+  def __init__(self, pattern=""):
+    self.pattern = pattern
+
+  @staticmethod
+  def escape(text):
+    return re.escape(text)
+
+class QSortFilterProxyModel(QObject):
+  def __init__(self, *args):
+    QObject.__init__(self)
+    self.source = QStringListModel()
+    self.filter = None
+
+  def setSourceModel(self, model):
+    self.source = model
+
+  def setFilterRegExp(self, regExp):
+    self.filter = re.compile(regExp.pattern) if regExp.pattern else None
+
+  @property
+  def strings(self):
+    if self.filter is None:
+      return self.source.strings
+    return [string for string in self.source.strings if self.filter.match(string)]
+
+  def mapFromSource(self, index):
+    string = self.source.strings[index.row()]
+    strings = self.strings
+    return QModelIndex(strings.index(string) if string in strings else -1)
+
+class QComboBox(QWidget):
+  NoInsert = 0
+  AdjustToContents = 0
+
+  def __init__(self, *args):
+    QWidget.__init__(self)
+    self.model = QStringListModel()
+    self.currentIndex = -1
+    self.editor = QLineEdit()
+
+  def lineEdit(self):
+    return self.editor
+
+  def setModel(self, model):
+    self.model = model
+
+  def setCurrentIndex(self, index):
+    self.currentIndex = index
+
+  def findText(self, text):
+    try:
+      return self.model.strings.index(text)
+    except ValueError:
+      return -1
+
+  @property
+  def currentText(self):
+    if 0 <= self.currentIndex < len(self.model.strings):
+      return self.model.strings[self.currentIndex]
+    return ""
+
+class QCompleter(QObject):
+  UnfilteredPopupCompletion = 1
+
+class QDockWidget(QWidget):
+  def __init__(self, title="", *args):
+    QWidget.__init__(self)
+    self.windowTitle = title
+
+class QFrame(QWidget):
+  NoFrame = 0
+
+class QTimer(QObject):
+  # Callbacks posted with singleShot(), run by processEvents()
+  pendingCalls = []
+
+  def __init__(self, *args):
+    QObject.__init__(self)
+    self.active = False
+
+  def start(self, *args):
+    self.active = True
+
+  def stop(self):
+    self.active = False
+
+  def isActive(self):
+    return self.active
+
+  @staticmethod
+  def singleShot(msec, callback):
+    QTimer.pendingCalls.append(callback)
+
+class QFileSystemWatcher(QObject):
+  def __init__(self, *args):
+    QObject.__init__(self)
+    self.paths = set()
+
+  def addPaths(self, paths):
+    self.paths.update(paths)
+
+  def removePath(self, path):
+    self.paths.discard(path)
+
+  def directories(self):
+    return [path for path in self.paths if os.path.isdir(path)]
+
+  def files(self):
+    return [path for path in self.paths if not os.path.isdir(path)]
+
+class QFileDialog(object):
+  openFileName = ""
+  saveFileName = ""
+
+  @staticmethod
+  def getOpenFileName(*args):
+    return QFileDialog.openFileName
+
+  @staticmethod
+  def getSaveFileName(*args):
+    return QFileDialog.saveFileName
+
+class QSettings(object):
+  values = {}
+
+  def value(self, key, default=None):
+    return QSettings.values.get(key, default)
+
+  def setValue(self, key, value):
+    QSettings.values[key] = value
+
+class QtNamespace(object):
+  LeftDockWidgetArea = 1
+  RightDockWidgetArea = 2
+
+class QAbstractItemView(object):
+  NoEditTriggers = 0
+
+class Settings(object):
+  def __init__(self, values):
+    self.values = values
+
+  def value(self, key):
+    return self.values.get(key)
+
+  def sync(self):
+    pass
+
+class SlicerApplication(QObject):
+  def __init__(self, settingsPath):
+    QObject.__init__(self)
+    self.settings = Settings({})
+    self.slicerRevisionUserSettingsFilePath = os.path.join(settingsPath, 'Slicer.ini')
+
+  def revisionUserSettings(self):
+    return self.settings
+
+  def hasPendingEvents(self):
+    return False
+
+  def moduleManager(self):
+    return QObject()
+
+class ModuleSelector(object):
+  selectedModule = ""
+
+class MainWindow(QWidget):
+  def __init__(self):
+    QWidget.__init__(self)
+    self.selector = ModuleSelector()
+
+  def moduleSelector(self):
+    return self.selector
+
+def makeStubModule(name, **members):
+  module = types.ModuleType(name)
+  module.__dict__.update(members)
+  return module
+
+def installStubs(settingsPath):
+  mainWindow = MainWindow()
+  def selectModule(moduleName):
+    mainWindow.selector.selectedModule = moduleName
+
+  qt = makeStubModule('qt',
+    QWidget=QWidget, QFrame=QFrame, QDialog=QWidget, QDockWidget=QDockWidget,
+    QPushButton=QPushButton, QCheckBox=QCheckBox, QLabel=QLabel, QLineEdit=QLineEdit,
+    QSpinBox=QSpinBox, QComboBox=QComboBox, QStringListModel=QStringListModel, QCompleter=QCompleter,
+    QSortFilterProxyModel=QSortFilterProxyModel, QRegExp=QRegExp,
+    QTableWidget=QWidget, QTableWidgetItem=QObject, QAbstractItemView=QAbstractItemView,
+    QVBoxLayout=QLayout, QHBoxLayout=QLayout, QFormLayout=QLayout,
+    QTimer=QTimer, QFileDialog=QFileDialog, QFileSystemWatcher=QFileSystemWatcher, QSettings=QSettings, QMessageBox=QObject(), Qt=QtNamespace)
+  ctk = makeStubModule('ctk', ctkCollapsibleButton=QWidget)
+  vtk = makeStubModule('vtk')
+  slicer = makeStubModule('slicer',
+    app=SlicerApplication(settingsPath),
+    util=makeStubModule('slicer.util', selectModule=selectModule,
+                        mainWindow=lambda: mainWindow, findChildren=noop),
+    mrmlScene=QObject(), qMRMLWidget=QWidget, modules=QObject())
+
+  import __main__
+  for name, module in (('qt', qt), ('ctk', ctk), ('vtk', vtk), ('slicer', slicer)):
+    setattr(__main__, name, module)
+    sys.modules.setdefault(name, module)
+  return slicer
+
+def processEvents():
+  while QTimer.pendingCalls:
+    QTimer.pendingCalls.pop(0)()
+
+#
+# Synthetic data
+#
+
+def makeModuleTree(rootPath, numberOfFiles, numberOfRoots=4):
+  """Create numberOfFiles module files spread over numberOfRoots directories.
+  Return the list of directories and the list of module names.
+  """
+  from WorkflowOrganizerLib.ModuleIndex import moduleFileTypes
+  fileTypes = moduleFileTypes.get(platform.system(), moduleFileTypes['Linux'])
+  kinds = ('loadable', 'scripted', 'cli')
+  directories = []
+  for r in xrange(0, numberOfRoots):
+    path = os.path.join(rootPath, 'Modules%d' % r)
+    os.makedirs(path)
+    directories.append(path)
+  names = []
+  for i in xrange(0, numberOfFiles):
+    kind = kinds[i % len(kinds)]
+    prefix, suffix = fileTypes[kind]
+    name = 'Module%05d' % i
+    open(os.path.join(directories[i % numberOfRoots], prefix + name + suffix), 'w').close()
+    names.append(name)
+  return directories, names
+
+def makeWorkflowFile(fileName, moduleNames, numberOfSteps):
+  rng = random.Random(numberOfSteps)
+  lines = ["<items>", "<title>Benchmark %d</title>" % numberOfSteps, "# module name and label name"]
+  for i in xrange(0, numberOfSteps):
+    name = rng.choice(moduleNames)
+    lines.append("<item>%s,%s</item>" % (name, name))
+  lines.append("</items>")
+  f = open(fileName, 'w')
+  f.write("\n".join(lines) + "\n")
+  f.close()
+
+#
+# Benchmark
+#
+
+class Benchmark(object):
+  def __init__(self, repeat):
+    self.repeat = repeat
+    self.results = []
+
+  def measure(self, operation, function, setup=None, **parameters):
+    times = []
+    for r in xrange(0, self.repeat):
+      if setup:
+        setup()
+      startTime = time.time()
+      function()
+      times.append(time.time() - startTime)
+    result = dict(parameters)
+    result.update({
+      'operation': operation,
+      'repeat': self.repeat,
+      'best': min(times),
+      'mean': sum(times) / len(times),
+      })
+    self.results.append(result)
+    return result
+
+class CheckFailed(Exception):
+  pass
+
+def check(condition, message):
+  # Unlike assert, also checked with python -O
+  if not condition:
+    raise CheckFailed(message)
+
+def waitForDiscovery(widget):
+  widget.discovery.thread.join()
+  while widget.discoveryTimer.isActive():
+    widget.onDiscoveryTimer()
+
+def run(moduleCounts, workflowSizes, repeat, numberOfNextCycles, verbose=False):
+  tempPath = tempfile.mkdtemp(prefix='WorkflowOrganizerBenchmark')
+  slicer = installStubs(tempPath)
+  sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+  import WorkflowOrganizer
+
+  benchmark = Benchmark(repeat)
+  # The messages of the module would mix with the JSON report
+  stdout = sys.stdout
+  sys.stdout = sys.stderr if verbose else open(os.devnull, 'w')
+  try:
+    for numberOfModules in moduleCounts:
+      treePath = os.path.join(tempPath, 'tree%d' % numberOfModules)
+      directories, moduleNames = makeModuleTree(treePath, numberOfModules)
+      slicer.app.settings.values["Modules/AdditionalPaths"] = directories
+
+      widgets = []
+      def setupWidget():
+        widget = WorkflowOrganizer.WorkflowOrganizerWidget(QWidget())
+        widget.layout = QLayout()
+        widget.setup()
+        widgets.append(widget)
+      benchmark.measure('setup', setupWidget, modules=numberOfModules)
+      for widget in widgets[1:]:
+        waitForDiscovery(widget)
+        widget.cleanup()
+      widget = widgets[0]
+      waitForDiscovery(widget)
+      check(len(widget.moduleRegistry) == numberOfModules,
+            'setup: %d of %d modules found' % (len(widget.moduleRegistry), numberOfModules))
+
+      def discover():
+        widget.makeExtensionList()
+        waitForDiscovery(widget)
+      benchmark.measure('makeExtensionList (cold)', discover,
+                        setup=widget.moduleIndexCache.clear, modules=numberOfModules)
+      check(widget.moduleRegistry.names == sorted(moduleNames), 'makeExtensionList: wrong module list')
+      widget.moduleIndexCache.hits = widget.moduleIndexCache.misses = 0
+      benchmark.measure('makeExtensionList (cached)', discover, modules=numberOfModules)
+      check(widget.moduleIndexCache.misses == 0 and widget.moduleIndexCache.hits > 0,
+            'makeExtensionList: %d cache misses on an unchanged tree' % widget.moduleIndexCache.misses)
+      check(len(widget.moduleRegistry) == numberOfModules, 'makeExtensionList (cached): wrong module count')
+
+      from WorkflowOrganizerLib import ModuleSearchIndex
+      benchmark.measure('ModuleSearchIndex', lambda: ModuleSearchIndex(moduleNames), modules=numberOfModules)
+      searchIndex = ModuleSearchIndex(moduleNames)
+      def search():
+        for query in ('m', 'mo', 'mod', 'module0', '0', '00', '123', 'e00'):
+          searchIndex.search(query)
+      result = benchmark.measure('ModuleSearchIndex.search', search, modules=numberOfModules)
+      result['queries'] = 8
+
+      for numberOfSteps in workflowSizes:
+        fileName = os.path.join(tempPath, 'workflow%d.xml' % numberOfSteps)
+        makeWorkflowFile(fileName, moduleNames, numberOfSteps)
+        QFileDialog.openFileName = fileName
+        parameters = {'modules': numberOfModules, 'steps': numberOfSteps}
+
+        benchmark.measure('onLoad', widget.onLoad, **parameters)
+        check(len(widget.items) == numberOfSteps, 'onLoad: %d of %d items' % (len(widget.items), numberOfSteps))
+        check(len(widget.modules) == numberOfSteps, 'onLoad: %d of %d steps' % (len(widget.modules), numberOfSteps))
+        check("None" not in [widget.selectedModuleName(item) for item in widget.items],
+              'onLoad: a module of the workflow was not selected')
+
+        def resetButtons():
+          widget.clearAllButtons()
+          for item in widget.items:
+            moduleName = widget.selectedModuleName(item)
+            widget.modules.append(WorkflowOrganizer.ModuleButtonProperty(moduleName, moduleName))
+        benchmark.measure('makeButtons', widget.makeButtons, setup=resetButtons, **parameters)
+
+        benchmark.measure('onApplyListButton (unchanged)', widget.onApplyListButton, **parameters)
+        check([p.module for p in widget.modules] == [widget.selectedModuleName(item) for item in widget.items],
+              'onApplyListButton: the steps do not match the items')
+        def changeOneStep():
+          selector = widget.items[len(widget.items) // 2].selector
+          selector.setCurrentIndex(selector.currentIndex % len(widget.moduleRegistry) + 1)
+        benchmark.measure('onApplyListButton (one step changed)', widget.onApplyListButton,
+                          setup=changeOneStep, **parameters)
+
+        benchmark.measure('makeFile', lambda: widget.makeFile(tempPath), **parameters)
+        text = widget.makeFile(tempPath)
+        check(text.count('<item>') == numberOfSteps, 'makeFile: %d of %d items' % (text.count('<item>'), numberOfSteps))
+
+        def nextCycles():
+          for i in xrange(0, numberOfNextCycles * numberOfSteps):
+            widget.onNext()
+            processEvents()
+        currentModuleId = widget.currentModuleId
+        result = benchmark.measure('onNext', nextCycles, **parameters)
+        result['transitions'] = numberOfNextCycles * numberOfSteps
+        # Whole cycles end on the step they started from
+        check(widget.currentModuleId == currentModuleId, 'onNext: ended on step %d' % (widget.currentModuleId+1))
+
+      widget.cleanup()
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+    shutil.rmtree(tempPath, ignore_errors=True)
+
+  return {
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'results': benchmark.results,
+    }
+
+def parseCounts(option, opt, value, parser):
+  setattr(parser.values, option.dest, [int(v) for v in value.split(',')])
+
+def main(argv):
+  parser = optparse.OptionParser(usage="%prog [options]")
+  parser.add_option('--module-counts', dest='moduleCounts', type='string', action='callback',
+                    callback=parseCounts, default=[100, 1000, 5000, 20000],
+                    help="comma separated numbers of module files")
+  parser.add_option('--workflow-sizes', dest='workflowSizes', type='string', action='callback',
+                    callback=parseCounts, default=[10, 100, 1000],
+                    help="comma separated numbers of workflow steps")
+  parser.add_option('--repeat', dest='repeat', type='int', default=3)
+  parser.add_option('--next-cycles', dest='nextCycles', type='int', default=2,
+                    help="number of times onNext goes through the whole workflow")
+  parser.add_option('--output', dest='output', default=None, help="JSON output file (default: stdout)")
+  parser.add_option('--quick', dest='quick', action='store_true', default=False,
+                    help="small sizes, for a smoke test")
+  parser.add_option('--verbose', dest='verbose', action='store_true', default=False,
+                    help="show the messages of the module on stderr")
+  options, args = parser.parse_args(argv)
+  if options.quick:
+    options.moduleCounts = [100]
+    options.workflowSizes = [10]
+    options.repeat = 1
+
+  try:
+    report = run(options.moduleCounts, options.workflowSizes, options.repeat, options.nextCycles, options.verbose)
+  except CheckFailed as e:
+    sys.stderr.write('Check failed: %s\n' % e)
+    return 1
+  data = json.dumps(report, indent=2, sort_keys=True)
+  if options.output:
+    f = open(options.output, 'w')
+    f.write(data)
+    f.close()
+  else:
+    print(data)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,943 @@
+#!/usr/bin/env python
+"""Headless unit tests of WorkflowOrganizerLib.
+
+The library does not use Qt or Slicer, so the tests run with a plain Python
+interpreter:
+
+  python WorkflowOrganizerLibTest.py [-v]
+"""
+
+import os
+import ast
+import csv
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from WorkflowOrganizerLib import (Workflow, WorkflowStep, WorkflowInclude, WorkflowCache, ModuleRegistry,
+                                  ModuleSearchIndex, DataPrefetcher, BackgroundFileWriter, ModuleIndexCache,
+                                  ModuleDiscovery, TransitionRecorder, ResourceRecorder, parseWorkflow,
+                                  formatWorkflow, readWorkflowFile, validateWorkflow, expandWorkflow,
+                                  writeFileAtomically)
+from WorkflowOrganizerLib.Batch import BatchRunner
+from WorkflowOrganizerLib.ModuleIndex import classifyModuleFiles, moduleFileTypes, moduleKinds
+from WorkflowOrganizerLib.ModuleMetadata import extractModuleMetadata
+from WorkflowOrganizerLib.Remote import RemoteClient, parseCommand, stepReply, parseStepReply, benchmark as remoteBenchmark
+from WorkflowOrganizerLib.Runner import WorkflowRunner
+from WorkflowOrganizerLib.StartupProfile import StartupProfile, moduleClosure, startupReport
+
+def writeFile(fileName, text):
+  f = open(fileName, 'w')
+  try:
+    f.write(text)
+  finally:
+    f.close()
+
+def readFile(fileName):
+  f = open(fileName, 'r')
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+class TemporaryDirectoryTestCase(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp(prefix='WorkflowOrganizerLibTest')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+  def path(self, *names):
+    return os.path.join(self.directory, *names)
+
+#
+# ModuleIndexCache
+#
+class ModuleIndexCacheTest(TemporaryDirectoryTestCase):
+  def setUp(self):
+    TemporaryDirectoryTestCase.setUp(self)
+    self.modulePath = self.path('modules')
+    os.mkdir(self.modulePath)
+    writeFile(os.path.join(self.modulePath, 'Data.py'), '')
+    writeFile(os.path.join(self.modulePath, 'libCropLib.so'), '')
+    self.directories = [(self.modulePath, ('scripted', 'cli'))]
+    self.indexFileName = self.path('index.json')
+
+  def discover(self):
+    cache = ModuleIndexCache(self.indexFileName)
+    names = ModuleDiscovery(cache, 'Linux', numberOfThreads=1).discover(self.directories)
+    return cache, names
+
+  def test_hitAfterReload(self):
+    cache, names = self.discover()
+    self.assertEqual(names, ['Crop', 'Data'])
+    self.assertEqual((cache.hits, cache.misses), (0, 1))
+    self.assertTrue(os.path.exists(self.indexFileName))
+    # A new session reads the index instead of listing the directory
+    cache, names = self.discover()
+    self.assertEqual(names, ['Crop', 'Data'])
+    self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+  def test_directoryChanged(self):
+    self.discover()
+    writeFile(os.path.join(self.modulePath, 'Volumes.py'), '')
+    # The mtime of the directory may not have changed within its resolution
+    mtime = os.stat(self.modulePath).st_mtime + 10
+    os.utime(self.modulePath, (mtime, mtime))
+    cache, names = self.discover()
+    self.assertEqual(names, ['Crop', 'Data', 'Volumes'])
+    self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+  def test_fileMetadata(self):
+    cache = ModuleIndexCache(None)
+    cache.storeFile('/m/Data.py', [1.0, 10], {'title': 'Data'})
+    self.assertEqual(cache.lookupFile('/m/Data.py', [1.0, 10]), {'title': 'Data'})
+    # Updated in place: same directory, other size
+    self.assertEqual(cache.lookupFile('/m/Data.py', [1.0, 12]), None)
+    self.assertEqual((cache.metadataHits, cache.metadataMisses), (1, 1))
+    cache.storeFile('/m/Data.py', None, {})
+    self.assertFalse('/m/Data.py' in cache.files)
+
+  def test_prune(self):
+    cache = ModuleIndexCache(None)
+    cache.store('/a', 1.0, [])
+    cache.store('/b', 1.0, [])
+    cache.storeFile('/b/B.py', [1.0, 10], {})
+    cache.prune(['/a'])
+    self.assertEqual(list(cache.directories.keys()), ['/a'])
+    self.assertEqual(cache.files, {})
+
+  def test_brokenIndex(self):
+    writeFile(self.indexFileName, '{"version": ')
+    cache, names = self.discover()
+    self.assertEqual(names, ['Crop', 'Data'])
+    self.assertEqual(cache.misses, 1)
+    # An index of another format version is ignored too
+    writeFile(self.indexFileName, '{"version": 0, "directories": {}}')
+    self.assertEqual(ModuleIndexCache(self.indexFileName).directories, {})
+
+#
+# Module discovery
+#
+class ModuleDiscoveryTest(TemporaryDirectoryTestCase):
+  def test_classifyModuleFiles(self):
+    fileNames = ['libqSlicerVolumesModule.so', 'Data.py', 'libCropLib.so', 'libvtkSlicerVolumesModuleLogic.so',
+                 '.hidden.py', 'README.txt', 'Data.pyc']
+    self.assertEqual(classifyModuleFiles(fileNames, moduleKinds, moduleFileTypes['Linux']),
+                     [['loadable', 'Volumes', 'libqSlicerVolumesModule.so'], ['scripted', 'Data', 'Data.py'],
+                      ['cli', 'Crop', 'libCropLib.so']])
+    # Only the kinds of the directory
+    self.assertEqual(classifyModuleFiles(fileNames, ('scripted',), moduleFileTypes['Linux']),
+                     [['scripted', 'Data', 'Data.py']])
+    self.assertEqual(classifyModuleFiles(['qSlicerVolumesModule.dll', 'CropLib.dll'], moduleKinds, moduleFileTypes['Windows']),
+                     [['loadable', 'Volumes', 'qSlicerVolumesModule.dll'], ['cli', 'Crop', 'CropLib.dll']])
+
+  def test_moduleDirectories(self):
+    appPath = self.path('Slicer')
+    for subdirectory in ('qt-scripted-modules', 'cli-modules'):
+      os.makedirs(os.path.join(appPath, 'lib', 'Slicer-4.11', subdirectory))
+    discovery = ModuleDiscovery(platformName='Linux')
+    self.assertEqual(discovery.moduleDirectories(appPath, [self.path('extra')]),
+                     [(os.path.join(appPath, 'lib', 'Slicer-4.11', 'qt-scripted-modules'), ('scripted',)),
+                      (os.path.join(appPath, 'lib', 'Slicer-4.11', 'cli-modules'), ('cli',)),
+                      (self.path('extra'), moduleKinds)])
+
+  def test_discover(self):
+    directories = []
+    for i in xrange(0, 4):
+      path = self.path('modules%d' % i)
+      os.mkdir(path)
+      writeFile(os.path.join(path, 'Module%d.py' % (3 - i)), '')
+      directories.append((path, moduleKinds))
+    directories.append((self.path('missing'), moduleKinds))
+    scanned = {}
+    def directoryScanned(path, modules):
+      scanned[path] = modules
+    discovery = ModuleDiscovery(platformName='Linux', numberOfThreads=4)
+    names = discovery.discover(directories, directoryScanned)
+    self.assertEqual(names, ['Module0', 'Module1', 'Module2', 'Module3'])
+    self.assertEqual(scanned[self.path('modules0')], [('scripted', 'Module3', self.path('modules0', 'Module3.py'))])
+    self.assertEqual(scanned[self.path('missing')], [])
+    self.assertEqual(len(discovery.moduleFiles), 4)
+
+#
+# Workflow files
+#
+class WorkflowFileTest(unittest.TestCase):
+  lines = ["<items>",
+           "<title>Biopsy</title>",
+           "# module name, label name and data files",
+           "<item>Data,Data</item>",
+           "<item>Volumes,Intra-op</item>",
+           "</items>"]
+
+  def test_parse(self):
+    workflow = parseWorkflow(self.lines + ["# <item>Commented,Out</item>", "<item>no label</item>"])
+    self.assertEqual(workflow.title, 'Biopsy')
+    self.assertEqual([(step.module, step.label) for step in workflow.steps], [('Data', 'Data'), ('Volumes', 'Intra-op')])
+
+  def test_roundTrip(self):
+    workflow = parseWorkflow(self.lines)
+    self.assertEqual(formatWorkflow(workflow).split('\n'), self.lines)
+
+  def test_defaultTitle(self):
+    workflow = parseWorkflow(["<items>", "<item>Data,Data</item>", "</items>"])
+    self.assertEqual(workflow.title, None)
+    self.assertTrue("<title>Workflow Organizer</title>" in formatWorkflow(workflow).split('\n'))
+
+#
+# TransitionRecorder
+#
+class TransitionRecorderTest(TemporaryDirectoryTestCase):
+  def makeRecorder(self):
+    recorder = TransitionRecorder()
+    for i in xrange(0, 20):
+      recorder.record('button', 'Data', 'Volumes', 0.01, 0.02 + i * 0.001, timestamp=i)
+    recorder.record('next', 'Volumes', 'Segmentation', 0.5, 1.0, timestamp=20)
+    return recorder
+
+  def test_summary(self):
+    summary = self.makeRecorder().summary()
+    # The slowest module first
+    self.assertEqual([s['module'] for s in summary], ['Segmentation', 'Volumes'])
+    volumes = summary[1]
+    self.assertEqual(volumes['count'], 20)
+    self.assertAlmostEqual(volumes['totalP50'], 0.03)
+    self.assertAlmostEqual(volumes['totalP95'], 0.038)
+    self.assertAlmostEqual(volumes['totalMax'], 0.039)
+    self.assertAlmostEqual(volumes['selectP95'], 0.01)
+
+  def test_maximumNumberOfRecords(self):
+    recorder = TransitionRecorder(maximumNumberOfRecords=5)
+    for i in xrange(0, 8):
+      recorder.record('next', 'Data', 'Volumes', 0.0, float(i))
+    self.assertEqual([r[5] for r in recorder.records], [3.0, 4.0, 5.0, 6.0, 7.0])
+
+  def test_export(self):
+    recorder = self.makeRecorder()
+    recorder.export(self.path('transitions.csv'))
+    f = open(self.path('transitions.csv'), 'rb')
+    try:
+      rows = list(csv.reader(f))
+    finally:
+      f.close()
+    self.assertEqual(tuple(rows[0]), TransitionRecorder.fields)
+    self.assertEqual(rows[-1], ['20', 'next', 'Volumes', 'Segmentation', '0.5', '1.0'])
+    recorder.export(self.path('transitions.json'))
+    data = json.loads(readFile(self.path('transitions.json')))
+    self.assertEqual(len(data['transitions']), 21)
+    self.assertEqual(data['summary'][0]['module'], 'Segmentation')
+
+#
+# ModuleSearchIndex
+#
+class ModuleSearchIndexTest(unittest.TestCase):
+  names = ['CropVolume', 'Data', 'DICOMPatcher', 'Volumes', 'VolumeRendering', 'ResampleScalarVolume']
+
+  def test_order(self):
+    index = ModuleSearchIndex(self.names)
+    # Prefix matches first, then initials, then substrings
+    self.assertEqual(index.search('vol'), ['VolumeRendering', 'Volumes', 'CropVolume', 'ResampleScalarVolume'])
+    self.assertEqual(index.search('cv'), ['CropVolume'])
+    self.assertEqual(index.search('dp'), ['DICOMPatcher'])
+    self.assertEqual(index.search('patch'), ['DICOMPatcher'])
+    self.assertEqual(index.search('xyz'), [])
+    self.assertEqual(index.search('', limit=2), ['CropVolume', 'DICOMPatcher'])
+
+  def test_shortQueries(self):
+    index = ModuleSearchIndex(self.names + ['IO'])
+    self.assertTrue('IO' in index.search('o'))
+    self.assertTrue('Volumes' in index.search('lu'))
+
+  def test_aliases(self):
+    index = ModuleSearchIndex(self.names, {'Data': ['Subject hierarchy']})
+    self.assertEqual(index.search('subject'), ['Data'])
+
+#
+# Workflow validation
+#
+class WorkflowValidationTest(unittest.TestCase):
+  def test_missingModules(self):
+    workflow = parseWorkflow(["<items>", "<item>Data,Data</item>", "<item>Volume,Typo</item>",
+                              "<item>Volume,Typo again</item>", "</items>"])
+    suggested = []
+    def similarNames(name):
+      suggested.append(name)
+      return ['Volumes']
+    missingSteps = validateWorkflow(workflow, set(['Data', 'Volumes']), similarNames)
+    self.assertEqual(missingSteps, [(1, 'Volume', ['Volumes']), (2, 'Volume', ['Volumes'])])
+    # The suggestions are looked up once per module
+    self.assertEqual(suggested, ['Volume'])
+
+  def test_similarNames(self):
+    index = ModuleSearchIndex(['CropVolume', 'Data', 'Volumes', 'VolumeRendering'])
+    self.assertEqual(index.similarNames('crop_volume'), ['CropVolume'])
+    self.assertEqual(index.similarNames('Volume')[0], 'Volumes')
+    self.assertEqual(index.similarNames('Qwerty'), [])
+
+#
+# Data files of the steps
+#
+class WorkflowDataTest(unittest.TestCase):
+  lines = ["<items>",
+           "<title>Biopsy</title>",
+           "# module name, label name and data files",
+           "<item>Volumes,Intra-op,intraop/T2.nrrd;/data/atlas.nrrd</item>",
+           "</items>"]
+
+  def test_parse(self):
+    workflow = parseWorkflow(self.lines, '/tmp/wf')
+    self.assertEqual(workflow.steps[0].data, ['/tmp/wf/intraop/T2.nrrd', '/data/atlas.nrrd'])
+
+  def test_roundTrip(self):
+    workflow = parseWorkflow(self.lines, '/tmp/wf')
+    self.assertEqual(formatWorkflow(workflow, '/tmp/wf').split('\n'), self.lines)
+
+  def test_relativePathsFollowTheFile(self):
+    workflow = parseWorkflow(self.lines, '/tmp/wf')
+    lines = formatWorkflow(workflow, '/tmp/other').split('\n')
+    self.assertTrue('<item>Volumes,Intra-op,../wf/intraop/T2.nrrd;/data/atlas.nrrd</item>' in lines)
+
+class DataPrefetcherTest(TemporaryDirectoryTestCase):
+  def waitForState(self, prefetcher, fileName, state):
+    endTime = time.time() + 10.0
+    while prefetcher.state(fileName) != state:
+      self.assertTrue(time.time() < endTime, '%s is %s, not %s' % (fileName, prefetcher.state(fileName), state))
+      time.sleep(0.01)
+
+  def makeFile(self, name, size):
+    writeFile(self.path(name), 'x' * size)
+    return self.path(name)
+
+  def test_prefetch(self):
+    fileNames = [self.makeFile('a.nrrd', 1000), self.makeFile('b.nrrd', 2000)]
+    prefetcher = DataPrefetcher(memoryLimit=10000, chunkSize=256)
+    prefetcher.prefetch(fileNames + [self.path('missing.nrrd')])
+    for fileName in fileNames:
+      self.waitForState(prefetcher, fileName, 'ready')
+    self.assertFalse(prefetcher.isActive())
+    self.assertEqual(prefetcher.state(self.path('missing.nrrd')), 'failed')
+    self.assertEqual(prefetcher.summary()['bytesHeld'], 3000)
+    prefetcher.release(fileNames[0])
+    self.assertEqual(prefetcher.state(fileNames[0]), 'loaded')
+    self.assertEqual(prefetcher.summary()['bytesHeld'], 2000)
+    prefetcher.stop()
+
+  def test_memoryLimit(self):
+    small = self.makeFile('small.nrrd', 600)
+    second = self.makeFile('second.nrrd', 600)
+    large = self.makeFile('large.nrrd', 5000)
+    prefetcher = DataPrefetcher(numberOfThreads=2, memoryLimit=1000, chunkSize=256)
+    prefetcher.prefetch([small, large, second])
+    # Skipped, as it is larger than the limit
+    self.assertEqual(prefetcher.state(large), 'skipped')
+    self.waitForState(prefetcher, small, 'ready')
+    # Waits for the memory of the first file
+    time.sleep(0.05)
+    self.assertEqual(prefetcher.state(second), 'queued')
+    self.assertEqual(prefetcher.summary()['bytesHeld'], 600)
+    prefetcher.release(small)
+    self.waitForState(prefetcher, second, 'ready')
+    prefetcher.stop()
+
+  def test_prefetchReplacesTheQueue(self):
+    first = self.makeFile('first.nrrd', 800)
+    queued = self.makeFile('queued.nrrd', 800)
+    prefetcher = DataPrefetcher(memoryLimit=1000, chunkSize=256)
+    prefetcher.prefetch([first, queued])
+    self.waitForState(prefetcher, first, 'ready')
+    self.assertEqual(prefetcher.state(queued), 'queued')
+    prefetcher.prefetch([first])
+    self.assertEqual(prefetcher.state(queued), None)
+    self.assertEqual(prefetcher.state(first), 'ready')
+    prefetcher.stop()
+
+  def test_prefetchReleasesDroppedFiles(self):
+    skipped = self.makeFile('skipped.nrrd', 800)
+    following = self.makeFile('following.nrrd', 800)
+    prefetcher = DataPrefetcher(memoryLimit=1000, chunkSize=256)
+    prefetcher.prefetch([skipped, following])
+    self.waitForState(prefetcher, skipped, 'ready')
+    self.assertEqual(prefetcher.summary()['bytesHeld'], 800)
+    # The step of the first file was skipped; its bytes must not block the next file
+    prefetcher.prefetch([following])
+    self.assertEqual(prefetcher.state(skipped), None)
+    self.waitForState(prefetcher, following, 'ready')
+    self.assertEqual(prefetcher.summary()['bytesHeld'], 800)
+    prefetcher.stop()
+
+#
+# WorkflowRunner
+#
+class WorkflowRunnerTest(TemporaryDirectoryTestCase):
+  def setUp(self):
+    TemporaryDirectoryTestCase.setUp(self)
+    self.logFileName = self.path('log.txt')
+    # The CLI 'Log' appends its argument to the log, 'Fail' fails
+    self.executables = {'Log': sys.executable, 'Fail': sys.executable}
+
+  def logStep(self, label, after=None):
+    arguments = '-c "import sys; open(sys.argv[1], \'a\').write(sys.argv[2] + \'\\n\')" {log} %s' % label
+    return WorkflowStep('Log', label, arguments=arguments, after=after)
+
+  def failStep(self, label, after=None):
+    return WorkflowStep('Fail', label, arguments='-c "import sys; sys.exit(1)"', after=after)
+
+  def runSteps(self, steps, numberOfThreads=4):
+    runner = WorkflowRunner(Workflow('Test', steps), self.executables, {'log': self.logFileName}, numberOfThreads)
+    runner.run()
+    return runner
+
+  def loggedSteps(self):
+    if not os.path.exists(self.logFileName):
+      return []
+    return readFile(self.logFileName).split()
+
+  def test_dependencyOrder(self):
+    runner = self.runSteps([self.logStep('C', ['B']), self.logStep('B', ['3', 'A']), self.logStep('A'),
+                            WorkflowStep('Volumes', 'Interactive')])
+    self.assertEqual(self.loggedSteps(), ['A', 'B', 'C'])
+    self.assertEqual([result.status for result in runner.results], ['done', 'done', 'done', 'interactive'])
+    self.assertTrue(runner.succeeded())
+
+  def test_independentStepsAllRun(self):
+    runner = self.runSteps([self.logStep('A'), self.logStep('B'), self.logStep('C', ['A', 'B'])])
+    logged = self.loggedSteps()
+    self.assertEqual(sorted(logged[0:2]), ['A', 'B'])
+    self.assertEqual(logged[2], 'C')
+    self.assertTrue(runner.succeeded())
+
+  def test_skipOnFailure(self):
+    runner = self.runSteps([self.failStep('Register'), self.logStep('Resample', ['Register']),
+                            self.logStep('Report', ['Resample']), self.logStep('Other')])
+    self.assertEqual([result.status for result in runner.results], ['failed', 'skipped', 'skipped', 'done'])
+    self.assertEqual(self.loggedSteps(), ['Other'])
+    self.assertFalse(runner.succeeded())
+
+  def test_cycle(self):
+    runner = WorkflowRunner(Workflow('Test', [self.logStep('A', ['C']), self.logStep('B', ['A']),
+                                              self.logStep('C', ['B']), self.logStep('D')]),
+                            self.executables, {'log': self.logFileName}, 1)
+    try:
+      runner.plan()
+    except ValueError as e:
+      self.assertTrue('cycle' in str(e) and '1, 2, 3' in str(e), str(e))
+    else:
+      self.fail('no cycle found')
+    self.assertRaises(ValueError, runner.run)
+    self.assertEqual(self.loggedSteps(), [])
+
+  def test_unknownDependency(self):
+    runner = WorkflowRunner(Workflow('Test', [self.logStep('A', ['Z'])]), self.executables, {'log': self.logFileName}, 1)
+    self.assertRaises(ValueError, runner.plan)
+
+  def test_parseArgumentsAndDependencies(self):
+    lines = ["<items>",
+             "<title>Registration</title>",
+             "# module name, label name and data files",
+             "<item>ResampleScalarVolume,Resample</item>",
+             "<args>--spacing 1,1,1 {case}/T2.nrrd {output}/T2iso.nrrd</args>",
+             "<item>BRAINSFit,Register</item>",
+             "<args>--fixedVolume {output}/T2iso.nrrd</args>",
+             "<after>Resample;1</after>",
+             "</items>"]
+    workflow = parseWorkflow(lines)
+    self.assertEqual(workflow.steps[0].arguments, '--spacing 1,1,1 {case}/T2.nrrd {output}/T2iso.nrrd')
+    self.assertEqual(workflow.steps[1].after, ['Resample', '1'])
+    self.assertEqual(formatWorkflow(workflow).split('\n'), lines)
+
+#
+# BatchRunner
+#
+stepScript = '''import os, sys, time
+case, output = sys.argv[1:3]
+def exists(name):
+  return os.path.exists(os.path.join(case, name))
+if exists('sleep'):
+  open(os.path.join(output, 'pid.txt'), 'w').write(str(os.getpid()))
+  time.sleep(60)
+if exists('fail'):
+  sys.exit(1)
+if exists('failOnce') and not exists('tried'):
+  open(os.path.join(case, 'tried'), 'w').close()
+  sys.exit(1)
+open(os.path.join(output, 'result.txt'), 'w').write(os.path.basename(case))
+'''
+
+def processExists(pid):
+  try:
+    os.kill(pid, 0)
+  except OSError:
+    return False
+  # A killed process that was not reaped yet is gone too
+  try:
+    return readFile('/proc/%d/stat' % pid).split()[2] != 'Z'
+  except IOError:
+    return True
+
+@unittest.skipIf(os.name == 'nt', 'the CLI of the test workflow is a shell script')
+class BatchRunnerTest(TemporaryDirectoryTestCase):
+  # The workers are 'python -m WorkflowOrganizerLib.Runner' processes, and
+  # the CLI of the workflow step runs stepScript with the same interpreter;
+  # what the step does depends on the files of the case directory.
+  def setUp(self):
+    TemporaryDirectoryTestCase.setUp(self)
+    self.modulePath = self.path('cli-modules')
+    os.mkdir(self.modulePath)
+    executable = os.path.join(self.modulePath, 'Python')
+    writeFile(executable, '#!/bin/sh\nexec "%s" "$@"\n' % sys.executable)
+    os.chmod(executable, 0o755)
+    writeFile(self.path('step.py'), stepScript)
+    writeFile(self.path('workflow.txt'),
+              "<items>\n<item>Python,Step</item>\n<args>{workflow}/step.py {case} {output}</args>\n</items>\n")
+
+  def makeCase(self, name, *flags):
+    directory = self.path('cases', name)
+    os.makedirs(directory)
+    for flag in flags:
+      writeFile(os.path.join(directory, flag), '')
+    return directory
+
+  def makeBatch(self, cases, output='output', **kwargs):
+    batch = BatchRunner(self.path('workflow.txt'), cases, self.path(output),
+                        runnerArguments=['--module-path', self.modulePath], **kwargs)
+    batch.pollInterval = 0.02
+    return batch
+
+  def readManifest(self, output='output'):
+    return json.loads(readFile(self.path(output, 'manifest.json')))
+
+  def test_run(self):
+    cases = [self.makeCase('a'), self.makeCase('b'), self.makeCase(os.path.join('other', 'a'))]
+    manifests = []
+    def caseFinished(case):
+      manifests.append(self.readManifest())
+    batch = self.makeBatch(cases, numberOfWorkers=2)
+    batch.run(caseFinished)
+    self.assertEqual([case.name for case in batch.cases], ['a', 'b', 'a-2'])
+    self.assertEqual([case.status for case in batch.cases], ['done', 'done', 'done'])
+    for case in batch.cases:
+      self.assertEqual(readFile(os.path.join(case.outputDirectory, 'result.txt')), 'a' if case.name != 'b' else 'b')
+      self.assertTrue(os.path.exists(os.path.join(case.outputDirectory, 'steps.json')))
+    # The manifest is replaced after every case, never left half written
+    self.assertEqual([manifest['counts']['done'] for manifest in manifests], [1, 2, 3])
+    self.assertEqual(self.readManifest()['counts']['done'], 3)
+    self.assertFalse(os.path.exists(self.path('output', 'manifest.json.tmp')))
+    f = open(self.path('output', 'timings.csv'), 'rb')
+    try:
+      rows = list(csv.reader(f))
+    finally:
+      f.close()
+    self.assertEqual([(row[0], row[4], row[7]) for row in rows[1:]], [('a', '1', 'done'), ('b', '1', 'done'), ('a-2', '1', 'done')])
+
+  def test_retry(self):
+    cases = [self.makeCase('flaky', 'failOnce'), self.makeCase('broken', 'fail')]
+    batch = self.makeBatch(cases, retries=1)
+    batch.run()
+    self.assertEqual([case.status for case in batch.cases], ['done', 'failed'])
+    self.assertEqual([attempt['status'] for attempt in batch.cases[0].attempts], ['failed', 'done'])
+    self.assertEqual([attempt['status'] for attempt in batch.cases[1].attempts], ['failed', 'failed'])
+    self.assertTrue(os.path.exists(self.path('output', 'flaky', 'log-2.txt')))
+
+  def test_timeout(self):
+    batch = self.makeBatch([self.makeCase('slow', 'sleep')], timeout=2.0)
+    batch.run()
+    case = batch.cases[0]
+    self.assertEqual(case.status, 'timeout')
+    self.assertTrue(case.attempts[0]['wallTime'] < 30.0)
+    # The CLI process started by the worker is killed with it
+    pid = int(readFile(os.path.join(case.outputDirectory, 'pid.txt')))
+    endTime = time.time() + 5.0
+    while processExists(pid) and time.time() < endTime:
+      time.sleep(0.05)
+    self.assertFalse(processExists(pid))
+
+  def test_resume(self):
+    cases = [self.makeCase('good'), self.makeCase('bad', 'fail')]
+    batch = self.makeBatch(cases)
+    batch.run()
+    self.assertEqual([case.status for case in batch.cases], ['done', 'failed'])
+    attempts = batch.cases[0].attempts
+
+    os.remove(self.path('cases', 'bad', 'fail'))
+    batch = self.makeBatch(cases)
+    batch.resume()
+    self.assertEqual([case.status for case in batch.cases], ['done', 'pending'])
+    batch.run()
+    self.assertEqual([case.status for case in batch.cases], ['done', 'done'])
+    # The done case was not run again
+    self.assertEqual(batch.cases[0].attempts, attempts)
+    self.assertFalse(os.path.exists(self.path('output', 'good', 'log-2.txt')))
+    self.assertEqual(self.readManifest()['counts']['done'], 2)
+
+  def test_resumeBrokenManifest(self):
+    batch = self.makeBatch([self.makeCase('a')])
+    os.makedirs(self.path('output'))
+    writeFile(self.path('output', 'manifest.json'), '{"cases": [')
+    batch.resume()
+    self.assertEqual(batch.cases[0].status, 'pending')
+
+#
+# Module metadata
+#
+cliDescription = '''<?xml version="1.0" encoding="utf-8"?>
+<executable>
+  <category>Registration.Specialized</category>
+  <title>Crop Volume</title>
+  <description><![CDATA[Crops a volume
+    to a region.]]></description>
+</executable>
+'''
+
+class ModuleMetadataTest(TemporaryDirectoryTestCase):
+  def test_scriptedModule(self):
+    fileName = self.path('Segmenter.py')
+    writeFile(fileName, '\n'.join([
+      "import os",
+      "open(%r, 'w').close()" % self.path('executed'),
+      "class Segmenter(ScriptedLoadableModule):",
+      "  def __init__(self, parent):",
+      "    self.parent.title = _('Segmenter')",
+      "    self.parent.categories = ['Segmentation', translate('qSlicerAbstractCoreModule', 'Examples')]",
+      "    parent.dependencies = computeDependencies()",
+      "class SegmenterWidget(ScriptedLoadableModuleWidget):",
+      "  def setup(self):",
+      "    self.parent.title = 'Not the module title'",
+      ""]))
+    metadata = extractModuleMetadata('scripted', 'Segmenter', fileName)
+    self.assertEqual(metadata, {'title': 'Segmenter', 'categories': ['Segmentation', 'Examples']})
+    # Parsed, never run
+    self.assertFalse(os.path.exists(self.path('executed')))
+
+  def test_cliDescriptionFile(self):
+    writeFile(self.path('libCropVolumeLib.so'), '')
+    writeFile(self.path('CropVolume.xml'), cliDescription)
+    metadata = extractModuleMetadata('cli', 'CropVolume', self.path('libCropVolumeLib.so'))
+    self.assertEqual(metadata, {'title': 'Crop Volume', 'categories': ['Registration.Specialized'],
+                                'description': 'Crops a volume to a region.'})
+
+  def test_cliEmbeddedDescription(self):
+    # The XML is compiled into the library as a string
+    description = cliDescription.split('\n', 1)[1]
+    writeFile(self.path('libCropVolumeLib.so'), '\x7fELF\x00\x01' + description + '\x00\x00binary')
+    metadata = extractModuleMetadata('cli', 'CropVolume', self.path('libCropVolumeLib.so'))
+    self.assertEqual(metadata['title'], 'Crop Volume')
+
+  def test_unreadable(self):
+    writeFile(self.path('Broken.py'), 'def broken(:\n')
+    writeFile(self.path('libBrokenLib.so'), '<executable><title>Broken</executable>')
+    writeFile(self.path('libEmptyLib.so'), '')
+    self.assertEqual(extractModuleMetadata('scripted', 'Broken', self.path('Broken.py')), {})
+    self.assertEqual(extractModuleMetadata('cli', 'Broken', self.path('libBrokenLib.so')), {})
+    self.assertEqual(extractModuleMetadata('cli', 'Empty', self.path('libEmptyLib.so')), {})
+    self.assertEqual(extractModuleMetadata('scripted', 'Missing', self.path('Missing.py')), {})
+    self.assertEqual(extractModuleMetadata('loadable', 'Volumes', self.path('libqSlicerVolumesModule.so')), {})
+
+#
+# ResourceRecorder
+#
+class ResourceRecorderTest(TemporaryDirectoryTestCase):
+  def test_sample(self):
+    recorder = ResourceRecorder()
+    recorder.sample('transition', 0, 'Data', 12)
+    timestamp, kind, step, module, rss, cpu, nodes = recorder.samples[0]
+    self.assertEqual((kind, step, module, nodes), ('transition', 0, 'Data', 12))
+    self.assertTrue(rss is None or rss > 0)
+    self.assertTrue(cpu >= 0.0)
+
+  def test_summary(self):
+    recorder = ResourceRecorder()
+    # (timestamp, kind, step, module, rss, cpuTime, nodes)
+    recorder.samples.extend([(0.0, 'transition', 0, 'Data', 100, 1.0, 10),
+                             (2.0, 'periodic', 0, 'Data', 150, 1.5, 12),
+                             (3.0, 'transition', 1, 'Segmentation', 400, 3.0, 40),
+                             (7.0, 'transition', 0, 'Data', 380, 3.5, 40),
+                             (8.0, 'transition', 1, 'Segmentation', None, 3.6, 41)])
+    summary = recorder.summary()
+    self.assertEqual([(s['step'], s['module'], s['visits']) for s in summary], [(0, 'Data', 2), (1, 'Segmentation', 2)])
+    data, segmentation = summary
+    # The usage up to the next sample is charged to the step of the first one
+    self.assertAlmostEqual(data['time'], 4.0)
+    self.assertAlmostEqual(data['cpuTime'], 2.1)
+    self.assertEqual(data['rssGrowth'], 300)
+    self.assertEqual(data['peakRSS'], 380)
+    self.assertAlmostEqual(segmentation['time'], 4.0)
+    self.assertEqual(segmentation['rssGrowth'], -20)
+    self.assertEqual(segmentation['peakNodes'], 41)
+
+  def test_export(self):
+    recorder = ResourceRecorder()
+    recorder.sample('transition', 0, 'Data', 1)
+    recorder.sample('periodic', 0, 'Data', 2)
+    recorder.export(self.path('case.json'), {'title': 'Biopsy'})
+    data = json.loads(readFile(self.path('case.json')))
+    self.assertEqual(data['case']['title'], 'Biopsy')
+    self.assertEqual([sample['kind'] for sample in data['timeline']], ['transition', 'periodic'])
+    self.assertEqual(data['summary'][0]['visits'], 1)
+    recorder.export(self.path('case.csv'))
+    f = open(self.path('case.csv'), 'rb')
+    try:
+      rows = list(csv.reader(f))
+    finally:
+      f.close()
+    self.assertEqual(tuple(rows[0]), ('elapsed',) + ResourceRecorder.fields)
+    self.assertEqual(len(rows), 3)
+    recorder.clear()
+    self.assertEqual(len(recorder.samples), 0)
+
+#
+# Remote navigation protocol
+#
+class RemoteProtocolTest(unittest.TestCase):
+  def test_parseCommand(self):
+    self.assertEqual(parseCommand('next\n'), ('next', ''))
+    self.assertEqual(parseCommand('GOTO  Needle placement \r\n'), ('goto', 'Needle placement'))
+    self.assertEqual(parseCommand('load /data/My Workflow.txt'), ('load', '/data/My Workflow.txt'))
+    for line in ('', '  \n', 'jump 3', 'goto', 'load '):
+      self.assertRaises(ValueError, parseCommand, line)
+
+  def test_stepReply(self):
+    self.assertEqual(stepReply(0, 'None'), 'ok 0 None')
+    self.assertEqual(stepReply(3, 'Volumes', 0.0013), 'ok 3 Volumes 1.3')
+    reply = stepReply(1, 'Data', 0.25, [(2, 'Nope'), (5, 'Other')])
+    self.assertEqual(reply, 'ok 1 Data 250.0 missing 2:Nope,5:Other')
+    self.assertEqual(parseStepReply(reply), (1, 'Data', 0.25, [(2, 'Nope'), (5, 'Other')]))
+    self.assertEqual(parseStepReply('ok 2 Volumes'), (2, 'Volumes', None, []))
+    self.assertEqual(parseStepReply(stepReply(1, 'Data', None, [(2, 'Nope')])), (1, 'Data', None, [(2, 'Nope')]))
+    self.assertRaises(ValueError, parseStepReply, 'error no step 9')
+
+  def test_client(self):
+    # A server answering every command with a step event and the reply
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    received = []
+    def serve():
+      connection = server.accept()[0]
+      f = connection.makefile('rb')
+      for i, line in enumerate(iter(f.readline, '')):
+        received.append(line.strip())
+        connection.sendall('step %d Volumes Volumes\n%s\n' % (i+1, stepReply(i+1, 'Volumes', 0.002)))
+      f.close()
+      connection.close()
+    thread = threading.Thread(target=serve)
+    thread.start()
+    client = RemoteClient(server.getsockname()[1])
+    try:
+      self.assertEqual(client.send('next'), 'ok 1 Volumes 2.0')
+      self.assertEqual(client.waitForEvent(), 'step 1 Volumes Volumes')
+      roundTripTimes, serverTimes = remoteBenchmark(client, 3)
+      self.assertEqual(serverTimes, [0.002] * 3)
+      self.assertEqual(len(roundTripTimes), 3)
+    finally:
+      client.close()
+      thread.join()
+      server.close()
+    self.assertEqual(received, ['next'] * 4)
+
+#
+# ModuleRegistry
+#
+class ModuleRegistryTest(unittest.TestCase):
+  def test_rows(self):
+    registry = ModuleRegistry()
+    registry.extend([('scripted', 'B', '/d1/B.py'), ('scripted', 'D', '/d1/D.py')], '/d1')
+    registry.extend([('cli', 'A', '/d2/A'), ('cli', 'B', '/d2/B')], '/d2')
+    self.assertEqual(registry.names, ['A', 'B', 'B', 'D'])
+    self.assertEqual(registry.row('B'), 1)
+    self.assertEqual(registry.row('C'), -1)
+    # The record added first wins
+    self.assertEqual(registry.get('B').path, '/d1/B.py')
+    self.assertEqual(registry.add('scripted', 'C', '/d1/C.py', '/d1'), 3)
+    self.assertEqual(sorted([record.name for record in registry.inDirectory('/d1')]), ['B', 'C', 'D'])
+
+  def test_remove(self):
+    registry = ModuleRegistry()
+    registry.extend([('scripted', 'B', '/d1/B.py')], '/d1')
+    registry.extend([('cli', 'B', '/d2/B')], '/d2')
+    self.assertEqual(registry.remove('scripted', 'B', '/d1/B.py'), 0)
+    self.assertEqual(registry.get('B').path, '/d2/B')
+    self.assertEqual(registry.inDirectory('/d1'), [])
+    self.assertEqual(registry.remove('scripted', 'B', '/d1/B.py'), -1)
+    self.assertEqual(registry.remove('cli', 'B', '/d2/B'), 0)
+    self.assertFalse('B' in registry)
+    self.assertEqual(len(registry), 0)
+    self.assertEqual(registry.ofKind('cli'), [])
+
+  def test_ofKind(self):
+    registry = ModuleRegistry()
+    registry.extend([('scripted', 'D', '/d1/D.py'), ('cli', 'C', '/d1/C')], '/d1')
+    registry.add('scripted', 'A', '/d1/A.py', '/d1')
+    self.assertEqual([record.name for record in registry.ofKind('scripted')], ['A', 'D'])
+    self.assertEqual([record.name for record in registry.ofKind('cli')], ['C'])
+    self.assertEqual(registry.ofKind('loadable'), [])
+
+#
+# Included workflows
+#
+class WorkflowIncludeTest(TemporaryDirectoryTestCase):
+  lines = ["<items>",
+           "<title>Biopsy</title>",
+           "# module name, label name and data files",
+           "<item>Data,Data</item>",
+           "<include>common/registration.txt,Registration</include>",
+           "<item>ResampleScalarVolume,Resample</item>",
+           "<args>--spacing 1,1,1 {case}/T2.nrrd {output}/T2iso.nrrd</args>",
+           "<after>Data;2</after>",
+           "</items>"]
+
+  def test_parse(self):
+    workflow = parseWorkflow(self.lines, '/tmp/wf')
+    self.assertEqual(len(workflow.includes), 1)
+    self.assertEqual(workflow.includes[0].fileName, '/tmp/wf/common/registration.txt')
+    self.assertEqual(workflow.includes[0].label, 'Registration')
+    self.assertEqual(workflow.includes[0].position, 1)
+    self.assertTrue(isinstance(workflow.entries()[1], WorkflowInclude))
+
+  def test_roundTrip(self):
+    workflow = parseWorkflow(self.lines, '/tmp/wf')
+    self.assertEqual(formatWorkflow(workflow, '/tmp/wf').split('\n'), self.lines)
+    lines = formatWorkflow(workflow, '/tmp/other').split('\n')
+    self.assertTrue('<include>../wf/common/registration.txt,Registration</include>' in lines)
+
+  def test_validationCountsIncludes(self):
+    workflow = parseWorkflow(self.lines + ["<item>Volume,Typo</item>"], '/tmp/wf')
+    missingSteps = validateWorkflow(workflow, set(['Data', 'ResampleScalarVolume']))
+    self.assertEqual(missingSteps, [(3, 'Volume', [])])
+
+  def test_expand(self):
+    os.mkdir(self.path('common'))
+    writeFile(self.path('common', 'registration.txt'),
+              "<items>\n<item>BRAINSFit,Register</item>\n<item>ResampleScalarVectorDWIVolume,Warp</item>\n"
+              "<after>1</after>\n</items>\n")
+    writeFile(self.path('main.txt'), '\n'.join(self.lines))
+    cache = WorkflowCache()
+    workflow = expandWorkflow(readWorkflowFile(self.path('main.txt')), cache)
+    self.assertEqual([step.label for step in workflow.steps], ['Data', 'Register', 'Warp', 'Resample'])
+    # The step numbers of the included file are renumbered
+    self.assertEqual(workflow.steps[2].after, ['2'])
+    self.assertEqual(workflow.steps[3].after, ['Data', '2'])
+    expandWorkflow(readWorkflowFile(self.path('main.txt')), cache)
+    self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+  def test_cycle(self):
+    writeFile(self.path('a.txt'), "<items>\n<include>b.txt</include>\n</items>\n")
+    writeFile(self.path('b.txt'), "<items>\n<item>Data,Data</item>\n<include>a.txt</include>\n</items>\n")
+    self.assertRaises(ValueError, expandWorkflow, readWorkflowFile(self.path('a.txt')))
+
+#
+# BackgroundFileWriter
+#
+class BackgroundFileWriterTest(TemporaryDirectoryTestCase):
+  def test_writeFileAtomically(self):
+    fileName = self.path('workflow.txt')
+    writeFileAtomically(fileName, u'<title>R\xe9section</title>')
+    self.assertEqual(readFile(fileName), '<title>R\xc3\xa9section</title>')
+    self.assertFalse(os.path.exists(fileName + '.tmp'))
+
+  def test_latestTextWins(self):
+    writer = BackgroundFileWriter()
+    fileName = self.path('autosave.txt')
+    for i in xrange(0, 50):
+      writer.save(fileName, 'version %d' % i)
+    self.assertTrue(writer.flush(10.0))
+    self.assertEqual(readFile(fileName), 'version 49')
+    self.assertTrue(1 <= writer.numberOfWrites <= 50)
+    self.assertEqual(writer.lastError, None)
+    self.assertFalse(writer.isBusy())
+
+  def test_remove(self):
+    writer = BackgroundFileWriter()
+    fileName = self.path('autosave.txt')
+    writer.save(fileName, 'text')
+    writer.remove(fileName)
+    self.assertTrue(writer.flush(10.0))
+    self.assertFalse(os.path.exists(fileName))
+
+  def test_error(self):
+    writer = BackgroundFileWriter()
+    writer.save(self.path('missing', 'autosave.txt'), 'text')
+    self.assertTrue(writer.flush(10.0))
+    self.assertNotEqual(writer.lastError, None)
+    # The writer keeps working after an error
+    writer.save(self.path('autosave.txt'), 'text')
+    self.assertTrue(writer.flush(10.0))
+    self.assertEqual(writer.lastError, None)
+
+#
+# StartupProfile
+#
+class StartupProfileTest(TemporaryDirectoryTestCase):
+  def makeProfile(self, **kwargs):
+    registry = ModuleRegistry()
+    registry.extend([('loadable', 'Volumes', '/m/libqSlicerVolumesModule.so'),
+                     ('loadable', 'Sequences', '/m/libqSlicerSequencesModule.so'),
+                     ('scripted', 'Segmenter', '/m/Segmenter.py'), ('scripted', 'Helpers', '/m/Helpers.py'),
+                     ('scripted', 'Unused', '/m/Unused.py'), ('cli', 'Resample', '/m/Resample')])
+    metadata = {'Segmenter': {'title': 'Segmenter', 'dependencies': ['Helpers']},
+                'Helpers': {'dependencies': ['Volumes']}, 'Unused': {'dependencies': ['Resample']}}
+    workflow = Workflow('Biopsy', [WorkflowStep('Segmenter', 'Segment'), WorkflowStep('Nope', 'Missing')])
+    return StartupProfile(workflow, registry, metadata, **kwargs)
+
+  def test_moduleClosure(self):
+    dependencies = {'A': ['B'], 'B': ['C', 'A'], 'D': ['E']}
+    self.assertEqual(moduleClosure(['A'], dependencies), set(['A', 'B', 'C']))
+    self.assertEqual(moduleClosure(['D', 'X'], dependencies), set(['D', 'E', 'X']))
+    self.assertEqual(moduleClosure([], dependencies), set())
+
+  def test_profile(self):
+    profile = self.makeProfile(keep=('Resample',))
+    self.assertEqual(profile.workflowModules, ['Nope', 'Segmenter'])
+    self.assertEqual(profile.missingModules, ['Nope'])
+    # The dependencies of the steps, and all the loadable modules
+    self.assertEqual(profile.loadedModules, ['Helpers', 'Resample', 'Segmenter', 'Sequences', 'Volumes'])
+    self.assertEqual(profile.ignoredModules, ['Unused'])
+    self.assertEqual(profile.arguments(), ['--modules-to-ignore', 'Unused'])
+    profile = self.makeProfile(keepKinds=(), keep=())
+    self.assertEqual(profile.ignoredModules, ['Resample', 'Sequences', 'Unused'])
+
+  def test_write(self):
+    profile = self.makeProfile(keep=())
+    fileNames = profile.write(self.path('biopsy'), '/opt/Slicer/Slicer')
+    self.assertEqual([os.path.basename(fileName) for fileName in fileNames],
+                     ['biopsy.json', 'biopsy.bat' if os.name == 'nt' else 'biopsy.sh'])
+    data = json.loads(readFile(fileNames[0]))
+    self.assertEqual(data['ignoredModules'], ['Resample', 'Unused'])
+    self.assertEqual(data['installedModules'], 6)
+    self.assertTrue('--modules-to-ignore' in readFile(fileNames[1]))
+
+  def test_startupReport(self):
+    report = startupReport({'full': [10.0, 12.0, 11.0], 'profile': [6.0, 5.0, 7.0]})
+    self.assertEqual(report, 'Startup time: 11.0 s with all the modules, 6.0 s with the profile (5.0 s, 45% less)')
+
+  @unittest.skipIf(os.name == 'nt', 'the launch script is a .bat file')
+  def test_launchScriptQuoting(self):
+    # A fake Slicer printing its arguments
+    slicerExecutable = self.path('Slicer')
+    writeFile(slicerExecutable, '#!%s\nimport sys\nprint(repr(sys.argv[1:]))\n' % sys.executable)
+    os.chmod(slicerExecutable, 0o755)
+    workflowFileName = self.path("Dr O'Brien's $HOME `date` \"biopsy\".txt")
+    workflow = Workflow('Biopsy', [WorkflowStep('Volumes', 'Volumes')])
+    registry = ModuleRegistry()
+    registry.extend([('scripted', 'Unused', '/m/Unused.py'), ('scripted', 'Volumes', '/m/Volumes.py')])
+    profile = StartupProfile(workflow, registry, {}, keep=())
+    scriptFileName = self.path('profile.sh')
+    profile.writeLaunchScript(scriptFileName, slicerExecutable, workflowFileName)
+    arguments = ast.literal_eval(subprocess.check_output(['/bin/sh', scriptFileName, '--no-splash']).strip())
+    self.assertEqual(arguments[0:2], ['--modules-to-ignore', 'Unused'])
+    self.assertEqual(arguments[-1], '--no-splash')
+    code = ast.parse(arguments[arguments.index('--python-code') + 1])
+    loadCall = code.body[-1].value
+    self.assertEqual(loadCall.func.attr, 'loadWorkflowFile')
+    self.assertEqual(ast.literal_eval(loadCall.args[0]), workflowFileName)
+
+if __name__ == '__main__':
+  unittest.main()
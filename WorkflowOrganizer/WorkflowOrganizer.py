@@ -1,14 +1,24 @@
 import os
-import unittest
 import os.path
 import platform
+import time
+import collections
+importStartTime = time.time()
 from __main__ import vtk, qt, ctk, slicer
+from WorkflowOrganizerLib import ModuleIndexCache, ModuleDiscovery, ModuleRegistry, ModuleSearchIndex, Workflow, WorkflowStep, WorkflowInclude, WorkflowCache, includeEntries, expandWorkflow, readWorkflowFile, formatHeader, formatEntry, validateWorkflow, WorkflowLibrary, TransitionRecorder, ResourceRecorder, DataPrefetcher, BackgroundFileWriter
+from WorkflowOrganizerLib.Workflow import autosaveSuffix
+from WorkflowOrganizerLib.Instrumentation import percentile
 
 #
 # WorkflowOrganizer
 #
+# Time spent in the import of this file, WorkflowOrganizer.__init__, setup()
+# and the module discovery, in seconds; see WorkflowOrganizerWidget.startupReport().
+startupTimings = {}
+
 class WorkflowOrganizer:
   def __init__(self, parent):
+    startTime = time.time()
     parent.title = "WorkflowOrganizer" # TODO make this more human readable by adding spaces
     parent.categories = ["IGT"]
     parent.dependencies = []
@@ -29,6 +39,7 @@ class WorkflowOrganizer:
     except AttributeError:
       slicer.selfTests = {}
     slicer.selfTests['WorkflowOrganizer'] = self.runTest
+    startupTimings['module'] = time.time() - startTime
 
   def runTest(self):
     tester = WorkflowOrganizerTest()
@@ -37,16 +48,47 @@ class WorkflowOrganizer:
 #
 # qWorkflowOrganizerWidget
 #
-class ModuleListProperty:
-  module = ''
-  label = ''
-  number = ''
-
-class ModuleButtonProperty:
-  module = ''
-  label = ''
-  handler = None
-  button = None
+class ModuleItem(object):
+  # One selector of the item list, with the loaded step it came from and
+  # the module it waits for while the discovery has not found it yet. An
+  # included workflow is shown by a label instead of a selector. 'changed'
+  # is set once the user picks a module in the selector. 'lines' caches
+  # ((module name, directory), lines of the workflow file) for makeFile().
+  __slots__ = ('selector', 'step', 'pendingModule', 'include', 'changed', 'lines')
+
+  def __init__(self, selector, step=None, include=None):
+    self.selector = selector
+    self.step = step
+    self.pendingModule = None
+    self.include = include
+    self.changed = False
+    self.lines = None
+
+class ModuleButtonProperty(object):
+  # One step of the dock panel, or a segment standing for the steps of an
+  # included workflow until it is expanded (module is None). 'label' is the
+  # text of the button, 'name' the untruncated label of the step or include.
+  __slots__ = ('module', 'label', 'name', 'data', 'index', 'handler', 'button', 'include')
+
+  def __init__(self, module='', label='', data=(), include=None, name=None):
+    self.module = module
+    self.label = label
+    self.name = name if name is not None else label
+    self.data = data
+    self.index = 0
+    self.handler = None
+    self.button = None
+    self.include = include
+
+class DockButtonRow:
+  # One row of step buttons in the dock panel. Rows are recycled when the
+  # list of steps changes.
+  def __init__(self, parent):
+    self.frame = qt.QFrame(parent)
+    self.frame.setFrameStyle(qt.QFrame.NoFrame)
+    self.layout = qt.QHBoxLayout()
+    self.frame.setLayout(self.layout)
+    self.modules = []
 
 class WorkflowOrganizerWidget:
 
@@ -63,6 +105,7 @@ class WorkflowOrganizerWidget:
       self.parent.show()
 
   def setup(self):
+    setupStartTime = time.time()
     # if this import is at top of the source, the loading could not work well.
     #import glob 
     # Instantiate and connect widgets ...
@@ -109,6 +152,11 @@ class WorkflowOrganizerWidget:
     self.aboutItemListFrame.setLayout(self.aboutItemLayout)
     self.configurationFormLayout.addRow("Item List:", self.aboutItemListFrame)
 
+    self.aboutLibraryFrame = qt.QFrame()
+    self.aboutLibraryLayout = qt.QHBoxLayout()
+    self.aboutLibraryFrame.setLayout(self.aboutLibraryLayout)
+    self.configurationFormLayout.addRow("Library:", self.aboutLibraryFrame)
+
     self.aboutOperationFrame = qt.QFrame()
     self.aboutOperationLayout = qt.QHBoxLayout()
     self.aboutOperationFrame.setLayout(self.aboutOperationLayout)
@@ -119,11 +167,56 @@ class WorkflowOrganizerWidget:
     self.aboutPanelFrame.setLayout(self.aboutPanelLayout)
     self.configurationFormLayout.addRow("Wizard Panel:", self.aboutPanelFrame)
 
+    self.aboutModuleIndexFrame = qt.QFrame()
+    self.aboutModuleIndexLayout = qt.QHBoxLayout()
+    self.aboutModuleIndexFrame.setLayout(self.aboutModuleIndexLayout)
+    self.configurationFormLayout.addRow("Module Index:", self.aboutModuleIndexFrame)
+
+    self.aboutPrefetchFrame = qt.QFrame()
+    self.aboutPrefetchLayout = qt.QHBoxLayout()
+    self.aboutPrefetchFrame.setLayout(self.aboutPrefetchLayout)
+    self.configurationFormLayout.addRow("Prefetch:", self.aboutPrefetchFrame)
+
+    self.aboutDataPrefetchFrame = qt.QFrame()
+    self.aboutDataPrefetchLayout = qt.QHBoxLayout()
+    self.aboutDataPrefetchFrame.setLayout(self.aboutDataPrefetchLayout)
+    self.configurationFormLayout.addRow("Data Prefetch:", self.aboutDataPrefetchFrame)
+
+    self.aboutRemoteFrame = qt.QFrame()
+    self.aboutRemoteLayout = qt.QHBoxLayout()
+    self.aboutRemoteFrame.setLayout(self.aboutRemoteLayout)
+    self.configurationFormLayout.addRow("Remote Control:", self.aboutRemoteFrame)
+
+    self.aboutAutosaveFrame = qt.QFrame()
+    self.aboutAutosaveLayout = qt.QHBoxLayout()
+    self.aboutAutosaveFrame.setLayout(self.aboutAutosaveLayout)
+    self.configurationFormLayout.addRow("Autosave:", self.aboutAutosaveFrame)
+
+    self.aboutStartupProfileFrame = qt.QFrame()
+    self.aboutStartupProfileLayout = qt.QHBoxLayout()
+    self.aboutStartupProfileFrame.setLayout(self.aboutStartupProfileLayout)
+    self.configurationFormLayout.addRow("Startup Profile:", self.aboutStartupProfileFrame)
+
     # Load File button
     self.fileReadButton = qt.QPushButton("Load")
     self.aboutItemListFrame.layout().addWidget(self.fileReadButton)
     self.fileReadButton.connect('clicked()', self.onLoad)
 
+    # Workflow library
+    self.libraryButton = qt.QPushButton("Open Library")
+    self.libraryButton.toolTip = "Select a directory of workflow files."
+    self.aboutLibraryFrame.layout().addWidget(self.libraryButton)
+    self.libraryButton.connect('clicked()', self.onLibraryButton)
+    self.librarySelector = qt.QComboBox()
+    self.librarySelector.enabled = False
+    self.librarySelector.setSizeAdjustPolicy(qt.QComboBox.AdjustToContents)
+    self.aboutLibraryFrame.layout().addWidget(self.librarySelector)
+    self.librarySelector.connect('activated(int)', self.onLibraryWorkflowSelected)
+    self.libraryRefreshButton = qt.QPushButton("Refresh")
+    self.libraryRefreshButton.enabled = False
+    self.aboutLibraryFrame.layout().addWidget(self.libraryRefreshButton)
+    self.libraryRefreshButton.connect('clicked()', self.updateLibraryCatalog)
+
     # Save Extension List button
     self.saveExtensionListButton = qt.QPushButton("Save")
     self.saveExtensionListButton.enabled = False
@@ -154,6 +247,103 @@ class WorkflowOrganizerWidget:
     self.aboutOperationFrame.layout().addWidget(self.removeButton)
     self.removeButton.connect('clicked()', self.onRemoveButton)
 
+    # Category filter of the selectors, filled from the module metadata
+    self.categorySelector = qt.QComboBox()
+    self.categorySelector.addItem("All categories")
+    self.categorySelector.toolTip = "Only list the modules of this category in the selectors. Loadable modules have no category."
+    self.aboutOperationFrame.layout().addWidget(self.categorySelector)
+    self.categorySelector.connect('currentIndexChanged(int)', self.onCategoryChanged)
+
+    # Module index status and Rebuild Index button
+    self.moduleIndexStatusLabel = qt.QLabel("")
+    self.aboutModuleIndexFrame.layout().addWidget(self.moduleIndexStatusLabel)
+    self.rebuildIndexButton = qt.QPushButton("Rebuild Index")
+    self.rebuildIndexButton.toolTip = "Discard the cached module index and rescan all module directories."
+    self.aboutModuleIndexFrame.layout().addWidget(self.rebuildIndexButton)
+    self.rebuildIndexButton.connect('clicked()', self.onRebuildIndexButton)
+
+    # Prefetch of the module widgets of the next steps
+    self.prefetchCheckBox = qt.QCheckBox("Enable")
+    self.prefetchCheckBox.checked = False
+    self.prefetchCheckBox.toolTip = "Create the widgets of the upcoming steps while the application is idle."
+    self.aboutPrefetchFrame.layout().addWidget(self.prefetchCheckBox)
+    self.prefetchCheckBox.connect('toggled(bool)', self.onPrefetchToggled)
+    self.aboutPrefetchFrame.layout().addWidget(qt.QLabel("Lookahead:"))
+    self.prefetchDepthSpinBox = qt.QSpinBox()
+    self.prefetchDepthSpinBox.minimum = 1
+    self.prefetchDepthSpinBox.maximum = 5
+    self.prefetchDepthSpinBox.value = 1
+    self.aboutPrefetchFrame.layout().addWidget(self.prefetchDepthSpinBox)
+    self.prefetchBackwardCheckBox = qt.QCheckBox("Previous steps")
+    self.prefetchBackwardCheckBox.checked = False
+    self.aboutPrefetchFrame.layout().addWidget(self.prefetchBackwardCheckBox)
+    self.aboutPrefetchFrame.layout().addWidget(qt.QLabel("Budget (ms):"))
+    self.prefetchBudgetSpinBox = qt.QSpinBox()
+    self.prefetchBudgetSpinBox.minimum = 10
+    self.prefetchBudgetSpinBox.maximum = 5000
+    self.prefetchBudgetSpinBox.value = 100
+    self.prefetchBudgetSpinBox.toolTip = "A step whose widget takes longer than this to create delays the next prefetch until the application is idle again."
+    self.aboutPrefetchFrame.layout().addWidget(self.prefetchBudgetSpinBox)
+
+    # Prefetch of the data files declared by the steps
+    self.dataPrefetchCheckBox = qt.QCheckBox("Enable")
+    self.dataPrefetchCheckBox.checked = True
+    self.dataPrefetchCheckBox.toolTip = "Read the data files of the upcoming steps in the background."
+    self.aboutDataPrefetchFrame.layout().addWidget(self.dataPrefetchCheckBox)
+    self.dataPrefetchCheckBox.connect('toggled(bool)', self.onDataPrefetchToggled)
+    self.aboutDataPrefetchFrame.layout().addWidget(qt.QLabel("Threads:"))
+    self.dataPrefetchThreadsSpinBox = qt.QSpinBox()
+    self.dataPrefetchThreadsSpinBox.minimum = 1
+    self.dataPrefetchThreadsSpinBox.maximum = 8
+    self.dataPrefetchThreadsSpinBox.value = 2
+    self.aboutDataPrefetchFrame.layout().addWidget(self.dataPrefetchThreadsSpinBox)
+    self.aboutDataPrefetchFrame.layout().addWidget(qt.QLabel("Memory (MB):"))
+    self.dataPrefetchMemorySpinBox = qt.QSpinBox()
+    self.dataPrefetchMemorySpinBox.minimum = 64
+    self.dataPrefetchMemorySpinBox.maximum = 65536
+    self.dataPrefetchMemorySpinBox.value = 2048
+    self.dataPrefetchMemorySpinBox.toolTip = "Data read ahead of the current step, not yet loaded into the scene."
+    self.aboutDataPrefetchFrame.layout().addWidget(self.dataPrefetchMemorySpinBox)
+    self.dataPrefetchStatusLabel = qt.QLabel("")
+    self.aboutDataPrefetchFrame.layout().addWidget(self.dataPrefetchStatusLabel)
+
+    # Navigation commands from a local socket, e.g. a foot pedal
+    self.remoteCheckBox = qt.QCheckBox("Enable")
+    self.remoteCheckBox.checked = False
+    self.remoteCheckBox.toolTip = "Accept next, back, goto and load commands on a local socket. See WorkflowOrganizerLib/Remote.py."
+    self.aboutRemoteFrame.layout().addWidget(self.remoteCheckBox)
+    self.aboutRemoteFrame.layout().addWidget(qt.QLabel("Address:"))
+    self.remoteAddressLineEdit = qt.QLineEdit("18950")
+    self.remoteAddressLineEdit.toolTip = "TCP port on 127.0.0.1, or name of a local socket."
+    self.aboutRemoteFrame.layout().addWidget(self.remoteAddressLineEdit)
+    self.remoteStatusLabel = qt.QLabel("")
+    self.aboutRemoteFrame.layout().addWidget(self.remoteStatusLabel)
+
+    # Autosave of the item list, next to the workflow file
+    self.autosaveCheckBox = qt.QCheckBox("Enable")
+    self.autosaveCheckBox.checked = False
+    self.autosaveCheckBox.toolTip = "Save the item list in the background a moment after each change, next to the workflow file (%s)." % autosaveSuffix
+    self.aboutAutosaveFrame.layout().addWidget(self.autosaveCheckBox)
+    self.autosaveRestoreButton = qt.QPushButton("Restore")
+    self.autosaveRestoreButton.toolTip = "Load the autosaved item list of an unsaved workflow."
+    self.autosaveRestoreButton.enabled = False
+    self.aboutAutosaveFrame.layout().addWidget(self.autosaveRestoreButton)
+    self.autosaveRestoreButton.connect('clicked()', self.onAutosaveRestoreButton)
+    self.autosaveStatusLabel = qt.QLabel("")
+    self.aboutAutosaveFrame.layout().addWidget(self.autosaveStatusLabel)
+
+    # Launch script starting Slicer with only the modules of the workflow
+    self.startupProfileButton = qt.QPushButton("Create...")
+    self.startupProfileButton.toolTip = "Write a launch script starting Slicer with only the modules the item list needs."
+    self.aboutStartupProfileFrame.layout().addWidget(self.startupProfileButton)
+    self.startupProfileButton.connect('clicked()', self.onStartupProfileButton)
+    self.startupProfileMeasureCheckBox = qt.QCheckBox("Measure startup")
+    self.startupProfileMeasureCheckBox.checked = False
+    self.startupProfileMeasureCheckBox.toolTip = "Start Slicer 3 times with and without the profile and compare the startup times."
+    self.aboutStartupProfileFrame.layout().addWidget(self.startupProfileMeasureCheckBox)
+    self.startupProfileStatusLabel = qt.QLabel("")
+    self.aboutStartupProfileFrame.layout().addWidget(self.startupProfileStatusLabel)
+
     # Wizard title edit box
     self.wizardTitleCollapsibleButton = ctk.ctkCollapsibleButton()
     self.wizardTitleCollapsibleButton.text = "Title"
@@ -178,144 +368,557 @@ class WorkflowOrganizerWidget:
     # Layout within the collapsible button
     self.extensionFormLayout = qt.QFormLayout(self.extensionCollapsibleButton)
 
+    # Step transition timing
+    self.timingCollapsibleButton = ctk.ctkCollapsibleButton()
+    self.timingCollapsibleButton.text = "Step Timing"
+    self.timingCollapsibleButton.collapsed = True
+    self.layout.addWidget(self.timingCollapsibleButton)
+    self.timingLayout = qt.QVBoxLayout(self.timingCollapsibleButton)
+    self.timingCollapsibleButton.connect('contentsCollapsed(bool)', self.onTimingCollapsed)
+
+    self.timingTable = qt.QTableWidget()
+    self.timingTable.setColumnCount(5)
+    self.timingTable.setHorizontalHeaderLabels(["Module", "Count", "p50 (ms)", "p95 (ms)", "Max (ms)"])
+    self.timingTable.toolTip = "Time from the step change until the application is idle again."
+    self.timingTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+    self.timingLayout.addWidget(self.timingTable)
+
+    self.timingButtonFrame = qt.QFrame()
+    self.timingButtonLayout = qt.QHBoxLayout()
+    self.timingButtonFrame.setLayout(self.timingButtonLayout)
+    self.timingLayout.addWidget(self.timingButtonFrame)
+    self.timingRefreshButton = qt.QPushButton("Refresh")
+    self.timingButtonLayout.addWidget(self.timingRefreshButton)
+    self.timingRefreshButton.connect('clicked()', self.updateTimingTable)
+    self.timingExportButton = qt.QPushButton("Export")
+    self.timingExportButton.toolTip = "Save the transitions as CSV, or as JSON if the file name ends with .json."
+    self.timingButtonLayout.addWidget(self.timingExportButton)
+    self.timingExportButton.connect('clicked()', self.onTimingExportButton)
+    self.timingClearButton = qt.QPushButton("Clear")
+    self.timingButtonLayout.addWidget(self.timingClearButton)
+    self.timingClearButton.connect('clicked()', self.onTimingClearButton)
+
+    # Resource usage of the steps
+    self.resourceCollapsibleButton = ctk.ctkCollapsibleButton()
+    self.resourceCollapsibleButton.text = "Step Resources"
+    self.resourceCollapsibleButton.collapsed = True
+    self.layout.addWidget(self.resourceCollapsibleButton)
+    self.resourceLayout = qt.QVBoxLayout(self.resourceCollapsibleButton)
+    self.resourceCollapsibleButton.connect('contentsCollapsed(bool)', self.onResourceCollapsed)
+
+    self.resourceTable = qt.QTableWidget()
+    self.resourceTable.setColumnCount(8)
+    self.resourceTable.setHorizontalHeaderLabels(["Step", "Module", "Visits", "Time (s)", "CPU (s)", "RSS growth (MB)", "Peak RSS (MB)", "Peak nodes"])
+    self.resourceTable.toolTip = "Resource usage while each step was active, since the case was started (Clear)."
+    self.resourceTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+    self.resourceLayout.addWidget(self.resourceTable)
+
+    self.resourceButtonFrame = qt.QFrame()
+    self.resourceButtonLayout = qt.QHBoxLayout()
+    self.resourceButtonFrame.setLayout(self.resourceButtonLayout)
+    self.resourceLayout.addWidget(self.resourceButtonFrame)
+    self.resourcePeriodicCheckBox = qt.QCheckBox("Sample every")
+    self.resourcePeriodicCheckBox.checked = False
+    self.resourcePeriodicCheckBox.toolTip = "Also sample while a step is active, not only when it is entered."
+    self.resourceButtonLayout.addWidget(self.resourcePeriodicCheckBox)
+    self.resourcePeriodicCheckBox.connect('toggled(bool)', self.onResourcePeriodicToggled)
+    self.resourceIntervalSpinBox = qt.QSpinBox()
+    self.resourceIntervalSpinBox.minimum = 1
+    self.resourceIntervalSpinBox.maximum = 600
+    self.resourceIntervalSpinBox.value = 10
+    self.resourceIntervalSpinBox.suffix = " s"
+    self.resourceButtonLayout.addWidget(self.resourceIntervalSpinBox)
+    self.resourceIntervalSpinBox.connect('valueChanged(int)', self.onResourceIntervalChanged)
+    self.resourceRefreshButton = qt.QPushButton("Refresh")
+    self.resourceButtonLayout.addWidget(self.resourceRefreshButton)
+    self.resourceRefreshButton.connect('clicked()', self.updateResourceTable)
+    self.resourceExportButton = qt.QPushButton("Export")
+    self.resourceExportButton.toolTip = "Save the timeline of the case as CSV, or as JSON with the per-step summary if the file name ends with .json."
+    self.resourceButtonLayout.addWidget(self.resourceExportButton)
+    self.resourceExportButton.connect('clicked()', self.onResourceExportButton)
+    self.resourceClearButton = qt.QPushButton("Clear")
+    self.resourceClearButton.toolTip = "Start a new case."
+    self.resourceButtonLayout.addWidget(self.resourceClearButton)
+    self.resourceClearButton.connect('clicked()', self.onResourceClearButton)
+
     #
-    # Dock Panel
+    # Dock Panel, created by the first Apply or Load
     #
-    self.createDockPanel()
+    self.dockPanel = None
+    self.modules = []
 
     # Add vertical spacer
     self.layout.addStretch(1)
 
-    self.extensionSelector = {}
-    self.installedExtensionName = {}
-    self.selectedItem = {}
+    self.items = []
 
     self.currentModuleId = 0
-    self.numberOfModule = 0
-    self.numberOfExtention = 0
-    self.numberOfExtentionList = 0
-    self.loadFileFlag = 0
+    self.lastLoadTimings = {}
     self.numberOfLabelText = 15
     self.itemsOnOneLine = 3
 
+    self.moduleListModel = qt.QStringListModel()
+    # The selectors show the modules of the selected category through a
+    # proxy, which is filtered once for all of them.
+    self.moduleProxyModel = qt.QSortFilterProxyModel()
+    self.moduleProxyModel.setSourceModel(self.moduleListModel)
+    self.moduleMatchModel = qt.QStringListModel()
+    self.moduleSearch = None
+    self.moduleSearchThread = None
+    self.moduleRegistry = ModuleRegistry()
+    self.moduleMetadata = {}
+    self.moduleCategoryNames = {}
+    self.categoryFilterApplied = False
+    self.moduleFilterNames = set()
+    self.updateModuleList()
+    self.pendingValidation = None
+    self.discovery = None
+    self.moduleScanRunning = False
+    self.discoveryTimer = qt.QTimer()
+    self.discoveryTimer.setInterval(50)
+    self.discoveryTimer.connect('timeout()', self.onDiscoveryTimer)
+
+    self.moduleDirectoryKinds = {}
+    self.changedModuleDirectories = set()
+    self.moduleSettingsChanged = False
+    self.moduleWatcher = qt.QFileSystemWatcher()
+    self.moduleWatcher.connect('directoryChanged(QString)', self.onModuleDirectoryChanged)
+    self.moduleWatcher.connect('fileChanged(QString)', self.onModuleSettingsChanged)
+    self.moduleWatchTimer = qt.QTimer()
+    self.moduleWatchTimer.setSingleShot(True)
+    self.moduleWatchTimer.setInterval(1000)
+    self.moduleWatchTimer.connect('timeout()', self.onModuleWatchTimer)
+
+    self.library = None
+    # Included workflows, parsed once for all the workflows including them
+    self.workflowCache = WorkflowCache()
+    self.libraryCatalog = []
+
+    self.prefetcher = ModuleWidgetPrefetcher()
+    self.dataPrefetcher = DataPrefetcher()
+    self.loadedDataNodes = {}
+    self.dataPrefetchTimer = qt.QTimer()
+    self.dataPrefetchTimer.setInterval(250)
+    self.dataPrefetchTimer.connect('timeout()', self.updateDataPrefetchStatus)
+    self.transitionRecorder = TransitionRecorder()
+    self.pendingTransitions = []
+    self.resourceRecorder = ResourceRecorder()
+    self.resourceTimer = qt.QTimer()
+    self.resourceTimer.setInterval(self.resourceIntervalSpinBox.value * 1000)
+    self.resourceTimer.connect('timeout()', self.onResourceTimer)
+    self.activeStep = None
+
+    self.moduleIndexCache = ModuleIndexCache(self.moduleIndexCacheFileName())
     self.makeExtensionList()
 
-  def makeExtensionList(self):
-    import glob
+    libraryPath = qt.QSettings().value("WorkflowOrganizer/LibraryPath")
+    if libraryPath and os.path.isdir(libraryPath):
+      self.openLibrary(libraryPath)
+
+    self.navigationServer = NavigationServer(self)
+    remoteAddress = qt.QSettings().value("WorkflowOrganizer/RemoteAddress")
+    if remoteAddress:
+      self.remoteAddressLineEdit.text = remoteAddress
+    self.remoteCheckBox.checked = qt.QSettings().value("WorkflowOrganizer/RemoteEnabled") in (True, 'true')
+    self.remoteCheckBox.connect('toggled(bool)', self.onRemoteToggled)
+    self.remoteAddressLineEdit.connect('editingFinished()', self.onRemoteAddressChanged)
+    if self.remoteCheckBox.checked:
+      self.onRemoteToggled(True)
+
+    self.workflowFileName = None
+    self.fileWriter = BackgroundFileWriter()
+    self.autosaveText = None
+    self.autosaveTimer = qt.QTimer()
+    self.autosaveTimer.setSingleShot(True)
+    self.autosaveTimer.setInterval(1000)
+    self.autosaveTimer.connect('timeout()', self.autosave)
+    self.autosaveStatusTimer = qt.QTimer()
+    self.autosaveStatusTimer.setInterval(200)
+    self.autosaveStatusTimer.connect('timeout()', self.updateAutosaveStatus)
+    self.autosaveCheckBox.checked = qt.QSettings().value("WorkflowOrganizer/Autosave") in (True, 'true')
+    self.autosaveCheckBox.connect('toggled(bool)', self.onAutosaveToggled)
+    self.autosaveRestoreButton.enabled = os.path.exists(self.autosaveFileName())
+
+    self.startupProfileEvents = None
+    self.startupProfileTimer = qt.QTimer()
+    self.startupProfileTimer.setInterval(250)
+    self.startupProfileTimer.connect('timeout()', self.onStartupProfileTimer)
+
+    startupTimings['setup'] = time.time() - setupStartTime
+
+  def moduleIndexCacheFileName(self):
+    settingsPath = os.path.dirname(slicer.app.slicerRevisionUserSettingsFilePath)
+    return os.path.join(settingsPath, 'WorkflowOrganizerModuleIndex.json')
 
+  def makeExtensionList(self):
+    """Start the module discovery on a background thread. The selectors are
+    refilled from onDiscoveryTimer() as the module directories are scanned.
+    """
     self.scriptPath = __file__
 
-    pathFlag = 0
-    appPath = ""
-    for i in xrange(0, 500):
-      if(self.scriptPath.find('/bin', 0, i) != -1 and pathFlag == 0):
-        appPath = self.scriptPath[:i-4]
-        pathFlag = 1
+    binLocation = self.scriptPath.find('/bin')
+    appPath = self.scriptPath[:binLocation] if binLocation != -1 else ""
 
     # check platform
     platformName = platform.system()
     print("platform =")
     print(platformName)
 
-    if(platformName == 'Darwin'):
-      loadableModulePath = appPath + "/lib/Slicer*/qt-loadable-modules/*Module.dylib" 
-      cliModulePath = appPath + "/lib/Slicer*/cli-modules/*Lib.dylib"
-    if(platformName == 'Windows'):
-      loadableModulePath = appPath + "/lib/Slicer*/qt-loadable-modules/*Module.dll" 
-      cliModulePath = appPath + "/lib/Slicer*/cli-modules/*Lib.dll"
-    if(platformName == 'Linux'):
-      loadableModulePath = appPath + "/lib/Slicer*/qt-loadable-modules/*Module.so" 
-      cliModulePath = appPath + "/lib/Slicer*/cli-modules/*Lib.so"
-
-    scriptedModulePath = appPath + "/lib/Slicer*/qt-scripted-modules/*.py"
-    
-    filesForQtLoadableModule = glob.glob(loadableModulePath)
-    filesForQtScriptedModule = glob.glob(scriptedModulePath) 
-    filesForCliModule = glob.glob(cliModulePath)
-
-    settings = slicer.app.revisionUserSettings()
-    modulesAdditionalPaths = settings.value("Modules/AdditionalPaths") 
+    self.moduleRegistry.clear()
+    # Keep the current selections while the list is rebuilt
+    for item in self.selectorItems():
+      name = self.selectedModuleName(item)
+      if name != "None":
+        item.pendingModule = name
+    self.rebuildIndexButton.enabled = False
+    self.moduleIndexStatusLabel.text = "Scanning module directories..."
+
+    self.discoveryIsRescan = False
+    self.discoveryStartTime = time.time()
+    self.moduleScanRunning = True
+    self.moduleMetadata = {}
+    self.discovery = ModuleDiscovery(self.moduleIndexCache, platformName)
+    self.discovery.start(appPath, self.modulesAdditionalPaths())
+    self.discoveryTimer.start()
+
+  def startupReport(self):
+    # Discovery runs in the background from setup(); 'metadata' includes it.
+    parts = []
+    for key, label in (('import', 'import'), ('module', 'WorkflowOrganizer.__init__'), ('setup', 'setup'),
+                       ('discovery', 'module discovery'), ('metadata', 'module metadata')):
+      if key in startupTimings:
+        parts.append('%s %.3f s' % (label, startupTimings[key]))
+    return 'WorkflowOrganizer startup: ' + ', '.join(parts)
+
+  def modulesAdditionalPaths(self):
     # See ExtensionWizard.py and qSlicerSettingsModulesPanel.cxx
+    settings = slicer.app.revisionUserSettings()
+    return settings.value("Modules/AdditionalPaths") or []
+
+  def isDiscoveryRunning(self):
+    # The discovery thread runs until the metadata is extracted
+    return self.discoveryTimer.isActive()
+
+  def isModuleScanRunning(self):
+    # True until all the module names are known
+    return self.moduleScanRunning
+
+  def onDiscoveryTimer(self):
+    import Queue
+    updated = False
+    finished = False
+    while not finished:
+      try:
+        event = self.discovery.events.get_nowait()
+      except Queue.Empty:
+        break
+      if event[0] == 'directory':
+        if self.discoveryIsRescan:
+          self.updateModuleDirectory(event[1], event[2])
+        else:
+          self.moduleRegistry.extend(event[2], event[1])
+          updated = True
+      elif event[0] == 'done':
+        finished = True
+      elif event[0] == 'metadata':
+        self.discoveryTimer.stop()
+        self.rebuildIndexButton.enabled = True
+        self.updateModuleMetadata(event[1])
+        if not self.discoveryIsRescan and 'metadata' not in startupTimings:
+          startupTimings['metadata'] = time.time() - self.discoveryStartTime
+          print(self.startupReport())
+        return
+      elif event[0] == 'error':
+        print('WorkflowOrganizer: module discovery failed: %s' % event[1])
+        self.discoveryTimer.stop()
+        self.rebuildIndexButton.enabled = True
+        finished = True
+
+    if updated:
+      selectedNames = [self.selectedModuleName(item) for item in self.selectorItems()]
+      self.updateModuleList()
+      self.refreshExtensionSelectors(selectedNames)
+      if not finished:
+        self.moduleIndexStatusLabel.text = "Scanning module directories... (%d modules)" % len(self.moduleRegistry)
+
+    if finished:
+      self.moduleScanRunning = False
+      if not self.discoveryIsRescan:
+        if 'discovery' not in startupTimings:
+          startupTimings['discovery'] = time.time() - self.discoveryStartTime
+        for item in self.items:
+          item.pendingModule = None
+        self.moduleDirectoryKinds = dict(self.discovery.directories)
+        print('Found %d modules in %.3f s' % (len(self.moduleRegistry), self.discovery.elapsedTime))
+      self.updateModuleIndexStatus()
+      self.watchModuleDirectories()
+      self.startModuleSearchIndex()
+      if self.pendingValidation is not None:
+        workflow, interactive = self.pendingValidation
+        self.pendingValidation = None
+        self.reportMissingModules(self.validateWorkflow(workflow), interactive)
+
+  def updateModuleMetadata(self, metadata):
+    # A rescan only extracts the metadata of the rescanned directories
+    self.moduleMetadata.update(metadata)
+    self.moduleRegistry.setLabels(metadata)
+    # The labels of the items without a loaded step may have changed
+    for item in self.items:
+      item.lines = None
+    self.moduleCategoryNames = {}
+    for name, moduleMetadata in self.moduleMetadata.items():
+      for category in moduleMetadata.get('categories', []):
+        if category:
+          topLevelCategory = category.split('.')[0]
+          self.moduleCategoryNames.setdefault(topLevelCategory, set()).add(name)
+
+    selectedCategory = self.categorySelector.currentText
+    self.categorySelector.blockSignals(True)
+    self.categorySelector.clear()
+    self.categorySelector.addItem("All categories")
+    for category in sorted(self.moduleCategoryNames.keys(), key=lambda c: c.lower()):
+      self.categorySelector.addItem(category)
+    self.categorySelector.setCurrentIndex(max(0, self.categorySelector.findText(selectedCategory)))
+    self.categorySelector.blockSignals(False)
+
+    for item in self.selectorItems():
+      self.updateSelectorToolTip(item.selector)
+    self.applyCategoryFilter()
+    # The titles and categories are searchable too
+    self.startModuleSearchIndex()
+    print('Module metadata of %d modules in %.3f s (cache: %d hits, %d misses)' % (
+      len(metadata), self.discovery.metadataTime, self.moduleIndexCache.metadataHits, self.moduleIndexCache.metadataMisses))
+
+  def moduleTitle(self, moduleName):
+    record = self.moduleRegistry.get(moduleName)
+    return record.label if record is not None else moduleName
+
+  def moduleDescription(self, moduleName):
+    metadata = self.moduleMetadata.get(moduleName)
+    if not metadata:
+      return moduleName
+    lines = [metadata.get('title') or moduleName]
+    if metadata.get('categories'):
+      lines.append('Category: %s' % ', '.join(metadata['categories']))
+    if metadata.get('dependencies'):
+      lines.append('Depends on: %s' % ', '.join(metadata['dependencies']))
+    if metadata.get('description'):
+      lines.append(metadata['description'])
+    return '\n'.join(lines)
+
+  def updateSelectorToolTip(self, selector):
+    selector.toolTip = self.moduleDescription(selector.currentText) if selector.currentIndex > 0 else ""
+
+  def selectedCategoryNames(self):
+    # Names of the modules of the selected category, None for all
+    if self.categorySelector.currentIndex <= 0:
+      return None
+    return self.moduleCategoryNames.get(self.categorySelector.currentText, set())
+
+  def onCategoryChanged(self, index):
+    self.applyCategoryFilter()
+
+  def applyCategoryFilter(self):
+    # The modules selected in the selectors are listed too, so that the
+    # filter does not change their selection.
+    names = self.selectedCategoryNames()
+    if names is None and not self.categoryFilterApplied:
+      return
+    self.categoryFilterApplied = names is not None
+    if names is None:
+      self.moduleProxyModel.setFilterRegExp(qt.QRegExp())
+      return
+    names = set(names)
+    names.update([self.selectedModuleName(item) for item in self.selectorItems()])
+    self.setModuleFilter(names)
+
+  def setModuleFilter(self, names):
+    self.moduleFilterNames = names
+    pattern = '|'.join([qt.QRegExp.escape(name) for name in sorted(names)])
+    self.moduleProxyModel.setFilterRegExp(qt.QRegExp('^(None|%s)$' % pattern))
+
+  def updateModuleList(self):
+    # All the selectors share self.moduleProxyModel over
+    # self.moduleListModel, whose rows are the module registry after the
+    # item 'None'.
+    self.moduleListModel.setStringList(["None"] + self.moduleRegistry.names)
+    self.moduleSearch = None
+    if self.categoryFilterApplied:
+      self.applyCategoryFilter()
+
+  def moduleRow(self, moduleName):
+    # Row of a module in the selectors, 0 ('None') if not installed
+    row = self.moduleRegistry.row(moduleName) + 1 # the item 'None' requires row+1.
+    if row == 0 or not self.categoryFilterApplied:
+      return row
+    if moduleName not in self.moduleFilterNames:
+      # A module of another category is selected, e.g. by a loaded workflow
+      self.setModuleFilter(self.moduleFilterNames | set([moduleName]))
+    return self.moduleProxyModel.mapFromSource(self.moduleListModel.index(row, 0)).row()
+
+  def startModuleSearchIndex(self):
+    # The search index is built on a background thread once the discovery
+    # is done; a search started before it is ready waits for it.
+    import threading
+    names = list(self.moduleRegistry.names)
+    aliases = {}
+    for name, metadata in self.moduleMetadata.items():
+      aliases[name] = [metadata.get('title') or ''] + metadata.get('categories', [])
+    def build():
+      index = ModuleSearchIndex(names, aliases)
+      if self.moduleSearchThread is thread:
+        self.moduleSearch = index
+    thread = threading.Thread(target=build)
+    thread.daemon = True
+    self.moduleSearchThread = thread
+    thread.start()
+
+  def moduleSearchIndex(self):
+    if self.moduleSearch is None:
+      if self.moduleSearchThread is not None and self.moduleSearchThread.is_alive():
+        self.moduleSearchThread.join()
+      if self.moduleSearch is None:
+        self.moduleSearch = ModuleSearchIndex(self.moduleRegistry.names)
+    return self.moduleSearch
+
+  def watchModuleDirectories(self):
+    # Watch the scanned directories, and the settings file for changes of
+    # Modules/AdditionalPaths (e.g. when an extension is installed).
+    # QSettings replaces the file when it is saved, which drops it from the
+    # watcher, so it is added again every time.
+    paths = set([path for path in self.moduleDirectoryKinds.keys() if os.path.isdir(path)])
+    settingsFileName = slicer.app.slicerRevisionUserSettingsFilePath
+    if os.path.exists(settingsFileName):
+      paths.add(settingsFileName)
+    watchedPaths = set(self.moduleWatcher.directories()) | set(self.moduleWatcher.files())
+    for path in watchedPaths - paths:
+      self.moduleWatcher.removePath(path)
+    newPaths = list(paths - watchedPaths)
+    if newPaths:
+      self.moduleWatcher.addPaths(newPaths)
+
+  def onModuleDirectoryChanged(self, path):
+    # Events come in bursts, e.g. when an extension archive is unpacked;
+    # they are handled once the burst is over.
+    self.changedModuleDirectories.add(path)
+    self.moduleWatchTimer.start()
+
+  def onModuleSettingsChanged(self, path):
+    self.moduleSettingsChanged = True
+    self.moduleWatchTimer.start()
+
+  def onModuleWatchTimer(self):
+    from WorkflowOrganizerLib.ModuleIndex import moduleKinds
+    if self.isDiscoveryRunning():
+      self.moduleWatchTimer.start()
+      return
+
+    directories = [(path, self.moduleDirectoryKinds[path])
+                   for path in self.changedModuleDirectories if path in self.moduleDirectoryKinds]
+    self.changedModuleDirectories = set()
+
+    if self.moduleSettingsChanged:
+      self.moduleSettingsChanged = False
+      slicer.app.revisionUserSettings().sync()
+      additionalPaths = set(self.modulesAdditionalPaths())
+      for path in additionalPaths:
+        if path not in self.moduleDirectoryKinds:
+          self.moduleDirectoryKinds[path] = moduleKinds
+          directories.append((path, moduleKinds))
+      for path, kinds in self.moduleDirectoryKinds.items():
+        if kinds == moduleKinds and path not in additionalPaths:
+          # Additional path removed from the settings
+          del self.moduleDirectoryKinds[path]
+          self.updateModuleDirectory(path, [])
+
+    if directories:
+      self.discoveryIsRescan = True
+      self.rebuildIndexButton.enabled = False
+      self.discovery.rescan(directories)
+      self.discoveryTimer.start()
+    else:
+      self.watchModuleDirectories()
+
+  def updateModuleDirectory(self, path, modules):
+    """Apply the additions and removals of modules in one directory to the
+    module registry and the shared model in place. The selectors keep
+    their selection; a selected module that is removed is kept as a pending
+    selection until it shows up again.
+    """
+    oldModules = set([(record.kind, record.name, record.path) for record in self.moduleRegistry.inDirectory(path)])
+    newModules = set(modules)
+    removedModules = oldModules - newModules
+    addedModules = newModules - oldModules
+    if not removedModules and not addedModules:
+      return
+
+    removedNames = set([name for kind, name, fileName in removedModules])
+    for item in self.selectorItems():
+      name = item.selector.currentText
+      if name in removedNames:
+        item.pendingModule = name
+        item.selector.setCurrentIndex(0)
+
+    for kind, name, fileName in removedModules:
+      row = self.moduleRegistry.remove(kind, name, fileName)
+      if row >= 0:
+        self.moduleListModel.removeRows(row+1, 1) # the item 'None' requires row+1.
+    for kind, name, fileName in sorted(addedModules):
+      row = self.moduleRegistry.add(kind, name, fileName, path)
+      self.moduleListModel.insertRows(row+1, 1)
+      self.moduleListModel.setData(self.moduleListModel.index(row+1, 0), self.moduleRegistry.names[row])
+    self.moduleSearch = None
+    if self.categoryFilterApplied:
+      self.applyCategoryFilter()
+
+    for item in self.selectorItems():
+      if item.pendingModule in self.moduleRegistry:
+        item.selector.setCurrentIndex(self.moduleRow(item.pendingModule))
+        item.pendingModule = None
+    print('Module directory %s changed: %d added, %d removed' % (path, len(addedModules), len(removedModules)))
+
+  def updateModuleIndexStatus(self):
+    self.moduleIndexStatusLabel.text = "%d modules (cache: %d hits, %d misses)" % (
+      len(self.moduleRegistry), self.moduleIndexCache.hits, self.moduleIndexCache.misses)
+
+  def onRebuildIndexButton(self):
+    if self.isDiscoveryRunning():
+      return
+    self.moduleIndexCache.clear()
+    self.makeExtensionList()
 
-    for file in modulesAdditionalPaths:
-
-      if(platformName == 'Darwin'):
-        loadableModulePathSource = file + "/*Module.dylib"
-        cliModulePathSource = file + "/*Lib.dylib"
-      if(platformName == 'Windows'):
-        loadableModulePathSource = file + "/*Module.dll"
-        cliModulePathSource = file + "/*Lib.dll"
-      if(platformName == 'Linux'):
-        loadableModulePathSource = file + "/*Module.so"
-        cliModulePathSource = file + "/*Lib.so"
-
-      pyPathSource = file + "/*.py"
-
-      loadableModulePath = glob.glob(loadableModulePathSource)
-      cliModulePath = glob.glob(cliModulePathSource)
-      pyPath = glob.glob(pyPathSource)
-
-      if loadableModulePath:
-        filesForQtLoadableModule += loadableModulePath
-      if cliModulePath:
-        filesForCliModule += cliModulePath
-      if pyPath:
-        filesForQtScriptedModule += pyPath
-
-    tmpItemList = {}
-
-    for file in filesForQtLoadableModule:
-      if(platformName == 'Darwin'):
-        editFileTmp = file.replace('Module.dylib','')
-        editFile = editFileTmp.replace('libqSlicer','')
-        slashLocation = editFile.rfind('/')
-      if(platformName == 'Windows'):
-        editFileTmp = file.replace('Module.dll','')
-        editFile = editFileTmp.replace('qSlicer','')
-        slashLocation = editFile.rfind('\\')
-      if(platformName == 'Linux'):
-        editFileTmp = file.replace('Module.so','')
-        editFile = editFileTmp.replace('libqSlicer','')
-        slashLocation = editFile.rfind('/')
-      
-      tmpItemList[self.numberOfExtention] = editFile[slashLocation+1:]
-      self.numberOfExtention = self.numberOfExtention + 1
-
-    for file in filesForQtScriptedModule:      
-      editFile = file.replace('.py','')     
-      if(platformName == 'Darwin'):
-        slashLocation = editFile.rfind('/')
-      if(platformName == 'Windows'):
-        slashLocation = editFile.rfind('\\')
-      if(platformName == 'Linux'):
-        slashLocation = editFile.rfind('/')
-      
-      tmpItemList[self.numberOfExtention] = editFile[slashLocation+1:]
-      self.numberOfExtention = self.numberOfExtention + 1
-
-    for file in filesForCliModule:
-      if(platformName == 'Darwin'):      
-        editFileTmp = file.replace('Lib.dylib','')
-        editFile = editFileTmp.replace('lib','')
-        slashLocation = editFile.rfind('/')
-      if(platformName == 'Windows'):
-        editFile = file.replace('Lib.dll','')
-        slashLocation = editFile.rfind('\\')
-      if(platformName == 'Linux'):
-        editFileTmp = file.replace('Lib.so','')
-        editFile = editFileTmp.replace('lib','')
-        slashLocation = editFile.rfind('/')
-
-      tmpItemList[self.numberOfExtention] = editFile[slashLocation+1:]
-      self.numberOfExtention = self.numberOfExtention + 1
-
-    sortedList = {}
-    sortedList = sorted(tmpItemList.items(), key=lambda x: x[1])
-    for x in xrange(0,self.numberOfExtention):
-      self.installedExtensionName[x] = sortedList[x][1] 
+  def refreshExtensionSelectors(self, selectedNames):
+    # Restore the selections after the shared model was reset, keeping the
+    # selected module if it is still installed. Modules of a loaded workflow
+    # that were not discovered yet are selected as soon as they show up.
+    for item, name in zip(self.selectorItems(), selectedNames):
+      index = self.moduleRow(name)
+      if index > 0:
+        item.pendingModule = None
+      item.selector.setCurrentIndex(index)
+
+  def selectorItems(self):
+    return [item for item in self.items if item.include is None]
+
+  def selectedModuleName(self, item):
+    # Name of the module chosen in the selector of 'item', including a
+    # loaded module that is still waiting for the discovery to find it.
+    currentText = item.selector.currentText
+    if currentText == "None" and item.pendingModule is not None:
+      return item.pendingModule
+    return currentText
+
+  def savedModuleName(self, item):
+    # Name of the module an item is saved with. A loaded step is kept as it
+    # was loaded until the user picks another module, even if its module is
+    # not installed and the selector shows "None".
+    if item.step is not None and not item.changed:
+      return item.step.module
+    return self.selectedModuleName(item)
 
   def createDockPanel(self):
-    self.modules = []
+    if self.dockPanel is not None:
+      return
 
     self.dockPanel = qt.QDockWidget('Workflow Organizer')
     self.dockPanel.windowTitle = self.wizardTitleTextBox.text
@@ -325,12 +928,8 @@ class WorkflowOrganizerWidget:
     self.dockFrame.setFrameStyle(qt.QFrame.NoFrame)
     self.dockLayout = qt.QVBoxLayout()
 
-    ## Button Frame
-    self.dockButtonFrame = qt.QFrame(self.dockFrame)
-    self.dockButtonFrame.setFrameStyle(qt.QFrame.NoFrame)
-    self.dockButtonLayout = qt.QHBoxLayout()
-      
-    self.dockButtonFrame.setLayout(self.dockButtonLayout)
+    ## Button rows, created on demand by makeButtons()
+    self.dockButtonRows = []
 
     ## Wizard Frame
     self.dockWizardFrame = qt.QFrame(self.dockFrame)
@@ -353,73 +952,397 @@ class WorkflowOrganizerWidget:
     self.dockWizardFrame.setLayout(self.dockWizardLayout)
     self.dockLayout.addWidget(self.dockWizardFrame)
 
+    self.dockDataStatusLabel = qt.QLabel("")
+    self.dockDataStatusLabel.visible = False
+    self.dockLayout.addWidget(self.dockDataStatusLabel)
+
     ## Set frame to the dock panel
     self.dockFrame.setLayout(self.dockLayout)
     self.dockPanel.setWidget(self.dockFrame)
 
-    self.dockButtonFrame.show()
     self.dockWizardFrame.show()
     mw = slicer.util.mainWindow()
     mw.addDockWidget(qt.Qt.LeftDockWidgetArea, self.dockPanel)
     self.dockFrame.show()    
+    self.updateDataPrefetchStatus()
 
   def cleanup(self):
-    pass
+    self.discoveryTimer.stop()
+    self.moduleWatchTimer.stop()
+    self.prefetcher.stop()
+    self.dataPrefetcher.stop()
+    self.dataPrefetchTimer.stop()
+    self.resourceTimer.stop()
+    self.navigationServer.close()
+    if self.autosaveTimer.isActive():
+      self.autosaveTimer.stop()
+      self.autosave()
+    self.autosaveStatusTimer.stop()
+    self.startupProfileTimer.stop()
+    # The last autosave may still be on its way to the disk
+    if not self.fileWriter.flush(2.0):
+      print('WorkflowOrganizer: the autosave to %s did not finish' % self.autosaveFileName())
 
   def enter(self):
     pass
 
   def editedWizardTitle(self, inputText):
-    self.dockPanel.windowTitle = inputText
-
-  def onModuleChange(self, moduleId):
-    print 'Change module to %s' % self.modules[moduleId].module
-    slicer.util.selectModule(self.modules[moduleId].module)
+    if self.dockPanel is not None:
+      self.dockPanel.windowTitle = inputText
+    self.scheduleAutosave()
+
+  def onModuleChange(self, moduleId, source='button'):
+    # A segment is expanded when it is entered, from its last step when
+    # going back
+    while self.modules[moduleId].include is not None:
+      numberOfEntries = self.expandSegment(moduleId)
+      if not self.modules:
+        return
+      if source == 'back':
+        moduleId = moduleId + numberOfEntries - 1
+      moduleId = moduleId % len(self.modules)
+
+    # Sampled before the module is selected, so that creating its widget is
+    # charged to the new step
+    self.sampleResources('transition', moduleId, self.modules[moduleId].module)
+    self.selectModuleTimed(self.modules[moduleId].module, source)
     self.modules[self.currentModuleId].button.setChecked(False)
     self.modules[moduleId].button.setChecked(True)
     self.currentModuleId = moduleId
     self.WorkflowOrganizerButton.enabled = True    
+    self.prefetcher.moduleEntered(self.modules[moduleId].module)
+    self.schedulePrefetch()
+    self.loadStepData(moduleId)
+    self.scheduleDataPrefetch()
+    self.navigationServer.publishStep(moduleId, self.modules[moduleId])
+
+  def expandSegment(self, index):
+    """Replace the segment at 'index' by the steps and segments of its
+    workflow, and return their number."""
+    startTime = time.time()
+    include = self.modules[index].include
+    try:
+      entries = includeEntries(include, self.workflowCache)
+    except (IOError, ValueError) as e:
+      print('WorkflowOrganizer: cannot include %s: %s' % (include.fileName, e))
+      entries = []
+    segment = []
+    for entry in entries:
+      if isinstance(entry, WorkflowInclude):
+        segment.append(self.segmentButtonProperty(entry))
+      else:
+        segment.append(ModuleButtonProperty(entry.module, entry.label[0:self.numberOfLabelText], entry.data, name=entry.label))
+    modules = [ModuleButtonProperty(p.module, p.label, p.data, p.include, p.name) for p in self.modules]
+    modules[index:index+1] = segment
+
+    currentModuleId = self.currentModuleId
+    self.updateDockButtons(modules)
+    if currentModuleId > index:
+      currentModuleId = currentModuleId + len(segment) - 1
+    self.currentModuleId = min(currentModuleId, max(0, len(self.modules) - 1))
+    print('Expanded %s: %d steps in %.3f s' % (include.label, len(segment), time.time() - startTime))
+
+    if not self.isModuleScanRunning():
+      # The entries are numbered like the buttons of the segment
+      steps = Workflow(steps=[entry for entry in entries if not isinstance(entry, WorkflowInclude)],
+                       includes=[entry for entry in entries if isinstance(entry, WorkflowInclude)])
+      self.reportMissingModules([(index + stepIndex, moduleName, suggestions)
+                                 for stepIndex, moduleName, suggestions in self.validateWorkflow(steps)])
+    return len(segment)
+
+  def selectModuleTimed(self, moduleName, source):
+    # The transition is recorded once the event loop is idle again, that is
+    # when the zero-delay timer fires after the pending events were processed.
+    mainWindow = slicer.util.mainWindow()
+    fromModule = mainWindow.moduleSelector().selectedModule if mainWindow else ""
+    startTime = time.time()
+    slicer.util.selectModule(moduleName)
+    selectTime = time.time() - startTime
+    self.pendingTransitions.append((startTime, selectTime, source, fromModule, moduleName))
+    qt.QTimer.singleShot(0, self.onTransitionIdle)
+
+  def onTransitionIdle(self):
+    startTime, selectTime, source, fromModule, moduleName = self.pendingTransitions.pop(0)
+    totalTime = time.time() - startTime
+    self.transitionRecorder.record(source, fromModule, moduleName, selectTime, totalTime, startTime)
+    print('Change module to %s: select %.3f s, total %.3f s' % (moduleName, selectTime, totalTime))
+    if not self.timingCollapsibleButton.collapsed:
+      self.updateTimingTable()
+
+  def updateTimingTable(self):
+    summary = self.transitionRecorder.summary()
+    self.timingTable.setRowCount(len(summary))
+    for row, s in enumerate(summary):
+      values = [s['module'], str(s['count'])] + ['%.1f' % (s[key] * 1000.0) for key in ('totalP50', 'totalP95', 'totalMax')]
+      for column, value in enumerate(values):
+        self.timingTable.setItem(row, column, qt.QTableWidgetItem(value))
+
+  def onTimingCollapsed(self, collapsed):
+    if not collapsed:
+      self.updateTimingTable()
+
+  def onTimingExportButton(self):
+    fileName = qt.QFileDialog.getSaveFileName(None, "Export Step Timing", "", "CSV (*.csv);;JSON (*.json)")
+    if(fileName != ""):
+      self.transitionRecorder.export(fileName)
+
+  def onTimingClearButton(self):
+    self.transitionRecorder.clear()
+    self.updateTimingTable()
+
+  def sampleResources(self, kind, step, moduleName):
+    self.activeStep = (step, moduleName)
+    self.resourceRecorder.sample(kind, step, moduleName, slicer.mrmlScene.GetNumberOfNodes() or 0)
+    if kind == 'transition' and self.resourcePeriodicCheckBox.checked:
+      # The interval restarts with the step
+      self.resourceTimer.start()
+
+  def onResourceTimer(self):
+    if self.activeStep is not None:
+      self.sampleResources('periodic', self.activeStep[0], self.activeStep[1])
+
+  def onResourcePeriodicToggled(self, checked):
+    if checked:
+      self.resourceTimer.start()
+    else:
+      self.resourceTimer.stop()
+
+  def onResourceIntervalChanged(self, value):
+    self.resourceTimer.setInterval(value * 1000)
+
+  def updateResourceTable(self):
+    summary = self.resourceRecorder.summary()
+    megabyte = 1024.0 * 1024.0
+    self.resourceTable.setRowCount(len(summary))
+    for row, s in enumerate(summary):
+      values = ['-' if s['step'] < 0 else str(s['step']+1), s['module'], str(s['visits']),
+                '%.1f' % s['time'], '%.1f' % s['cpuTime'], '%.1f' % (s['rssGrowth'] / megabyte),
+                '%.1f' % (s['peakRSS'] / megabyte), str(s['peakNodes'])]
+      for column, value in enumerate(values):
+        self.resourceTable.setItem(row, column, qt.QTableWidgetItem(value))
+
+  def onResourceCollapsed(self, collapsed):
+    if not collapsed:
+      self.updateResourceTable()
+
+  def onResourceExportButton(self):
+    fileName = qt.QFileDialog.getSaveFileName(None, "Export Step Resources", "", "CSV (*.csv);;JSON (*.json)")
+    if(fileName != ""):
+      case = {'workflow': self.wizardTitleTextBox.text, 'steps': [p.module for p in self.modules]}
+      self.resourceRecorder.export(fileName, case)
+
+  def onResourceClearButton(self):
+    self.resourceRecorder.clear()
+    if self.activeStep is not None:
+      # The new case starts in the current step
+      self.sampleResources('transition', self.activeStep[0], self.activeStep[1])
+    self.updateResourceTable()
+
+  def schedulePrefetch(self):
+    if not self.prefetchCheckBox.checked or len(self.modules) == 0:
+      return
+    n = len(self.modules)
+    moduleNames = []
+    for distance in xrange(1, self.prefetchDepthSpinBox.value+1):
+      moduleNames.append(self.modules[(self.currentModuleId + distance) % n].module)
+      if self.prefetchBackwardCheckBox.checked:
+        moduleNames.append(self.modules[(self.currentModuleId - distance + n) % n].module)
+    self.prefetcher.budget = self.prefetchBudgetSpinBox.value / 1000.0
+    # Segments have no module until they are expanded
+    self.prefetcher.prefetch([name for name in moduleNames if name is not None])
+
+  def onPrefetchToggled(self, checked):
+    if checked:
+      self.schedulePrefetch()
+    else:
+      self.prefetcher.stop()
+
+  def scheduleDataPrefetch(self):
+    # The data files of the current step and the steps after it, nearest
+    # first; the memory limit decides how far ahead they are read.
+    if not self.dataPrefetchCheckBox.checked:
+      return
+    n = len(self.modules)
+    fileNames = []
+    for distance in xrange(0, n):
+      for fileName in self.modules[(self.currentModuleId + distance) % n].data:
+        if not self.isDataLoaded(fileName):
+          fileNames.append(fileName)
+    if not fileNames and not self.dataPrefetcher.isActive():
+      return
+    self.dataPrefetcher.numberOfThreads = self.dataPrefetchThreadsSpinBox.value
+    self.dataPrefetcher.memoryLimit = self.dataPrefetchMemorySpinBox.value * 1024 * 1024
+    self.dataPrefetcher.prefetch(fileNames)
+    self.dataPrefetchTimer.start()
+    self.updateDataPrefetchStatus()
+
+  def onDataPrefetchToggled(self, checked):
+    if checked:
+      self.scheduleDataPrefetch()
+    else:
+      self.dataPrefetcher.prefetch([])
+      self.updateDataPrefetchStatus()
+
+  def updateDataPrefetchStatus(self):
+    summary = self.dataPrefetcher.summary()
+    parts = ['%d %s' % (summary[state], state) for state in ('loaded', 'ready', 'reading', 'queued', 'skipped', 'failed') if summary[state]]
+    if parts:
+      text = 'Data: %s (%d MB read ahead)' % (', '.join(parts), summary['bytesHeld'] / (1024 * 1024))
+    else:
+      text = ''
+    self.dataPrefetchStatusLabel.text = text
+    if self.dockPanel is not None:
+      self.dockDataStatusLabel.text = text
+      self.dockDataStatusLabel.visible = (text != '')
+    if not self.dataPrefetcher.isActive():
+      self.dataPrefetchTimer.stop()
+
+  def isDataLoaded(self, fileName):
+    node = self.loadedDataNodes.get(fileName)
+    return node is not None and slicer.mrmlScene.IsNodePresent(node)
+
+  def loadStepData(self, moduleId):
+    # Load the data files of the entered step into the scene. The files
+    # were read ahead by the data prefetcher, so they come from the file
+    # cache of the operating system.
+    for fileName in self.modules[moduleId].data:
+      if self.isDataLoaded(fileName):
+        continue
+      startTime = time.time()
+      node = None
+      try:
+        fileType = slicer.app.coreIOManager().fileType(fileName)
+        success, loadedNode = slicer.util.loadNodeFromFile(fileName, fileType, returnNode=True)
+        if success:
+          node = loadedNode
+      except Exception as e:
+        print('WorkflowOrganizer: could not load %s: %s' % (fileName, e))
+      state = self.dataPrefetcher.state(fileName)
+      self.dataPrefetcher.release(fileName)
+      if node:
+        self.loadedDataNodes[fileName] = node
+        print('Loaded %s (%s) in %.3f s' % (fileName, state or 'not prefetched', time.time() - startTime))
+    self.updateDataPrefetchStatus()
 
   def clearAllButtons(self):
-    self.numberOfModule = 0
     self.clearButton.enabled = False
 
-    #Delete Workflow Organizer Panel
-    self.dockPanel.close()
-
-    #Cretate Workflow Organizer Panel
-    self.createDockPanel()
+    # Remove the step buttons; the dock panel itself is kept
+    if self.dockPanel is not None:
+      self.updateDockButtons([])
+      self.WorkflowOrganizerButton.enabled = False
+    self.dataPrefetcher.clear()
+    self.updateDataPrefetchStatus()
 
   def onPlusButton(self):
-    # Extension selector
-    self.extensionSelector[self.numberOfExtentionList] = qt.QComboBox()
-    self.extensionSelector[self.numberOfExtentionList].enabled = True  
-    self.extensionSelector[self.numberOfExtentionList].addItem("None")
+    self.addExtensionSelector()
+    self.updateItemListButtons()
 
-    if(self.numberOfExtentionList == 0):
+  def addExtensionSelector(self, moduleName=None, step=None):
+    # Extension selector
+    selector = qt.QComboBox()
+    selector.enabled = True
+    selector.setModel(self.moduleProxyModel)
+    selector.setCurrentIndex(0)
+    self.enableModuleSearch(selector)
+    def onCurrentIndexChanged(index, selector=selector):
+      self.updateSelectorToolTip(selector)
+      self.scheduleAutosave()
+    selector.connect('currentIndexChanged(int)', onCurrentIndexChanged)
+
+    # The loaded step keeps the data files, arguments and dependencies of
+    # the item for makeFile() and onApplyListButton().
+    item = ModuleItem(selector, step)
+    def onActivated(index, item=item):
+      item.changed = True
+    selector.connect('activated(int)', onActivated)
+
+    if moduleName is not None:
+      index = self.moduleRow(moduleName)
+      selector.setCurrentIndex(index)
+      if(index == 0 and self.isModuleScanRunning()):
+        # The module may not have been discovered yet
+        item.pendingModule = moduleName
+
+    self.extensionFormLayout.addWidget(selector)
+    self.items.append(item)
+    self.scheduleAutosave()
+
+  def addIncludeItem(self, include):
+    label = qt.QLabel("Include: %s" % include.label)
+    label.toolTip = include.fileName
+    self.extensionFormLayout.addWidget(label)
+    self.items.append(ModuleItem(label, include=include))
+    self.scheduleAutosave()
+
+  def segmentButtonProperty(self, include):
+    return ModuleButtonProperty(None, "+ " + include.label[0:self.numberOfLabelText], (), include, include.label)
+
+  def enableModuleSearch(self, selector):
+    # Type-ahead search: the typed text is looked up in the module search
+    # index and the matches are shown in the completer popup.
+    selector.setEditable(True)
+    selector.setInsertPolicy(qt.QComboBox.NoInsert)
+    completer = qt.QCompleter(self.moduleMatchModel, selector)
+    completer.setCompletionMode(qt.QCompleter.UnfilteredPopupCompletion)
+    selector.setCompleter(completer)
+    def onTextEdited(text, selector=selector): self.onModuleSearchTextEdited(selector, text)
+    def onActivated(text, selector=selector): self.onModuleSearchActivated(selector, text)
+    def onEditingFinished(selector=selector): self.onModuleSearchFinished(selector)
+    selector.lineEdit().connect('textEdited(QString)', onTextEdited)
+    completer.connect('activated(QString)', onActivated)
+    selector.lineEdit().connect('editingFinished()', onEditingFinished)
+
+  def onModuleSearchTextEdited(self, selector, text):
+    names = self.selectedCategoryNames()
+    if names is None:
+      matches = self.moduleSearchIndex().search(text)
+    else:
+      matches = [name for name in self.moduleSearchIndex().search(text, len(self.moduleRegistry)) if name in names][:50]
+    self.moduleMatchModel.setStringList(matches)
+    selector.completer().complete()
+
+  def onModuleSearchActivated(self, selector, text):
+    if text in self.moduleRegistry:
+      self.selectSearchedModule(selector, text)
+
+  def onModuleSearchFinished(self, selector):
+    # Only installed modules can be selected; partial text is reverted
+    text = selector.currentText
+    if text in self.moduleRegistry:
+      self.selectSearchedModule(selector, text)
+    else:
+      selector.setEditText(selector.itemText(selector.currentIndex))
+
+  def selectSearchedModule(self, selector, name):
+    index = self.moduleRow(name)
+    if index != selector.currentIndex:
+      for item in self.items:
+        if item.selector is selector:
+          item.changed = True
+    selector.setCurrentIndex(index)
+
+  def updateItemListButtons(self):
+    if(len(self.items) > 0):
       self.extensionCollapsibleButton.collapsed = False
       self.extensionCollapsibleButton.enabled = True
-
-    for i in range(self.numberOfExtention):
-      self.extensionSelector[self.numberOfExtentionList].addItem(self.installedExtensionName[i])
-      if(self.loadFileFlag == 1 and self.modules[self.numberOfModule].module == self.installedExtensionName[i]):
-        self.extensionSelector[self.numberOfExtentionList].setCurrentIndex(i+1) # the item 'None' requires i+1.
-
-    self.extensionFormLayout.addWidget(self.extensionSelector[self.numberOfExtentionList])
-    self.numberOfExtentionList = self.numberOfExtentionList + 1
-    self.removeButton.enabled = True
-    self.saveExtensionListButton.enabled = True
-    self.applyListButton.enabled = True
+      self.removeButton.enabled = True
+      self.saveExtensionListButton.enabled = True
+      self.applyListButton.enabled = True
     # Reset the current item
     self.currentModuleId = 0
 
   def onRemoveButton(self):
-    self.numberOfExtentionList = self.numberOfExtentionList - 1
+    item = self.items.pop()
     # Reset the current item
     self.currentModuleId = 0
 
-    self.extensionFormLayout.removeWidget(self.extensionSelector[self.numberOfExtentionList])
-    if(self.numberOfExtentionList == 0):
+    self.extensionFormLayout.removeWidget(item.selector)
+    # Removing the widget from the layout does not delete it
+    item.selector.hide()
+    item.selector.deleteLater()
+    self.scheduleAutosave()
+    if(len(self.items) == 0):
       self.removeButton.enabled = False
       self.extensionCollapsibleButton.collapsed = True
       self.extensionCollapsibleButton.enabled = False
@@ -427,151 +1350,484 @@ class WorkflowOrganizerWidget:
       self.applyListButton.enabled = False
 
   def clearItemList(self):
-    for i in xrange(0,self.numberOfExtentionList):
+    while self.items:
       self.onRemoveButton()
 
   def onSaveExtensionListButton(self):
-    data = {}
-    data = self.makeFile()
-
     fileName = qt.QFileDialog.getSaveFileName()
-    f = open(fileName, 'w')
-    f.write(data)
-    f.close()
-    
-  def makeFile(self):
-    data = {}
-
-    data = "<items>\n"
-    data += "<title>"
-    data += self.dockPanel.windowTitle
-    data += "</title>\n"
-    data += "# module name and label name\n"
-
-    for x in xrange(0,self.numberOfExtentionList):
-      data += "<item>"
-      data += self.extensionSelector[x].currentText
-      data += ","
-      data += self.extensionSelector[x].currentText[0:self.numberOfLabelText]
-      data += "</item>\n"
-
-    data += "</items>"
-
-    return data    
+    if not fileName:
+      return
+    # Written in the background, like the autosaves
+    oldAutosaveFileName = self.autosaveFileName()
+    self.fileWriter.save(fileName, self.makeFile(os.path.dirname(os.path.abspath(fileName))))
+    self.fileWriter.remove(oldAutosaveFileName)
+    self.workflowFileName = fileName
+    self.autosaveTimer.stop()
+    self.autosaveText = None
+    self.autosaveStatusTimer.start()
+
+  def makeFile(self, baseDirectory):
+    # The relative paths are written relative to baseDirectory, the
+    # directory of the file. Each item keeps its lines until its module
+    # changes, so a long list is not formatted again for every autosave.
+    lines = formatHeader(self.wizardTitleTextBox.text)
+    for item in self.items:
+      if item.include is not None:
+        moduleName = None
+      else:
+        moduleName = self.savedModuleName(item)
+      key = (moduleName, baseDirectory)
+      if item.lines is None or item.lines[0] != key:
+        item.lines = (key, formatEntry(self.itemEntry(item, moduleName), baseDirectory))
+      lines.extend(item.lines[1])
+    lines.append("</items>")
+    return "\n".join(lines)
+
+  def itemEntry(self, item, moduleName):
+    # The WorkflowStep or WorkflowInclude of an item
+    if item.include is not None:
+      return item.include
+    loadedStep = item.step
+    if loadedStep is not None and loadedStep.module == moduleName:
+      # The label is kept, as <after> lines may refer to it
+      return WorkflowStep(moduleName, loadedStep.label, loadedStep.data, loadedStep.arguments, loadedStep.after, loadedStep.dataPaths)
+    return WorkflowStep(moduleName, self.moduleTitle(moduleName)[0:self.numberOfLabelText])
+
+  def currentWorkflow(self):
+    # The Workflow of the item list
+    workflow = Workflow(self.wizardTitleTextBox.text)
+    for item in self.items:
+      if item.include is not None:
+        workflow.includes.append(WorkflowInclude(item.include.fileName, item.include.label, len(workflow.steps), path=item.include.path))
+        continue
+      moduleName = self.savedModuleName(item)
+      if moduleName and moduleName != "None":
+        workflow.steps.append(self.itemEntry(item, moduleName))
+    return workflow
+
+  def onStartupProfileButton(self):
+    if self.isDiscoveryRunning():
+      self.startupProfileStatusLabel.text = "Wait for the module scan to finish."
+      return
+    if self.startupProfileTimer.isActive():
+      return
+    try:
+      workflow = expandWorkflow(self.currentWorkflow(), self.workflowCache)
+    except (IOError, ValueError) as e:
+      self.startupProfileStatusLabel.text = "Cannot read the workflow: %s" % e
+      return
+    fileName = qt.QFileDialog.getSaveFileName()
+    if not fileName:
+      return
+    # subprocess and signal are only imported when a profile is made
+    from WorkflowOrganizerLib.StartupProfile import StartupProfile
+    profile = StartupProfile(workflow, self.moduleRegistry, self.moduleMetadata)
+    slicerExecutable = getattr(slicer.app, 'launcherExecutableFilePath', None) or slicer.app.applicationFilePath()
+    fileNameBase = os.path.splitext(fileName)[0]
+    fileNames = profile.write(fileNameBase, slicerExecutable, self.workflowFileName)
+    self.startupProfileStatusLabel.text = "%d of %d modules (%s)" % (
+      len(profile.loadedModules), profile.numberOfInstalledModules, os.path.basename(fileNames[-1]))
+    self.startupProfileStatusLabel.toolTip = "\n".join(fileNames)
+    print('Startup profile %s: %d of %d modules loaded, %d ignored' % (
+      fileNames[-1], len(profile.loadedModules), profile.numberOfInstalledModules, len(profile.ignoredModules)))
+    if profile.missingModules:
+      print('Startup profile: not installed: %s' % ', '.join(profile.missingModules))
+    if self.startupProfileMeasureCheckBox.checked:
+      self.startStartupMeasurement(profile, slicerExecutable, fileNameBase + '.json')
+
+  def startStartupMeasurement(self, profile, slicerExecutable, jsonFileName):
+    # Slicer is started several times; the GUI stays responsive and the
+    # progress is posted to self.startupProfileEvents.
+    import threading
+    import Queue
+    from WorkflowOrganizerLib.StartupProfile import measureStartupTimes
+    events = Queue.Queue()
+    def measure():
+      try:
+        times = measureStartupTimes(slicerExecutable, profile, 3, lambda message: events.put(('progress', message)))
+      except (OSError, RuntimeError) as e:
+        events.put(('error', str(e)))
+        return
+      events.put(('done', times))
+    self.startupProfileEvents = (events, profile, jsonFileName)
+    thread = threading.Thread(target=measure)
+    thread.daemon = True
+    thread.start()
+    self.startupProfileTimer.start()
+
+  def onStartupProfileTimer(self):
+    import Queue
+    from WorkflowOrganizerLib.StartupProfile import startupReport
+    events, profile, jsonFileName = self.startupProfileEvents
+    while True:
+      try:
+        event = events.get_nowait()
+      except Queue.Empty:
+        return
+      if event[0] == 'progress':
+        self.startupProfileStatusLabel.text = event[1]
+        continue
+      self.startupProfileTimer.stop()
+      self.startupProfileEvents = None
+      if event[0] == 'error':
+        self.startupProfileStatusLabel.text = "Startup measurement failed: %s" % event[1]
+      else:
+        profile.startupTimes = event[1]
+        profile.writeJSON(jsonFileName)
+        report = startupReport(profile.startupTimes)
+        self.startupProfileStatusLabel.text = report
+        print(report)
+      return
+
+  def autosaveFileName(self):
+    if self.workflowFileName:
+      return self.workflowFileName + autosaveSuffix
+    settingsPath = os.path.dirname(slicer.app.slicerRevisionUserSettingsFilePath)
+    return os.path.join(settingsPath, 'WorkflowOrganizerAutosave.txt')
+
+  def scheduleAutosave(self):
+    # Changes come in bursts (loading, typing the title); the item list is
+    # saved once they stop.
+    if self.autosaveCheckBox.checked:
+      self.autosaveTimer.start()
+
+  def autosave(self):
+    startTime = time.time()
+    fileName = self.autosaveFileName()
+    text = self.makeFile(os.path.dirname(os.path.abspath(fileName)))
+    if text == self.autosaveText:
+      return
+    self.autosaveText = text
+    self.fileWriter.save(fileName, text)
+    self.autosaveStatusTimer.start()
+    print('Autosave: %d items formatted in %.3f s' % (len(self.items), time.time() - startTime))
+
+  def updateAutosaveStatus(self):
+    writer = self.fileWriter
+    if writer.isBusy():
+      self.autosaveStatusLabel.text = "Saving..."
+      return
+    self.autosaveStatusTimer.stop()
+    if writer.lastError:
+      self.autosaveStatusLabel.text = "Save failed: %s" % writer.lastError
+    elif writer.lastWriteTime is not None:
+      self.autosaveStatusLabel.text = "Saved %s in %.0f ms" % (
+        time.strftime('%H:%M:%S', time.localtime(writer.lastWriteTime)), writer.lastWallTime * 1000.0)
+    self.autosaveStatusLabel.toolTip = writer.lastFileName or ""
+
+  def onAutosaveToggled(self, checked):
+    qt.QSettings().setValue("WorkflowOrganizer/Autosave", checked)
+    if checked:
+      self.autosaveText = None
+      self.scheduleAutosave()
+    else:
+      self.autosaveTimer.stop()
+
+  def onAutosaveRestoreButton(self):
+    fileName = self.autosaveFileName()
+    if os.path.exists(fileName):
+      self.applyWorkflow(readWorkflowFile(fileName))
+    self.autosaveRestoreButton.enabled = False
 
   def makeButtons(self):
-    id = 0
-    bthProp = 0
-
-    for btnProp in self.modules:
-      btnProp.button = qt.QPushButton(btnProp.label)
-      btnProp.button.setCheckable ( True )
-      # NOTE: we cannot use lambda for slot here, because it treats 'id' as a valuable
-      #       see http://math.andrej.com/2009/04/09/pythons-lambda-is-broken/
-      def f(id=id): return self.onModuleChange(id)
-      btnProp.handler = f;
-      #print('function =')
-      #print btnProp.handler
-      print 'Change module to %s' % self.modules[id].module
-      btnProp.button.connect('clicked()', btnProp.handler)
-      self.dockButtonLayout.addWidget(btnProp.button)
-
-      if((id+1) % self.itemsOnOneLine == 0 and id != 0): # Change the row
-        self.dockLayout.addWidget(self.dockButtonFrame)
-        self.dockButtonLayout = qt.QHBoxLayout()
-        self.dockButtonFrame = qt.QFrame(self.dockFrame)
-        self.dockButtonFrame.setFrameStyle(qt.QFrame.NoFrame)
-        self.dockButtonFrame.setLayout(self.dockButtonLayout)
-      id = id + 1
-
-    self.dockLayout.addWidget(self.dockButtonFrame)    
-    self.dockLayout.removeWidget(self.dockWizardFrame)
-    self.dockLayout.addWidget(self.dockWizardFrame)
+    # Create the buttons of the new steps and lay out the button rows.
+    # Existing buttons are relabeled and moved only if needed.
+    for id, btnProp in enumerate(self.modules):
+      btnProp.index = id
+      if btnProp.button is None:
+        btnProp.button = qt.QPushButton(btnProp.label)
+        btnProp.button.setCheckable ( True )
+        # NOTE: we cannot use lambda for slot here, because it treats 'id' as a valuable
+        #       see http://math.andrej.com/2009/04/09/pythons-lambda-is-broken/
+        #       The step index is read from btnProp, as it changes when steps
+        #       are inserted or removed.
+        def f(btnProp=btnProp): return self.onModuleChange(btnProp.index)
+        btnProp.handler = f;
+        btnProp.button.connect('clicked()', btnProp.handler)
+      elif btnProp.button.text != btnProp.label:
+        btnProp.button.text = btnProp.label
+      btnProp.button.setChecked(False)
+
+    rows = []
+    for start in xrange(0, len(self.modules), self.itemsOnOneLine):
+      rows.append(self.modules[start:start+self.itemsOnOneLine])
+    while len(self.dockButtonRows) < len(rows):
+      row = DockButtonRow(self.dockFrame)
+      # keep the back/next buttons below the rows
+      self.dockLayout.insertWidget(len(self.dockButtonRows), row.frame)
+      self.dockButtonRows.append(row)
+
+    # Take the buttons out of the rows that changed before adding them
+    # again, as a button may move from one row to another.
+    changedRows = []
+    for r, row in enumerate(self.dockButtonRows):
+      modules = rows[r] if r < len(rows) else []
+      if row.modules != modules:
+        for p in row.modules:
+          row.layout.removeWidget(p.button)
+        row.modules = modules
+        changedRows.append(row)
+    for row in changedRows:
+      for p in row.modules:
+        row.layout.addWidget(p.button)
+    for r, row in enumerate(self.dockButtonRows):
+      row.frame.visible = (r < len(rows))
+
+    self.backButton.enabled = (len(self.modules) > 0)
+    self.nextButton.enabled = (len(self.modules) > 0)
+    self.clearButton.enabled = (len(self.modules) > 0)
+
+  def updateDockButtons(self, modules):
+    """Replace self.modules by 'modules' (ModuleButtonProperty without buttons).
+    The buttons of the steps that did not change are reused; only inserted,
+    removed or renamed steps are touched.
+    """
+    import difflib
+    oldModules = self.modules
+    key = lambda p: p.module if p.include is None else ('include', p.include.fileName)
+    matcher = difflib.SequenceMatcher(None,
+      [key(p) for p in oldModules], [key(p) for p in modules], autojunk=False)
+    newModules = []
+    removedModules = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+      # Equal and replaced steps keep their button
+      reused = min(i2-i1, j2-j1) if tag != 'insert' and tag != 'delete' else 0
+      for k in xrange(0, reused):
+        p = oldModules[i1+k]
+        p.module = modules[j1+k].module
+        p.label = modules[j1+k].label
+        p.name = modules[j1+k].name
+        p.data = modules[j1+k].data
+        p.include = modules[j1+k].include
+        newModules.append(p)
+      newModules += modules[j1+reused:j2]
+      removedModules += oldModules[i1+reused:i2]
+
+    self.modules = newModules
+    self.currentModuleId = 0
+    self.makeButtons()
 
-    self.backButton.enabled = True
-    self.nextButton.enabled = True
-    self.clearButton.enabled = True
+    for p in removedModules:
+      p.button.hide()
+      p.button.deleteLater()
+      p.button = None
+      p.handler = None
 
   def onApplyListButton(self):
-    self.loadFileFlag = 1
-    self.clearAllButtons() # clear self.module
-    
+    self.createDockPanel()
+    self.dockPanel.windowTitle = self.wizardTitleTextBox.text
     self.wizardTitleTextBox.text = self.dockPanel.windowTitle  
 
-    for x in xrange(0,self.numberOfExtentionList):
-      moduleName = self.extensionSelector[x].currentText
-      label = self.extensionSelector[x].currentText[0:self.numberOfLabelText]
-      p = ModuleButtonProperty()
-      p.module = moduleName
-      p.label = label[0:self.numberOfLabelText]
-      self.modules.append(p)   
-
-    self.makeButtons()
-
-    self.loadFileFlag = 0
+    modules = []
+    for item in self.items:
+      if item.include is not None:
+        modules.append(self.segmentButtonProperty(item.include))
+        continue
+      moduleName = self.selectedModuleName(item)
+      loadedStep = item.step
+      data = loadedStep.data if loadedStep is not None and loadedStep.module == moduleName else []
+      title = self.moduleTitle(moduleName)
+      modules.append(ModuleButtonProperty(moduleName, title[0:self.numberOfLabelText], data, name=title))
+
+    self.updateDockButtons(modules)
+    self.dockPanel.show()
+    self.scheduleDataPrefetch()
 
   def onLoad(self):
-    import os.path
-    self.loadFileFlag = 1
-
     fileName = qt.QFileDialog.getOpenFileName()
     if(fileName != ""):
-      self.clearItemList()
-      f = open(fileName, "rb")
-
-    if(fileName != ""):
-      l = 1
-      self.clearAllButtons() # clear self.module
-
-      while l:
-        l = f.readline()
-
-        if(l.find('#') == -1): # If the line is not a comment one...
-
-          splitText = l.split(',')
-          number = len(splitText)
-
-          if((l.find("<item>") >= 0 or l.find("<Item>") >= 0) and number >= 2): # If the line has ',', the code recognizes an item. 
-
-            splitText[0] = splitText[0].replace('<item>', '').replace('<Item>', '').rstrip().lstrip()
-            splitText[1] = splitText[1].replace('</item>', '').replace('</Item>', '').rstrip().lstrip()
-
-            moduleName = splitText[0]
-            label = splitText[1]
-            p = ModuleButtonProperty()
-            p.module = moduleName
-            p.label = label[0:self.numberOfLabelText]
-            self.modules.append(p)   
-            self.onPlusButton()
-            self.numberOfModule = self.numberOfModule + 1          
-
-          elif(l.find("<title>") >= 0 or l.find("<Title>") >= 0):
-            l = l.replace('<title>', '').replace('<Title>', '').replace('</title>', '').replace('</Title>', '').rstrip().lstrip()
-            if not l:
-              l = "Workflow Organizer"
-            self.dockPanel.windowTitle = l
-            self.wizardTitleTextBox.text = l
-    
-      f.close()
+      self.loadWorkflowFile(fileName)
+
+  def onLibraryButton(self):
+    directory = qt.QFileDialog.getExistingDirectory()
+    if(directory != ""):
+      qt.QSettings().setValue("WorkflowOrganizer/LibraryPath", directory)
+      self.openLibrary(directory)
+
+  def openLibrary(self, directory):
+    self.library = WorkflowLibrary(directory)
+    self.librarySelector.enabled = True
+    self.libraryRefreshButton.enabled = True
+    self.librarySelector.toolTip = directory
+    self.updateLibraryCatalog()
+
+  def updateLibraryCatalog(self):
+    startTime = time.time()
+    self.libraryCatalog = self.library.catalog()
+    self.librarySelector.clear()
+    self.librarySelector.addItem("Select a workflow")
+    for fileName, title, numberOfSteps in self.libraryCatalog:
+      self.librarySelector.addItem("%s (%d steps)" % (title, numberOfSteps))
+    print('Workflow library %s: %d workflows in %.3f s' % (
+      self.library.directory, len(self.libraryCatalog), time.time() - startTime))
+
+  def onLibraryWorkflowSelected(self, index):
+    if index <= 0:
+      return
+    fileName = self.libraryCatalog[index-1][0]
+    startTime = time.time()
+    workflow = self.library.workflow(fileName)
+    parseTime = time.time() - startTime
+    if workflow is None:
+      # The file was removed or changed since the catalog was made
+      self.updateLibraryCatalog()
+      return
+    self.workflowFileName = fileName
+    self.applyWorkflow(workflow, parseTime)
+
+  def loadWorkflowFile(self, fileName, interactive=True):
+    """Load a workflow file and return the steps whose module is not
+    installed (see applyWorkflow()). Unless 'interactive', no dialog is
+    shown: a newer autosave is kept for the Restore button instead of being
+    offered, and the missing modules are only printed."""
+    startTime = time.time()
+    self.workflowFileName = fileName
+    self.autosaveRestoreButton.enabled = False
+    autosaveFileName = self.autosaveFileName()
+    if os.path.exists(autosaveFileName):
+      newer = os.path.getmtime(autosaveFileName) > os.path.getmtime(fileName)
+      if newer and not interactive:
+        self.autosaveRestoreButton.enabled = True
+      elif newer and qt.QMessageBox.question(slicer.util.mainWindow(), "Workflow Organizer",
+                                             "%s has unsaved changes from a previous session. Restore them?" % fileName,
+                                             qt.QMessageBox.Yes | qt.QMessageBox.No) == qt.QMessageBox.Yes:
+        fileName = autosaveFileName
+      else:
+        self.fileWriter.remove(autosaveFileName)
+    workflow = readWorkflowFile(fileName)
+    parseTime = time.time() - startTime
+    return self.applyWorkflow(workflow, parseTime, interactive)
+
+  def applyWorkflow(self, workflow, parseTime=0.0, interactive=True):
+    """Build the selectors and the dock buttons of a parsed workflow in one pass.
+    Widget updates are suspended while the widgets are created, so the item
+    list and the dock are laid out and repainted only once.
+
+    Return the (stepIndex, moduleName, suggestions) of the steps whose
+    module is not installed; they are also reported, in a dialog if
+    'interactive'. While the module directories are being scanned, the
+    check is done when the scan is finished and nothing is returned.
+    """
+    startTime = time.time()
 
-      self.makeButtons()
+    self.clearItemList()
 
-    self.loadFileFlag = 0
+    # Check all the steps against the module index before the dock is built.
+    # While the module directories are being scanned, the check is deferred
+    # until the scan is done.
+    validationStartTime = time.time()
+    if self.isModuleScanRunning():
+      self.pendingValidation = (workflow, interactive)
+      missingSteps = []
+    else:
+      self.pendingValidation = None
+      missingSteps = self.validateWorkflow(workflow)
+    validationTime = time.time() - validationStartTime
+    self.reportMissingModules(missingSteps, interactive)
+    startTime = time.time()
 
-  def onBack(self):
+    self.createDockPanel()
+    self.extensionCollapsibleButton.setUpdatesEnabled(False)
+    self.dockPanel.setUpdatesEnabled(False)
+    try:
+      if workflow.title is not None:
+        self.dockPanel.windowTitle = workflow.title
+        self.wizardTitleTextBox.text = workflow.title
+
+      modules = []
+      # The included workflows are only read when their segment is entered
+      for step in workflow.entries():
+        if isinstance(step, WorkflowInclude):
+          modules.append(self.segmentButtonProperty(step))
+          self.addIncludeItem(step)
+          continue
+        modules.append(ModuleButtonProperty(step.module, step.label[0:self.numberOfLabelText], step.data, name=step.label))
+        self.addExtensionSelector(step.module, step)
+      self.updateItemListButtons()
+
+      self.updateDockButtons(modules)
+      self.dockPanel.show()
+      widgetTime = time.time() - startTime
+
+      startTime = time.time()
+    finally:
+      self.extensionCollapsibleButton.setUpdatesEnabled(True)
+      self.dockPanel.setUpdatesEnabled(True)
+    self.extensionFormLayout.activate()
+    self.dockLayout.activate()
+    layoutTime = time.time() - startTime
+
+    # Loading is not an edit
+    self.autosaveTimer.stop()
+    self.autosaveText = None
+    self.lastLoadTimings = {'parse': parseTime, 'validation': validationTime, 'widgets': widgetTime, 'layout': layoutTime}
+    print('Loaded %d items: parse %.3f s, validation %.3f s, widgets %.3f s, layout %.3f s' % (
+      len(workflow.steps), parseTime, validationTime, widgetTime, layoutTime))
+    self.scheduleDataPrefetch()
+    return missingSteps
+
+  def validateWorkflow(self, workflow):
+    # The near-miss suggestions need the search index, which is only
+    # requested when some module is missing.
+    similarNames = lambda name: self.moduleSearchIndex().similarNames(name)
+    return validateWorkflow(workflow, self.moduleRegistry, similarNames)
+
+  def reportMissingModules(self, missingSteps, interactive=True):
+    if not missingSteps:
+      return
+    lines = []
+    for stepIndex, moduleName, suggestions in missingSteps:
+      line = 'Step %d: %s' % (stepIndex + 1, moduleName)
+      if suggestions:
+        line = line + ' (did you mean %s?)' % ', '.join(suggestions)
+      lines.append(line)
+    message = '%d step(s) use modules that are not installed:\n\n%s' % (len(missingSteps), '\n'.join(lines))
+    print('WorkflowOrganizer: ' + message)
+    if interactive:
+      qt.QMessageBox.warning(slicer.util.mainWindow(), "Workflow Organizer", message)
+
+  def onBack(self, source='back'):
     n = len(self.modules)
     next = (self.currentModuleId -1 + n) % n
-    self.onModuleChange(next)
+    self.onModuleChange(next, source)
     self.WorkflowOrganizerButton.enabled = True
 
-  def onNext(self):
+  def onNext(self, source='next'):
     n = len(self.modules)
     next = (self.currentModuleId + 1) % n
-    self.onModuleChange(next)
+    self.onModuleChange(next, source)
     self.WorkflowOrganizerButton.enabled = True
 
+  def onRemoteToggled(self, checked):
+    qt.QSettings().setValue("WorkflowOrganizer/RemoteEnabled", checked)
+    if checked:
+      address = self.remoteAddressLineEdit.text.strip()
+      error = self.navigationServer.listen(address)
+      if error:
+        self.remoteStatusLabel.text = "Cannot listen on %s: %s" % (address, error)
+    else:
+      self.navigationServer.close()
+    self.updateRemoteStatus()
+
+  def onRemoteAddressChanged(self):
+    qt.QSettings().setValue("WorkflowOrganizer/RemoteAddress", self.remoteAddressLineEdit.text.strip())
+    if self.remoteCheckBox.checked:
+      self.onRemoteToggled(True)
+
+  def updateRemoteStatus(self):
+    if not self.navigationServer.isListening():
+      if not self.remoteCheckBox.checked:
+        self.remoteStatusLabel.text = ""
+      return
+    text = "Listening, %d client(s)" % len(self.navigationServer.connections)
+    latencies = sorted(self.navigationServer.latencies)
+    if latencies:
+      text += ", command p50 %.0f ms, p95 %.0f ms" % (percentile(latencies, 0.5) * 1000.0, percentile(latencies, 0.95) * 1000.0)
+    self.remoteStatusLabel.text = text
+
   def onWorkflowOrganizer(self):
-    slicer.util.selectModule("WorkflowOrganizer")
+    self.sampleResources('transition', -1, "WorkflowOrganizer")
+    self.selectModuleTimed("WorkflowOrganizer", 'organizer')
     self.modules[self.currentModuleId].button.setChecked(False)
     self.WorkflowOrganizerButton.enabled = False
 
@@ -582,7 +1838,8 @@ class WorkflowOrganizerWidget:
     import imp, sys, os, slicer
 
     #Delete Workflow Organizer Pane
-    self.dockPanel.close()
+    if self.dockPanel is not None:
+      self.dockPanel.close()
 
     widgetName = moduleName + "Widget"
     # reload the source code
@@ -634,6 +1891,218 @@ class WorkflowOrganizerWidget:
       qt.QMessageBox.warning(slicer.util.mainWindow(), 
           "Reload and Test", 'Exception!\n\n' + str(e) + "\n\nSee Python Console for Stack Trace")
 
+#
+# NavigationServer
+#
+class NavigationServer:
+  """Run the navigation commands received on a local socket.
+
+  A numeric address is a TCP port on 127.0.0.1, anything else the name of a
+  local socket (QLocalServer). The commands are read when the sockets signal
+  readyRead() and run right away on the GUI thread; the protocol is
+  described in WorkflowOrganizerLib/Remote.py. The time from reading a
+  command to writing its reply is kept in self.latencies.
+  """
+
+  def __init__(self, widget):
+    self.widget = widget
+    self.server = None
+    self.connections = []
+    self.subscribers = []
+    self.latencies = collections.deque(maxlen=1000)
+
+  def isListening(self):
+    return self.server is not None
+
+  def listen(self, address):
+    """Return None, or the error message if the server cannot listen."""
+    self.close()
+    if address.isdigit():
+      server = qt.QTcpServer()
+      listening = server.listen(qt.QHostAddress(qt.QHostAddress.LocalHost), int(address))
+    else:
+      # A socket file left by a crashed session would block listen()
+      qt.QLocalServer.removeServer(address)
+      server = qt.QLocalServer()
+      listening = server.listen(address)
+    if not listening:
+      return server.errorString()
+    server.connect('newConnection()', self.onNewConnection)
+    self.server = server
+    print('WorkflowOrganizer: listening for navigation commands on %s' % address)
+    return None
+
+  def close(self):
+    for connection in list(self.connections):
+      connection.close()
+    self.connections = []
+    self.subscribers = []
+    if self.server is not None:
+      self.server.close()
+      self.server = None
+
+  def onNewConnection(self):
+    while self.server.hasPendingConnections():
+      connection = self.server.nextPendingConnection()
+      self.connections.append(connection)
+      def onReadyRead(connection=connection): self.onReadyRead(connection)
+      def onDisconnected(connection=connection): self.onDisconnected(connection)
+      connection.connect('readyRead()', onReadyRead)
+      connection.connect('disconnected()', onDisconnected)
+    self.widget.updateRemoteStatus()
+
+  def onDisconnected(self, connection):
+    if connection in self.connections:
+      self.connections.remove(connection)
+    if connection in self.subscribers:
+      self.subscribers.remove(connection)
+    connection.deleteLater()
+    self.widget.updateRemoteStatus()
+
+  def onReadyRead(self, connection):
+    while connection.canReadLine():
+      startTime = time.time()
+      line = connection.readLine().data()
+      self.write(connection, self.execute(connection, line, startTime))
+    self.widget.updateRemoteStatus()
+
+  def write(self, connection, line):
+    connection.write(qt.QByteArray(line + '\n'))
+    connection.flush()
+
+  def currentStep(self, startTime=None, missingSteps=None):
+    # The reply to a navigation command also gives the time since startTime
+    from WorkflowOrganizerLib.Remote import stepReply
+    elapsedTime = None
+    if startTime is not None:
+      elapsedTime = time.time() - startTime
+      self.latencies.append(elapsedTime)
+    widget = self.widget
+    if not widget.modules:
+      return stepReply(0, 'None', elapsedTime, missingSteps)
+    return stepReply(widget.currentModuleId+1, widget.modules[widget.currentModuleId].module, elapsedTime, missingSteps)
+
+  def stepIndex(self, name):
+    modules = self.widget.modules
+    if name.isdigit() and 1 <= int(name) <= len(modules):
+      return int(name) - 1
+    for key in ('name', 'module'):
+      for index, p in enumerate(modules):
+        if getattr(p, key) == name:
+          return index
+    raise ValueError('no step %s' % name)
+
+  def execute(self, connection, line, startTime=None):
+    """Run one command line, read at startTime, and return the reply line."""
+    # The protocol (and socket) are only imported once a client connects
+    from WorkflowOrganizerLib.Remote import parseCommand
+    if startTime is None:
+      startTime = time.time()
+    widget = self.widget
+    try:
+      command, argument = parseCommand(line)
+      if command == 'ping':
+        return 'ok pong'
+      if command == 'subscribe':
+        if connection not in self.subscribers:
+          self.subscribers.append(connection)
+        return self.currentStep()
+      if command == 'status':
+        return self.currentStep()
+      if command == 'load':
+        if not os.path.isfile(argument):
+          raise ValueError('no file %s' % argument)
+        # No dialog: the client would wait for someone to close it, and its
+        # next commands would be read by the nested event loop.
+        missingSteps = widget.loadWorkflowFile(argument, interactive=False)
+        return self.currentStep(startTime, [(stepIndex+1, moduleName) for stepIndex, moduleName, suggestions in missingSteps])
+      if not widget.modules:
+        raise ValueError('no workflow')
+      if command == 'next':
+        widget.onNext('remote')
+      elif command == 'back':
+        widget.onBack('remote')
+      elif command == 'goto':
+        widget.onModuleChange(self.stepIndex(argument), 'remote')
+      return self.currentStep(startTime)
+    except ValueError as e:
+      return 'error %s' % e
+    except Exception as e:
+      # Failing to read the file or to enter the module; the client still
+      # gets a reply instead of waiting for one.
+      return 'error %s: %s' % (type(e).__name__, e)
+
+  def publishStep(self, index, p):
+    for connection in self.subscribers:
+      self.write(connection, 'step %d %s %s' % (index+1, p.module, p.name))
+
+#
+# ModuleWidgetPrefetcher
+#
+class ModuleWidgetPrefetcher:
+  """Create the widget representation of modules while the event loop is idle.
+
+  Slicer instantiates the widget of a module the first time the module is
+  selected, which may take a while. The prefetcher does it ahead of time, one
+  module per timer tick. It waits while user events are pending, and a module
+  that takes longer than 'budget' seconds pushes the next one back by
+  'idleDelay' milliseconds.
+  """
+
+  def __init__(self):
+    self.budget = 0.1
+    self.idleDelay = 250
+    self.queue = []
+    self.warmedModules = set()
+    self.timer = qt.QTimer()
+    self.timer.setSingleShot(True)
+    self.timer.connect('timeout()', self.onTimer)
+
+  def prefetch(self, moduleNames):
+    # Replaces the previous requests, which belong to the previous step
+    self.queue = []
+    for moduleName in moduleNames:
+      if moduleName not in self.warmedModules and moduleName not in self.queue and moduleName != "None":
+        self.queue.append(moduleName)
+    if self.queue:
+      self.timer.start(self.idleDelay)
+
+  def moduleEntered(self, moduleName):
+    self.warmedModules.add(moduleName)
+    if moduleName in self.queue:
+      self.queue.remove(moduleName)
+
+  def stop(self):
+    self.timer.stop()
+    self.queue = []
+
+  def onTimer(self):
+    if not self.queue:
+      return
+    if slicer.app.hasPendingEvents():
+      # Leave the event loop to the user
+      self.timer.start(self.idleDelay)
+      return
+
+    moduleName = self.queue.pop(0)
+    startTime = time.time()
+    self.warmUp(moduleName)
+    elapsedTime = time.time() - startTime
+    self.warmedModules.add(moduleName)
+    print('Prefetched %s in %.3f s' % (moduleName, elapsedTime))
+
+    if self.queue:
+      self.timer.start(0 if elapsedTime <= self.budget else self.idleDelay)
+
+  def warmUp(self, moduleName):
+    module = slicer.app.moduleManager().module(moduleName)
+    if module is None:
+      return
+    try:
+      module.widgetRepresentation()
+    except Exception as e:
+      print('WorkflowOrganizer: could not prefetch %s: %s' % (moduleName, e))
+
 #
 # WorkflowOrganizerLogic
 #
@@ -641,34 +2110,13 @@ class WorkflowOrganizerLogic:
   def __init__(self):
     pass
 
-class WorkflowOrganizerTest(unittest.TestCase):
-  def delayDisplay(self,message,msec=1000):
-    """This utility method displays a small dialog and waits.
-    This does two things: 1) it lets the event loop catch up
-    to the state of the test so that rendering and widget updates
-    have all taken place before the test continues and 2) it
-    shows the user/developer/tester the state of the test
-    so that we'll know when it breaks.
-    """
-    print(message)
-    self.info = qt.QDialog()
-    self.infoLayout = qt.QVBoxLayout()
-    self.info.setLayout(self.infoLayout)
-    self.label = qt.QLabel(message,self.info)
-    self.infoLayout.addWidget(self.label)
-    qt.QTimer.singleShot(msec, self.info.close)
-    self.info.exec_()
-
-  def setUp(self):
-    """ Do whatever is needed to reset the state - typically a scene clear will be enough.
-    """
-    slicer.mrmlScene.Clear(0)
-
-  def runTest(self):
-    """Run as few or as many tests as needed here.
-    """
-    self.setUp()
-    self.test_WorkflowOrganizer1()
+#
+# WorkflowOrganizerTest
+#
+def WorkflowOrganizerTest(*args):
+  """Create the self test. unittest and the test case are only imported
+  when the tests are run, not every time the module is loaded."""
+  from WorkflowOrganizerLib.SelfTest import WorkflowOrganizerTest
+  return WorkflowOrganizerTest(*args)
 
-  def test_WorkflowOrganizer1(self):
-    self.delayDisplay('Test passed!')
+startupTimings['import'] = time.time() - importStartTime
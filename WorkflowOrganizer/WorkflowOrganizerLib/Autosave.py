@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+import collections
+
+def writeFileAtomically(fileName, text):
+  """Write 'text' to a temporary file next to fileName and rename it, so
+  that fileName always holds either the old or the new content."""
+  if isinstance(text, unicode):
+    text = text.encode('utf-8')
+  tmpFileName = fileName + '.tmp'
+  f = open(tmpFileName, 'wb')
+  try:
+    f.write(text)
+    f.flush()
+    os.fsync(f.fileno())
+  finally:
+    f.close()
+  if os.name == 'nt' and os.path.exists(fileName):
+    os.remove(fileName) # os.rename() does not overwrite on Windows
+  os.rename(tmpFileName, fileName)
+
+#
+# BackgroundFileWriter
+#
+class BackgroundFileWriter(object):
+  """Write and remove files on a background thread.
+
+  save() and remove() only record the request and return. A file requested
+  again before it was written is written once, with the latest text, so a
+  slow disk or network share delays the writes but never piles them up.
+  The result of the last request is in lastFileName, lastWriteTime,
+  lastWallTime and lastError, to be polled by the GUI.
+  """
+
+  def __init__(self):
+    self.condition = threading.Condition()
+    # fileName -> text, or None to remove the file
+    self.pending = collections.OrderedDict()
+    self.busy = False
+    self.thread = None
+    self.numberOfWrites = 0
+    self.lastFileName = None
+    self.lastWriteTime = None
+    self.lastWallTime = 0.0
+    self.lastError = None
+
+  def save(self, fileName, text):
+    self.submit(fileName, text)
+
+  def remove(self, fileName):
+    self.submit(fileName, None)
+
+  def submit(self, fileName, text):
+    self.condition.acquire()
+    try:
+      if fileName in self.pending:
+        del self.pending[fileName]
+      self.pending[fileName] = text
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+      self.condition.notifyAll()
+    finally:
+      self.condition.release()
+
+  def isBusy(self):
+    self.condition.acquire()
+    try:
+      return self.busy or len(self.pending) > 0
+    finally:
+      self.condition.release()
+
+  def flush(self, timeout=None):
+    """Wait until the pending requests are done, at most 'timeout' seconds.
+    Return False on timeout."""
+    endTime = time.time() + timeout if timeout is not None else None
+    self.condition.acquire()
+    try:
+      while self.busy or self.pending:
+        if endTime is None:
+          self.condition.wait()
+        else:
+          remaining = endTime - time.time()
+          if remaining <= 0:
+            return False
+          self.condition.wait(remaining)
+      return True
+    finally:
+      self.condition.release()
+
+  def run(self):
+    while True:
+      self.condition.acquire()
+      try:
+        if not self.pending:
+          # Started again by the next request
+          self.thread = None
+          return
+        fileName, text = self.pending.popitem(last=False)
+        self.busy = True
+      finally:
+        self.condition.release()
+
+      startTime = time.time()
+      error = None
+      try:
+        if text is None:
+          if os.path.exists(fileName):
+            os.remove(fileName)
+        else:
+          writeFileAtomically(fileName, text)
+      except (IOError, OSError) as e:
+        error = str(e)
+
+      self.condition.acquire()
+      try:
+        self.busy = False
+        self.numberOfWrites = self.numberOfWrites + 1
+        self.lastFileName = fileName
+        self.lastWriteTime = time.time()
+        self.lastWallTime = self.lastWriteTime - startTime
+        self.lastError = error
+        self.condition.notifyAll()
+      finally:
+        self.condition.release()
@@ -0,0 +1,301 @@
+"""Run a workflow over many cases.
+
+  python -m WorkflowOrganizerLib.Batch [options] --output DIR workflow.txt CASEDIR...
+
+Each case is run by its own worker process (WorkflowOrganizerLib.Runner with
+{case} set to the case directory and {output} to the output directory of the
+case), and up to --workers cases run at the same time. A case that fails or
+runs longer than --timeout is retried up to --retries times. The output
+directory gets a manifest.json with the status and attempts of every case,
+updated as the cases finish, and a timings.csv with the wall time of every
+step of every case.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import signal
+import subprocess
+
+caseStates = ('pending', 'running', 'done', 'failed', 'timeout')
+
+#
+# BatchCase
+#
+class BatchCase(object):
+
+  def __init__(self, name, directory, outputDirectory):
+    self.name = name
+    self.directory = directory
+    self.outputDirectory = outputDirectory
+    self.status = 'pending'
+    self.attempts = []
+    self.process = None
+    self.log = None
+    self.startTime = None
+
+  def toDict(self):
+    return {'name': self.name, 'directory': self.directory, 'output': self.outputDirectory,
+            'status': self.status, 'attempts': self.attempts}
+
+def caseNames(directories):
+  """Unique names of the case directories, from their base names."""
+  names = []
+  used = set()
+  for directory in directories:
+    base = os.path.basename(os.path.normpath(directory)) or 'case'
+    name = base
+    n = 2
+    while name in used:
+      name = '%s-%d' % (base, n)
+      n = n + 1
+    used.add(name)
+    names.append(name)
+  return names
+
+#
+# BatchRunner
+#
+class BatchRunner(object):
+  """Fan a workflow out over case directories on a pool of worker processes.
+
+  'runnerArguments' are passed to every WorkflowOrganizerLib.Runner worker
+  (e.g. --slicer, --module-path, --set). The workers are polled rather than
+  waited for, so a case that exceeds 'timeout' seconds can be killed
+  together with the processes it started.
+  """
+
+  pollInterval = 0.1
+
+  def __init__(self, workflowFileName, caseDirectories, outputDirectory, numberOfWorkers=None,
+               timeout=None, retries=0, runnerArguments=None, stepThreads=1):
+    if numberOfWorkers is None:
+      import multiprocessing
+      numberOfWorkers = multiprocessing.cpu_count()
+    self.workflowFileName = os.path.abspath(workflowFileName)
+    self.outputDirectory = os.path.abspath(outputDirectory)
+    self.numberOfWorkers = max(1, numberOfWorkers)
+    self.timeout = timeout
+    self.retries = retries
+    self.runnerArguments = list(runnerArguments or [])
+    self.stepThreads = stepThreads
+    self.cases = []
+    for name, directory in zip(caseNames(caseDirectories), caseDirectories):
+      self.cases.append(BatchCase(name, os.path.abspath(directory), os.path.join(self.outputDirectory, name)))
+    self.elapsedTime = 0.0
+
+  def manifestFileName(self):
+    return os.path.join(self.outputDirectory, 'manifest.json')
+
+  def resume(self):
+    """Mark the cases done by a previous run of the same batch as done."""
+    try:
+      f = open(self.manifestFileName(), 'r')
+      try:
+        manifest = json.load(f)
+      finally:
+        f.close()
+    except (IOError, ValueError):
+      return
+    previous = dict([(case['directory'], case) for case in manifest.get('cases', [])])
+    for case in self.cases:
+      record = previous.get(case.directory)
+      if record is not None and record['status'] == 'done':
+        case.status = 'done'
+        case.attempts = record['attempts']
+
+  def workerCommand(self, case):
+    return [sys.executable, '-m', 'WorkflowOrganizerLib.Runner',
+            '--set', 'case=%s' % case.directory,
+            '--set', 'output=%s' % case.outputDirectory,
+            '--threads', str(self.stepThreads),
+            '--report', os.path.join(case.outputDirectory, 'steps.json')] + \
+            self.runnerArguments + [self.workflowFileName]
+
+  def start(self, case):
+    if not os.path.isdir(case.outputDirectory):
+      os.makedirs(case.outputDirectory)
+    stepsFileName = os.path.join(case.outputDirectory, 'steps.json')
+    if os.path.exists(stepsFileName):
+      os.remove(stepsFileName)
+    case.log = open(os.path.join(case.outputDirectory, 'log-%d.txt' % (len(case.attempts)+1)), 'w')
+    kwargs = {}
+    if os.name == 'posix':
+      # A process group, so that a timeout also stops the CLI processes
+      kwargs['preexec_fn'] = os.setsid
+    # The worker imports WorkflowOrganizerLib from the module directory
+    libParent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    case.process = subprocess.Popen(self.workerCommand(case), stdout=case.log, stderr=subprocess.STDOUT,
+                                    cwd=libParent, **kwargs)
+    case.startTime = time.time()
+    case.status = 'running'
+
+  def kill(self, case):
+    try:
+      if os.name == 'posix':
+        os.killpg(case.process.pid, signal.SIGKILL)
+      else:
+        subprocess.call(['taskkill', '/F', '/T', '/PID', str(case.process.pid)])
+    except OSError:
+      pass
+    case.process.wait()
+
+  def finish(self, case, status):
+    case.log.close()
+    case.attempts.append({'status': status, 'returnCode': case.process.returncode,
+                          'startTime': case.startTime, 'wallTime': time.time() - case.startTime})
+    case.process = None
+    case.log = None
+    if status != 'done' and len(case.attempts) <= self.retries:
+      case.status = 'pending'
+    else:
+      case.status = status
+
+  def run(self, caseFinished=None):
+    """Run the pending cases. caseFinished(case) is called after each attempt."""
+    startTime = time.time()
+    if not os.path.isdir(self.outputDirectory):
+      os.makedirs(self.outputDirectory)
+    running = []
+    try:
+      while True:
+        for case in self.cases:
+          if len(running) >= self.numberOfWorkers:
+            break
+          if case.status == 'pending':
+            self.start(case)
+            running.append(case)
+        if not running:
+          break
+        time.sleep(self.pollInterval)
+        for case in list(running):
+          if case.process.poll() is not None:
+            status = 'done' if case.process.returncode == 0 else 'failed'
+          elif self.timeout is not None and time.time() - case.startTime > self.timeout:
+            self.kill(case)
+            status = 'timeout'
+          else:
+            continue
+          running.remove(case)
+          self.finish(case, status)
+          self.writeManifest()
+          if caseFinished:
+            caseFinished(case)
+    finally:
+      for case in running:
+        self.kill(case)
+        self.finish(case, 'failed')
+      self.elapsedTime = time.time() - startTime
+      self.writeManifest()
+      self.writeTimings()
+
+  def writeManifest(self):
+    counts = dict([(state, 0) for state in caseStates])
+    for case in self.cases:
+      counts[case.status] = counts[case.status] + 1
+    manifest = {'workflow': self.workflowFileName, 'workers': self.numberOfWorkers,
+                'timeout': self.timeout, 'retries': self.retries,
+                'elapsedTime': self.elapsedTime, 'counts': counts,
+                'cases': [case.toDict() for case in self.cases]}
+    # Written to a temporary file first, so an interrupted batch always
+    # leaves a complete manifest for resume()
+    fileName = self.manifestFileName()
+    f = open(fileName + '.tmp', 'w')
+    try:
+      json.dump(manifest, f, indent=2)
+    finally:
+      f.close()
+    if os.path.exists(fileName):
+      os.remove(fileName) # os.rename() does not overwrite on Windows
+    os.rename(fileName + '.tmp', fileName)
+
+  def writeTimings(self):
+    f = open(os.path.join(self.outputDirectory, 'timings.csv'), 'wb')
+    try:
+      writer = csv.writer(f)
+      writer.writerow(['case', 'status', 'attempts', 'caseWallTime', 'step', 'label', 'module', 'stepStatus', 'stepStart', 'stepWallTime'])
+      for case in self.cases:
+        if not case.attempts:
+          continue
+        caseRow = [case.name, case.status, len(case.attempts), '%.3f' % case.attempts[-1]['wallTime']]
+        steps = self.readSteps(case)
+        if not steps:
+          writer.writerow(caseRow + ['', '', '', '', '', ''])
+        for step in steps:
+          writer.writerow(caseRow + [step['index']+1, step['label'], step['module'], step['status'],
+                                     '' if step['startTime'] is None else '%.3f' % step['startTime'],
+                                     '' if step['wallTime'] is None else '%.3f' % step['wallTime']])
+    finally:
+      f.close()
+
+  def readSteps(self, case):
+    try:
+      f = open(os.path.join(case.outputDirectory, 'steps.json'), 'r')
+      try:
+        return json.load(f)['steps']
+      finally:
+        f.close()
+    except (IOError, ValueError, KeyError):
+      return []
+
+def readCaseList(fileName):
+  """One case directory per line; empty lines and lines starting with '#'
+  are skipped."""
+  f = open(fileName, 'r')
+  try:
+    return [l.strip() for l in f if l.strip() and not l.strip().startswith('#')]
+  finally:
+    f.close()
+
+def main(argv):
+  from optparse import OptionParser
+  parser = OptionParser(usage="python -m WorkflowOrganizerLib.Batch [options] --output DIR workflow.txt [CASEDIR...]")
+  parser.add_option("--output", dest="output", default=None, help="output directory of the batch")
+  parser.add_option("--cases", dest="casesFile", default=None, help="file listing the case directories, one per line")
+  parser.add_option("--workers", dest="numberOfWorkers", type="int", default=None,
+                    help="number of cases run at the same time (default: number of cores)")
+  parser.add_option("--step-threads", dest="stepThreads", type="int", default=1,
+                    help="number of steps of a case run at the same time (default: 1)")
+  parser.add_option("--timeout", dest="timeout", type="float", default=None, help="time limit of a case in seconds")
+  parser.add_option("--retries", dest="retries", type="int", default=0, help="number of retries of a failed case")
+  parser.add_option("--resume", dest="resume", action="store_true", default=False,
+                    help="skip the cases done by a previous run into the same output directory")
+  parser.add_option("--slicer", dest="slicer", default=None, help="Slicer executable, passed to the workers")
+  parser.add_option("--module-path", dest="modulePaths", action="append", default=[],
+                    help="additional directory of CLI modules (may be repeated)")
+  parser.add_option("--set", dest="assignments", action="append", default=[],
+                    help="value of a {name} in the arguments, as name=value (may be repeated)")
+  (options, args) = parser.parse_args(argv)
+  if not args or not options.output:
+    parser.error("expected --output and a workflow file")
+  caseDirectories = args[1:]
+  if options.casesFile:
+    caseDirectories = caseDirectories + readCaseList(options.casesFile)
+  if not caseDirectories:
+    parser.error("no case directories")
+
+  runnerArguments = []
+  if options.slicer:
+    runnerArguments += ['--slicer', os.path.abspath(options.slicer)]
+  for path in options.modulePaths:
+    runnerArguments += ['--module-path', os.path.abspath(path)]
+  for assignment in options.assignments:
+    runnerArguments += ['--set', assignment]
+
+  batch = BatchRunner(args[0], caseDirectories, options.output, options.numberOfWorkers,
+                      options.timeout, options.retries, runnerArguments, options.stepThreads)
+  if options.resume:
+    batch.resume()
+  def caseFinished(case):
+    attempt = case.attempts[-1]
+    print('%s: %s in %.1f s (attempt %d)' % (case.name, attempt['status'], attempt['wallTime'], len(case.attempts)))
+  batch.run(caseFinished)
+
+  counts = dict([(state, len([case for case in batch.cases if case.status == state])) for state in caseStates])
+  print('%d cases in %.1f s: %d done, %d failed, %d timed out' % (
+    len(batch.cases), batch.elapsedTime, counts['done'], counts['failed'], counts['timeout']))
+  return 0 if counts['done'] == len(batch.cases) else 1
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
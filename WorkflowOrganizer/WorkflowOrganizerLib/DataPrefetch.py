@@ -0,0 +1,172 @@
+import os
+import threading
+
+dataStates = ('queued', 'reading', 'ready', 'loaded', 'skipped', 'failed')
+
+#
+# DataPrefetcher
+#
+class DataPrefetcher(object):
+  """Read the data files of the upcoming steps on background threads.
+
+  The files are read in the order they were requested, in chunks and
+  discarded, so that the operating system has them in its file cache when
+  the step is entered and the file is loaded into the scene. The bytes of
+  the files being read or ready count against memoryLimit until release()
+  is called for them; a file that does not fit waits for the files before
+  it to be released, and a file larger than memoryLimit is skipped.
+  """
+
+  def __init__(self, numberOfThreads=2, memoryLimit=2048*1024*1024, chunkSize=4*1024*1024):
+    self.numberOfThreads = numberOfThreads
+    self.memoryLimit = memoryLimit
+    self.chunkSize = chunkSize
+    self.condition = threading.Condition()
+    self.queue = []
+    self.states = {}
+    self.sizes = {}
+    self.bytesHeld = 0
+    self.numberOfWorkers = 0
+    self.stopped = False
+
+  def prefetch(self, fileNames):
+    """Replace the queued files by fileNames, in order. Files already being
+    read, ready or loaded are not read again; the files being read or ready
+    that are not in fileNames any more, e.g. those of skipped steps, are
+    forgotten and free their share of the memory limit."""
+    self.condition.acquire()
+    try:
+      self.stopped = False
+      for fileName in self.queue:
+        del self.states[fileName]
+      self.queue = []
+      requested = set(fileNames)
+      for fileName, state in list(self.states.items()):
+        if state in ('reading', 'ready') and fileName not in requested:
+          self.bytesHeld = self.bytesHeld - self.sizes[fileName]
+          del self.states[fileName]
+      for fileName in fileNames:
+        if fileName in self.states or fileName in self.queue:
+          continue
+        try:
+          size = os.path.getsize(fileName)
+        except OSError:
+          self.states[fileName] = 'failed'
+          continue
+        self.sizes[fileName] = size
+        if size > self.memoryLimit:
+          self.states[fileName] = 'skipped'
+          continue
+        self.states[fileName] = 'queued'
+        self.queue.append(fileName)
+      while self.numberOfWorkers < min(self.numberOfThreads, len(self.queue)):
+        self.numberOfWorkers = self.numberOfWorkers + 1
+        worker = threading.Thread(target=self.run)
+        worker.daemon = True
+        worker.start()
+      self.condition.notifyAll()
+    finally:
+      self.condition.release()
+
+  def release(self, fileName):
+    """Mark fileName as loaded into the scene, which frees its share of the
+    memory limit."""
+    self.condition.acquire()
+    try:
+      state = self.states.get(fileName)
+      if state in ('reading', 'ready'):
+        self.bytesHeld = self.bytesHeld - self.sizes[fileName]
+      elif state == 'queued':
+        self.queue.remove(fileName)
+      self.states[fileName] = 'loaded'
+      self.condition.notifyAll()
+    finally:
+      self.condition.release()
+
+  def state(self, fileName):
+    return self.states.get(fileName)
+
+  def summary(self):
+    """Return the number of files in each state and the bytes held."""
+    self.condition.acquire()
+    try:
+      counts = dict([(state, 0) for state in dataStates])
+      for state in self.states.values():
+        counts[state] = counts[state] + 1
+      counts['bytesHeld'] = self.bytesHeld
+      return counts
+    finally:
+      self.condition.release()
+
+  def isActive(self):
+    self.condition.acquire()
+    try:
+      return len(self.queue) > 0 or 'reading' in self.states.values()
+    finally:
+      self.condition.release()
+
+  def clear(self):
+    """Forget all the files, e.g. when another workflow is loaded."""
+    self.condition.acquire()
+    try:
+      self.queue = []
+      self.states = {}
+      self.sizes = {}
+      self.bytesHeld = 0
+      self.condition.notifyAll()
+    finally:
+      self.condition.release()
+
+  def stop(self):
+    self.condition.acquire()
+    try:
+      self.stopped = True
+      self.condition.notifyAll()
+    finally:
+      self.condition.release()
+
+  def nextFile(self):
+    # Called with the lock held. Files are read strictly in order, so a
+    # later step never takes the memory needed by an earlier one.
+    while not self.stopped and self.queue:
+      fileName = self.queue[0]
+      if self.bytesHeld + self.sizes[fileName] <= self.memoryLimit:
+        del self.queue[0]
+        self.states[fileName] = 'reading'
+        self.bytesHeld = self.bytesHeld + self.sizes[fileName]
+        return fileName
+      self.condition.wait()
+    return None
+
+  def run(self):
+    while True:
+      self.condition.acquire()
+      try:
+        fileName = self.nextFile()
+        if fileName is None:
+          self.numberOfWorkers = self.numberOfWorkers - 1
+          return
+      finally:
+        self.condition.release()
+
+      state = 'ready'
+      try:
+        f = open(fileName, 'rb')
+        try:
+          while f.read(self.chunkSize):
+            if self.stopped:
+              break
+        finally:
+          f.close()
+      except IOError:
+        state = 'failed'
+
+      self.condition.acquire()
+      try:
+        if self.states.get(fileName) == 'reading':
+          self.states[fileName] = state
+          if state == 'failed':
+            self.bytesHeld = self.bytesHeld - self.sizes[fileName]
+        self.condition.notifyAll()
+      finally:
+        self.condition.release()
@@ -0,0 +1,363 @@
+import os
+import time
+import json
+import collections
+
+# psutil is imported by the first residentSetSize() call, not with this
+# module, which the widget and the remote client load at startup.
+psutil = None
+psutilImported = False
+
+def percentile(sortedValues, fraction):
+  """Nearest-rank percentile of an already sorted list."""
+  if not sortedValues:
+    return 0.0
+  rank = int(round(fraction * (len(sortedValues) - 1)))
+  return sortedValues[rank]
+
+#
+# TransitionRecorder
+#
+class TransitionRecorder(object):
+  """Record the latency of the step transitions.
+
+  Each record holds the time spent in slicer.util.selectModule() ('select')
+  and the time until the event loop was idle again ('total'), both in
+  seconds. The most recent 'maximumNumberOfRecords' are kept.
+  """
+
+  fields = ('timestamp', 'source', 'fromModule', 'toModule', 'select', 'total')
+
+  def __init__(self, maximumNumberOfRecords=10000):
+    self.records = collections.deque(maxlen=maximumNumberOfRecords)
+
+  def record(self, source, fromModule, toModule, selectTime, totalTime, timestamp=None):
+    if timestamp is None:
+      timestamp = time.time()
+    self.records.append((timestamp, source, fromModule, toModule, selectTime, totalTime))
+
+  def clear(self):
+    self.records.clear()
+
+  def summary(self):
+    """Return a list of per-module statistics sorted by decreasing p95 of the
+    total latency.
+    """
+    latencies = {}
+    for timestamp, source, fromModule, toModule, selectTime, totalTime in self.records:
+      selectTimes, totalTimes = latencies.setdefault(toModule, ([], []))
+      selectTimes.append(selectTime)
+      totalTimes.append(totalTime)
+    summary = []
+    for moduleName, (selectTimes, totalTimes) in latencies.items():
+      selectTimes.sort()
+      totalTimes.sort()
+      summary.append({
+        'module': moduleName,
+        'count': len(totalTimes),
+        'selectP50': percentile(selectTimes, 0.5),
+        'selectP95': percentile(selectTimes, 0.95),
+        'selectMax': selectTimes[-1],
+        'totalP50': percentile(totalTimes, 0.5),
+        'totalP95': percentile(totalTimes, 0.95),
+        'totalMax': totalTimes[-1],
+        })
+    summary.sort(key=lambda s: s['totalP95'], reverse=True)
+    return summary
+
+  def exportCSV(self, fileName):
+    import csv
+    f = open(fileName, 'wb')
+    try:
+      writer = csv.writer(f)
+      writer.writerow(self.fields)
+      for r in self.records:
+        writer.writerow(r)
+    finally:
+      f.close()
+
+  def exportJSON(self, fileName):
+    f = open(fileName, 'w')
+    try:
+      json.dump({
+        'transitions': [dict(zip(self.fields, r)) for r in self.records],
+        'summary': self.summary(),
+        }, f, indent=2)
+    finally:
+      f.close()
+
+  def export(self, fileName):
+    if fileName.lower().endswith('.json'):
+      self.exportJSON(fileName)
+    else:
+      self.exportCSV(fileName)
+
+def residentSetSize():
+  """Current resident set size of the process in bytes, or None if it
+  cannot be read. psutil is used if it is installed; otherwise it is read
+  from /proc on Linux, and the peak RSS from getrusage() is used elsewhere."""
+  global psutil, psutilImported
+  if not psutilImported:
+    psutilImported = True
+    try:
+      import psutil
+    except ImportError:
+      psutil = None
+  if psutil is not None:
+    return psutil.Process(os.getpid()).memory_info().rss
+  try:
+    f = open('/proc/self/statm', 'r')
+    try:
+      residentPages = int(f.read().split()[1])
+    finally:
+      f.close()
+    return residentPages * os.sysconf('SC_PAGE_SIZE')
+  except (IOError, OSError, ValueError, IndexError):
+    pass
+  try:
+    import resource
+    import sys
+    maximumResidentSetSize = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on Mac OS X
+    return maximumResidentSetSize if sys.platform == 'darwin' else maximumResidentSetSize * 1024
+  except ImportError:
+    return None
+
+def cpuTime():
+  """User and system CPU time of the process in seconds."""
+  times = os.times()
+  return times[0] + times[1]
+
+#
+# ResourceRecorder
+#
+class ResourceRecorder(object):
+  """Record the resource usage of the process along a case.
+
+  Each sample holds the RSS, the CPU time and the number of MRML nodes, and
+  is attributed to the workflow step that is active from then on: a sample
+  is taken when a step is entered, and optionally at a fixed interval while
+  it is active. The usage between two samples (CPU time, RSS growth) is
+  charged to the step of the first one. The most recent
+  'maximumNumberOfSamples' are kept.
+  """
+
+  fields = ('timestamp', 'kind', 'step', 'module', 'rss', 'cpuTime', 'nodes')
+
+  def __init__(self, maximumNumberOfSamples=20000):
+    self.samples = collections.deque(maxlen=maximumNumberOfSamples)
+    self.caseStartTime = time.time()
+
+  def sample(self, kind, step, module, numberOfNodes, timestamp=None):
+    """kind is 'transition' or 'periodic'; step is the index of the step."""
+    if timestamp is None:
+      timestamp = time.time()
+    self.samples.append((timestamp, kind, step, module, residentSetSize(), cpuTime(), numberOfNodes))
+
+  def clear(self):
+    """Start a new case."""
+    self.samples.clear()
+    self.caseStartTime = time.time()
+
+  def summary(self):
+    """Return per-step statistics in step order: time and CPU time spent in
+    the step, RSS growth while it was active, peak RSS and peak node count."""
+    steps = {}
+    previous = None
+    for sample in self.samples:
+      timestamp, kind, step, module, rss, cpu, nodes = sample
+      s = steps.setdefault((step, module), {'step': step, 'module': module, 'visits': 0, 'time': 0.0,
+                                            'cpuTime': 0.0, 'rssGrowth': 0, 'peakRSS': 0, 'peakNodes': 0})
+      if kind == 'transition':
+        s['visits'] = s['visits'] + 1
+      s['peakRSS'] = max(s['peakRSS'], rss or 0)
+      s['peakNodes'] = max(s['peakNodes'], nodes)
+      if previous is not None:
+        p = steps[(previous[2], previous[3])]
+        p['time'] = p['time'] + timestamp - previous[0]
+        p['cpuTime'] = p['cpuTime'] + cpu - previous[5]
+        if rss is not None and previous[4] is not None:
+          p['rssGrowth'] = p['rssGrowth'] + rss - previous[4]
+      previous = sample
+    return sorted(steps.values(), key=lambda s: (s['step'], s['module']))
+
+  def exportCSV(self, fileName):
+    import csv
+    f = open(fileName, 'wb')
+    try:
+      writer = csv.writer(f)
+      writer.writerow(('elapsed',) + self.fields)
+      for r in self.samples:
+        writer.writerow(('%.3f' % (r[0] - self.caseStartTime),) + r)
+    finally:
+      f.close()
+
+  def exportJSON(self, fileName, case=None):
+    """'case' is a dict describing the case, e.g. the workflow title."""
+    f = open(fileName, 'w')
+    try:
+      json.dump({
+        'case': dict(case or {}, startTime=self.caseStartTime),
+        'timeline': [dict(zip(self.fields, r), elapsed=r[0] - self.caseStartTime) for r in self.samples],
+        'summary': self.summary(),
+        }, f, indent=2)
+    finally:
+      f.close()
+
+  def export(self, fileName, case=None):
+    if fileName.lower().endswith('.json'):
+      self.exportJSON(fileName, case)
+    else:
+      self.exportCSV(fileName)
+
+#
+# WarmUpProfiler
+#
+class WarmUpProfiler(object):
+  """Measure the first entry into each module of a workflow.
+
+  measure() times the creation of the module widget ('instantiate') and the
+  selection of the module until the event loop is idle ('enter'), and the
+  RSS growth over both. With profileCalls, the calls are recorded with
+  cProfile and the 'numberOfCallSites' functions with the largest own time
+  are kept; the profiler slows the Python code down, so times measured with
+  and without it should not be compared.
+  """
+
+  fields = ('step', 'module', 'instantiate', 'enter', 'total', 'rssGrowth')
+
+  def __init__(self, profileCalls=False, numberOfCallSites=10):
+    self.profileCalls = profileCalls
+    self.numberOfCallSites = numberOfCallSites
+    self.records = []
+
+  def measure(self, step, module, instantiate, enter):
+    """Call instantiate() then enter() and record their cost. An exception
+    is recorded in the 'error' field of the record."""
+    profiler = None
+    if self.profileCalls:
+      import cProfile
+      profiler = cProfile.Profile()
+    error = None
+    startRSS = residentSetSize()
+    startTime = time.time()
+    instantiateTime = None
+    if profiler is not None:
+      profiler.enable()
+    try:
+      try:
+        instantiate()
+        instantiateTime = time.time() - startTime
+        enter()
+      except Exception as e:
+        error = str(e)
+    finally:
+      if profiler is not None:
+        profiler.disable()
+    totalTime = time.time() - startTime
+    endRSS = residentSetSize()
+    if instantiateTime is None:
+      instantiateTime = totalTime
+    record = {
+      'step': step,
+      'module': module,
+      'instantiate': instantiateTime,
+      'enter': totalTime - instantiateTime,
+      'total': totalTime,
+      'rssGrowth': endRSS - startRSS if startRSS is not None and endRSS is not None else None,
+      'callSites': self.callSites(profiler) if profiler is not None else [],
+      'error': error,
+      }
+    self.records.append(record)
+    return record
+
+  def callSites(self, profiler):
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    # Without the call that stops the profiler
+    sites = [item for item in stats.items() if '_lsprof' not in item[0][2]]
+    sites = sorted(sites, key=lambda item: item[1][2], reverse=True)[0:self.numberOfCallSites]
+    return [{'function': '%s:%d(%s)' % (os.path.basename(fileName), line, function),
+             'calls': numberOfCalls, 'ownTime': ownTime, 'cumulativeTime': cumulativeTime}
+            for (fileName, line, function), (primitiveCalls, numberOfCalls, ownTime, cumulativeTime, callers) in sites]
+
+  def ranking(self):
+    """The records sorted by decreasing total time."""
+    return sorted(self.records, key=lambda r: r['total'], reverse=True)
+
+  def compare(self, baseline, tolerance=0.5, minimumTime=0.05, minimumRSS=16*1024*1024):
+    """Return the modules that regressed against 'baseline' (see
+    writeBaseline()), as a dict of module name to the list of regressed
+    quantities. A time or RSS growth regresses when it exceeds the baseline
+    by more than 'tolerance' (relative) and more than minimumTime seconds or
+    minimumRSS bytes, which keeps the noise of short steps out."""
+    regressions = {}
+    modules = baseline.get('modules', {})
+    for record in self.records:
+      reference = modules.get(record['module'])
+      if reference is None or record['error']:
+        continue
+      for key, minimum in (('instantiate', minimumTime), ('enter', minimumTime), ('rssGrowth', minimumRSS)):
+        value = record[key]
+        referenceValue = reference.get(key)
+        if value is None or referenceValue is None:
+          continue
+        if value - referenceValue > minimum and value > referenceValue * (1.0 + tolerance):
+          regressions.setdefault(record['module'], []).append(
+            {'quantity': key, 'baseline': referenceValue, 'current': value})
+    return regressions
+
+  def report(self, title=None, regressions=None):
+    """Text report, slowest module first."""
+    regressions = regressions or {}
+    lines = ['Warm-up of %s: %d modules, %.3f s' % (
+      title or 'the workflow', len(self.records), sum([r['total'] for r in self.records]))]
+    for rank, record in enumerate(self.ranking()):
+      line = '%3d. %-32s total %.3f s (widget %.3f s, enter %.3f s)' % (
+        rank + 1, record['module'], record['total'], record['instantiate'], record['enter'])
+      if record['rssGrowth'] is not None:
+        line += ', RSS %+.1f MB' % (record['rssGrowth'] / 1048576.0)
+      if record['error']:
+        line += ', failed: %s' % record['error']
+      for regression in regressions.get(record['module'], ()):
+        if regression['quantity'] == 'rssGrowth':
+          line += ' [REGRESSED rssGrowth %+.1f MB -> %+.1f MB]' % (
+            regression['baseline'] / 1048576.0, regression['current'] / 1048576.0)
+        else:
+          line += ' [REGRESSED %s %.3f s -> %.3f s]' % (regression['quantity'], regression['baseline'], regression['current'])
+      lines.append(line)
+      for site in record['callSites'][0:3]:
+        lines.append('       %8.3f s own, %8.3f s cumulative, %6d calls  %s' % (
+          site['ownTime'], site['cumulativeTime'], site['calls'], site['function']))
+    return '\n'.join(lines)
+
+  def writeBaseline(self, fileName, title=None):
+    f = open(fileName, 'w')
+    try:
+      json.dump({
+        'title': title,
+        'time': time.time(),
+        'profileCalls': self.profileCalls,
+        'modules': dict([(r['module'], dict([(key, r[key]) for key in ('instantiate', 'enter', 'total', 'rssGrowth')]))
+                         for r in self.records if not r['error']]),
+        }, f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+
+  def exportJSON(self, fileName, title=None, regressions=None):
+    f = open(fileName, 'w')
+    try:
+      json.dump({'title': title, 'ranking': self.ranking(), 'regressions': regressions or {}}, f, indent=2)
+    finally:
+      f.close()
+
+def readWarmUpBaseline(fileName):
+  """The baseline written by WarmUpProfiler.writeBaseline(), or None if the
+  file does not exist."""
+  if not os.path.exists(fileName):
+    return None
+  f = open(fileName, 'r')
+  try:
+    return json.load(f)
+  finally:
+    f.close()
@@ -0,0 +1,382 @@
+import os
+import json
+import time
+import fnmatch
+import threading
+import Queue
+
+from .ModuleMetadata import fileSignature, extractModuleMetadata
+
+#
+# ModuleIndexCache
+#
+class ModuleIndexCache(object):
+  """Persistent index of the module files found in each scanned directory.
+
+  Each directory is stored together with its modification time. Adding or
+  removing a file updates the mtime of the directory, so a directory is only
+  rescanned when its content changed since the index was written. The
+  metadata of each module file is stored with the mtime and size of the
+  file, as updating a module in place does not change its directory.
+  """
+
+  formatVersion = 3
+
+  def __init__(self, fileName):
+    self.fileName = fileName
+    self.directories = {}
+    self.files = {}
+    self.hits = 0
+    self.misses = 0
+    self.metadataHits = 0
+    self.metadataMisses = 0
+    self.modified = False
+    self.load()
+
+  def load(self):
+    self.directories = {}
+    self.files = {}
+    self.modified = False
+    if not self.fileName or not os.path.exists(self.fileName):
+      return
+    try:
+      f = open(self.fileName, 'r')
+      try:
+        data = json.load(f)
+      finally:
+        f.close()
+    except (IOError, ValueError):
+      # An unreadable index is simply rebuilt by the next scan.
+      print('WorkflowOrganizer: ignoring broken module index %s' % self.fileName)
+      return
+    if isinstance(data, dict) and data.get('version') == self.formatVersion:
+      self.directories = data.get('directories', {})
+      self.files = data.get('files', {})
+
+  def save(self):
+    if not self.modified or not self.fileName:
+      return
+    tmpFileName = self.fileName + '.tmp'
+    try:
+      f = open(tmpFileName, 'w')
+      try:
+        json.dump({'version': self.formatVersion, 'directories': self.directories, 'files': self.files}, f)
+      finally:
+        f.close()
+      if os.path.exists(self.fileName):
+        os.remove(self.fileName) # os.rename() does not overwrite on Windows
+      os.rename(tmpFileName, self.fileName)
+      self.modified = False
+    except (IOError, OSError) as e:
+      print('WorkflowOrganizer: could not write module index %s: %s' % (self.fileName, e))
+
+  def lookup(self, path, mtime):
+    """Return the cached entry of 'path' if it was indexed with 'mtime',
+    otherwise None.
+    """
+    record = self.directories.get(path)
+    if record is not None and mtime is not None and record.get('mtime') == mtime:
+      self.hits = self.hits + 1
+      return record['entry']
+    self.misses = self.misses + 1
+    return None
+
+  def store(self, path, mtime, entry):
+    if mtime is None:
+      # The directory is gone; forget about it.
+      if path in self.directories:
+        del self.directories[path]
+        self.modified = True
+      return
+    self.directories[path] = {'mtime': mtime, 'entry': entry}
+    self.modified = True
+
+  def lookupFile(self, fileName, signature):
+    """Return the cached metadata of 'fileName' if it was extracted from a
+    file with the same signature (mtime, size), otherwise None."""
+    record = self.files.get(fileName)
+    if record is not None and signature is not None and record.get('signature') == signature:
+      self.metadataHits = self.metadataHits + 1
+      return record['metadata']
+    self.metadataMisses = self.metadataMisses + 1
+    return None
+
+  def storeFile(self, fileName, signature, metadata):
+    if signature is None:
+      if fileName in self.files:
+        del self.files[fileName]
+        self.modified = True
+      return
+    self.files[fileName] = {'signature': signature, 'metadata': metadata}
+    self.modified = True
+
+  def prune(self, paths):
+    """Drop the directories that are not part of 'paths' any more, and the
+    files in them."""
+    paths = set(paths)
+    for path in list(self.directories.keys()):
+      if path not in paths:
+        del self.directories[path]
+        self.modified = True
+    for fileName in list(self.files.keys()):
+      if os.path.dirname(fileName) not in paths:
+        del self.files[fileName]
+        self.modified = True
+
+  def clear(self):
+    self.directories = {}
+    self.files = {}
+    self.modified = True
+
+
+#
+# Module discovery
+#
+
+moduleKinds = ('loadable', 'scripted', 'cli')
+
+# (prefix, suffix) of the module files of each kind, per platform
+moduleFileTypes = {
+  'Darwin' : {
+    'loadable' : ('libqSlicer', 'Module.dylib'),
+    'scripted' : ('', '.py'),
+    'cli' : ('lib', 'Lib.dylib'),
+    },
+  'Windows' : {
+    'loadable' : ('qSlicer', 'Module.dll'),
+    'scripted' : ('', '.py'),
+    'cli' : ('', 'Lib.dll'),
+    },
+  'Linux' : {
+    'loadable' : ('libqSlicer', 'Module.so'),
+    'scripted' : ('', '.py'),
+    'cli' : ('lib', 'Lib.so'),
+    },
+  }
+
+def classifyModuleFiles(fileNames, kinds, fileTypes):
+  """Classify the file names of one directory in a single pass.
+  Return a list of [kind, moduleName, fileName].
+  """
+  matchers = []
+  for kind in kinds:
+    prefix, suffix = fileTypes[kind]
+    matchers.append((os.path.normcase(suffix), len(suffix), prefix, kind))
+  modules = []
+  for fileName in fileNames:
+    if fileName.startswith('.'):
+      continue
+    key = os.path.normcase(fileName)
+    for suffix, suffixLength, prefix, kind in matchers:
+      if key.endswith(suffix):
+        name = fileName[:-suffixLength]
+        if prefix and name.startswith(prefix):
+          name = name[len(prefix):]
+        modules.append([kind, name, fileName])
+        break
+  return modules
+
+def directoryModificationTime(path):
+  try:
+    return os.stat(path).st_mtime
+  except OSError:
+    return None
+
+def scanModuleDirectory(path, kinds, fileTypes):
+  try:
+    fileNames = os.listdir(path)
+  except OSError:
+    return []
+  return classifyModuleFiles(fileNames, kinds, fileTypes)
+
+#
+# ModuleDiscovery
+#
+class ModuleDiscovery(object):
+  """Find the installed loadable, scripted and CLI modules.
+
+  Every module directory is listed once and its files are classified in the
+  same pass. The directories are scanned concurrently on a thread pool, which
+  mostly pays off on network mounted paths where each call waits on I/O.
+  The metadata of the modules (see ModuleMetadata.py) is extracted the same
+  way once all the names are known, only for the files that changed since
+  it was cached.
+  """
+
+  def __init__(self, cache=None, platformName=None, numberOfThreads=8):
+    if platformName is None:
+      import platform
+      platformName = platform.system()
+    self.fileTypes = moduleFileTypes.get(platformName, moduleFileTypes['Linux'])
+    self.cache = cache
+    self.numberOfThreads = numberOfThreads
+    self.elapsedTime = 0.0
+    self.thread = None
+    self.events = None
+    self.directories = []
+    self.moduleFiles = []
+    self.metadataTime = 0.0
+
+  def moduleDirectories(self, appPath, additionalPaths=None):
+    """Return the list of (path, kinds) to scan."""
+    directories = []
+    libPath = appPath + '/lib'
+    try:
+      libNames = sorted(fnmatch.filter(os.listdir(libPath), 'Slicer*'))
+    except OSError:
+      libNames = []
+    for subdirectory, kind in (('qt-loadable-modules', 'loadable'),
+                               ('qt-scripted-modules', 'scripted'),
+                               ('cli-modules', 'cli')):
+      for libName in libNames:
+        path = os.path.join(libPath, libName, subdirectory)
+        if os.path.isdir(path):
+          directories.append((path, (kind,)))
+    for path in additionalPaths or []:
+      directories.append((path, moduleKinds))
+    return directories
+
+  def scanDirectory(self, directory):
+    """Scan one (path, kinds) directory, unless the cache is up to date.
+    Return (path, mtime, modules, scanned). Runs on the worker threads, so
+    it must not touch the cache.
+    """
+    path, kinds = directory
+    mtime = directoryModificationTime(path)
+    if self.cache is not None:
+      record = self.cache.directories.get(path)
+      if record is not None and mtime is not None and record.get('mtime') == mtime:
+        return (path, mtime, None, False)
+    return (path, mtime, scanModuleDirectory(path, kinds, self.fileTypes), True)
+
+  def imapUnordered(self, function, items):
+    """Map 'function' over 'items' on the thread pool, yielding each result
+    as soon as it is available."""
+    if len(items) > 1 and self.numberOfThreads > 1:
+      from multiprocessing.pool import ThreadPool
+      pool = ThreadPool(min(self.numberOfThreads, len(items)))
+      try:
+        for result in pool.imap_unordered(function, items):
+          yield result
+      finally:
+        # All the results were consumed; pool.join() would only wait for
+        # the pool's handler thread, which polls every 100 ms.
+        pool.close()
+    else:
+      for item in items:
+        yield function(item)
+
+  def scanDirectories(self, directories):
+    """Scan 'directories', yielding each result as soon as it is available."""
+    return self.imapUnordered(self.scanDirectory, directories)
+
+  def discover(self, directories, directoryScanned=None, prune=True):
+    """Return the sorted list of the names of the modules found in 'directories'.
+    directoryScanned(path, modules) is called with the (kind, name, fileName)
+    of the modules of each directory, sorted by name, as soon as it is
+    scanned. If 'prune' is True, the cache entries
+    of the directories not in 'directories' are dropped.
+    """
+    startTime = time.time()
+    names = []
+    self.moduleFiles = []
+    for path, mtime, modules, scanned in self.scanDirectories(directories):
+      if self.cache is not None:
+        cached = self.cache.lookup(path, mtime)
+        if cached is None:
+          self.cache.store(path, mtime, modules)
+        else:
+          modules = cached
+      moduleFiles = sorted([(kind, name, os.path.join(path, fileName)) for kind, name, fileName in modules],
+                           key=lambda moduleFile: moduleFile[1])
+      self.moduleFiles.extend(moduleFiles)
+      names.extend([name for kind, name, fileName in moduleFiles])
+      if directoryScanned:
+        directoryScanned(path, moduleFiles)
+    if self.cache is not None:
+      if prune:
+        self.cache.prune([path for path, kinds in directories])
+      self.cache.save()
+    names.sort()
+    self.elapsedTime = time.time() - startTime
+    return names
+
+  def extractFileMetadata(self, moduleFile):
+    # Runs on the worker threads
+    kind, name, fileName = moduleFile
+    return (moduleFile, extractModuleMetadata(kind, name, fileName))
+
+  def extractMetadata(self, moduleFiles=None):
+    """Return a dict mapping the module names to their metadata, for the
+    module files found by the last discover(). The first file of a name
+    wins, like in the module list."""
+    startTime = time.time()
+    if moduleFiles is None:
+      moduleFiles = self.moduleFiles
+    metadata = {}
+    signatures = {}
+    changedFiles = []
+    for moduleFile in moduleFiles:
+      kind, name, fileName = moduleFile
+      if kind == 'loadable':
+        continue
+      signature = fileSignature(fileName)
+      cached = self.cache.lookupFile(fileName, signature) if self.cache is not None else None
+      if cached is None:
+        signatures[fileName] = signature
+        changedFiles.append(moduleFile)
+      elif name not in metadata:
+        metadata[name] = cached
+    for (kind, name, fileName), fileMetadata in self.imapUnordered(self.extractFileMetadata, changedFiles):
+      if self.cache is not None:
+        self.cache.storeFile(fileName, signatures[fileName], fileMetadata)
+      if name not in metadata:
+        metadata[name] = fileMetadata
+    if self.cache is not None:
+      self.cache.save()
+    self.metadataTime = time.time() - startTime
+    return metadata
+
+  def start(self, appPath, additionalPaths=None):
+    """Run the discovery on a background thread.
+
+    The results are posted to self.events, to be read from the GUI thread:
+    ('directory', path, modules) for each scanned directory, then either
+    ('done', names) followed by ('metadata', metadata) from
+    extractMetadata(), or ('error', message). The scanned (path, kinds) are
+    available in self.directories once the discovery is done.
+    """
+    self.startThread(lambda: self.moduleDirectories(appPath, additionalPaths), True)
+
+  def rescan(self, directories):
+    """Like start(), but only scan the given (path, kinds). The cache entries
+    of the other directories are kept, and the metadata is only extracted
+    for the modules of these directories.
+    """
+    self.startThread(lambda: directories, False)
+
+  def startThread(self, directoriesFunction, prune):
+    self.events = Queue.Queue()
+    self.thread = threading.Thread(target=self.run, args=(directoriesFunction, prune))
+    self.thread.daemon = True
+    self.thread.start()
+
+  def run(self, directoriesFunction, prune):
+    def directoryScanned(path, modules):
+      self.events.put(('directory', path, modules))
+    try:
+      self.directories = directoriesFunction()
+      names = self.discover(self.directories, directoryScanned, prune)
+    except Exception as e:
+      self.events.put(('error', str(e)))
+      return
+    self.events.put(('done', names))
+    try:
+      metadata = self.extractMetadata()
+    except Exception as e:
+      print('WorkflowOrganizer: module metadata extraction failed: %s' % e)
+      metadata = {}
+    self.events.put(('metadata', metadata))
+
+  def isRunning(self):
+    return self.thread is not None and self.thread.is_alive()
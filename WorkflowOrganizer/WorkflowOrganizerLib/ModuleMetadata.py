@@ -0,0 +1,130 @@
+import os
+
+#
+# Module metadata
+#
+# The title, categories and dependencies of a module are read from its files
+# without loading it: scripted modules are parsed with the ast module and
+# never executed, and the XML description of CLI modules is read from an
+# .xml file next to the module or from the module library, where it is
+# embedded as a string. Loadable modules have no metadata. The metadata is a
+# dict with any of the keys 'title', 'categories', 'dependencies' and, for
+# CLI modules, 'description'. The parsers are imported when the first file is
+# read, which does not happen at all when the metadata is cached.
+#
+
+scriptedModuleAttributes = ('title', 'categories', 'dependencies')
+
+def fileSignature(fileName):
+  """(mtime, size) of a file, or None if it does not exist."""
+  try:
+    s = os.stat(fileName)
+  except OSError:
+    return None
+  return [s.st_mtime, s.st_size]
+
+def literalValue(node):
+  # Like ast.literal_eval(), but also accepts translated strings such as
+  # _("Title") or translate("context", "Title").
+  import ast
+  if isinstance(node, ast.Call) and node.args and isinstance(node.args[-1], ast.Str):
+    return node.args[-1].s
+  if isinstance(node, (ast.List, ast.Tuple)):
+    return [literalValue(element) for element in node.elts]
+  return ast.literal_eval(node)
+
+def isParentAttribute(node):
+  # parent.title or self.parent.title
+  import ast
+  return (isinstance(node, ast.Name) and node.id == 'parent') or \
+         (isinstance(node, ast.Attribute) and node.attr == 'parent')
+
+def extractScriptedModuleMetadata(fileName):
+  import ast
+  f = open(fileName, 'rb')
+  try:
+    source = f.read()
+  finally:
+    f.close()
+  metadata = {}
+  for node in ast.walk(ast.parse(source, fileName)):
+    if not isinstance(node, ast.Assign):
+      continue
+    for target in node.targets:
+      if isinstance(target, ast.Attribute) and target.attr in scriptedModuleAttributes \
+          and isParentAttribute(target.value) and target.attr not in metadata:
+        try:
+          metadata[target.attr] = literalValue(node.value)
+        except ValueError:
+          pass # not a literal, e.g. computed at run time
+  return metadata
+
+def parseCLIDescription(text):
+  import xml.etree.ElementTree as ElementTree
+  try:
+    root = ElementTree.fromstring(text)
+  except ElementTree.ParseError as e:
+    raise ValueError(str(e))
+  metadata = {}
+  title = root.findtext('title')
+  if title:
+    metadata['title'] = title.strip()
+  category = root.findtext('category')
+  if category:
+    metadata['categories'] = [category.strip()]
+  description = root.findtext('description')
+  if description:
+    metadata['description'] = ' '.join(description.split())[:300]
+  return metadata
+
+def embeddedCLIDescription(fileName):
+  # The description is compiled into the module as one string; mmap avoids
+  # reading the whole library to find it.
+  import mmap
+  f = open(fileName, 'rb')
+  try:
+    if os.fstat(f.fileno()).st_size == 0:
+      return None
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      start = data.find('<executable')
+      if start == -1:
+        return None
+      end = data.find('</executable>', start)
+      if end == -1:
+        return None
+      text = data[start:end + len('</executable>')]
+    finally:
+      data.close()
+  finally:
+    f.close()
+  declaration = '<?xml version="1.0" encoding="utf-8"?>\n'
+  return declaration + text
+
+def extractCLIModuleMetadata(fileName, moduleName):
+  directory = os.path.dirname(fileName)
+  xmlFileName = os.path.join(directory, moduleName + '.xml')
+  if os.path.isfile(xmlFileName):
+    f = open(xmlFileName, 'rb')
+    try:
+      return parseCLIDescription(f.read())
+    finally:
+      f.close()
+  for candidate in (fileName, os.path.join(directory, moduleName), os.path.join(directory, moduleName + '.exe')):
+    if os.path.isfile(candidate):
+      text = embeddedCLIDescription(candidate)
+      if text is not None:
+        return parseCLIDescription(text)
+  return {}
+
+def extractModuleMetadata(kind, moduleName, fileName):
+  """Return the metadata of a module file; an empty dict if there is none or
+  it cannot be read."""
+  try:
+    if kind == 'scripted':
+      return extractScriptedModuleMetadata(fileName)
+    if kind == 'cli':
+      return extractCLIModuleMetadata(fileName, moduleName)
+  except (IOError, OSError, SyntaxError, TypeError, ValueError) as e:
+    print('WorkflowOrganizer: could not read the metadata of %s: %s' % (fileName, e))
+  return {}
@@ -0,0 +1,135 @@
+import bisect
+from operator import attrgetter
+
+def internName(name):
+  # Module names come from the directory listings and the JSON cache
+  # (unicode); the records, the module list and the search index then share
+  # one copy of each name.
+  try:
+    return intern(str(name))
+  except UnicodeEncodeError:
+    return name
+
+#
+# ModuleRecord
+#
+class ModuleRecord(object):
+  """An installed module. 'kind' is 'loadable', 'scripted' or 'cli', 'path'
+  the module file, 'directory' the module directory it was found in and
+  'label' the title of the module, or its name while the metadata is not
+  known."""
+
+  __slots__ = ('kind', 'name', 'path', 'directory', 'label')
+
+  def __init__(self, kind, name, path, directory=None, label=None):
+    self.kind = internName(kind)
+    self.name = internName(name)
+    self.path = path
+    self.directory = directory
+    self.label = label or self.name
+
+  def __repr__(self):
+    return 'ModuleRecord(%r, %r, %r)' % (self.kind, self.name, self.path)
+
+#
+# ModuleRegistry
+#
+class ModuleRegistry(object):
+  """The installed modules in name order, indexed by name, by kind and by
+  module directory.
+
+  The row of a module is its position in self.names, which is also the
+  order of the module list shown by the selectors. A name found in more
+  than one directory has a row per record; get() and row() return the first
+  one added, like the module list of Slicer.
+  """
+
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.names = []
+    self.records = []
+    self.byName = {}
+    self.byKind = {}
+    self.byDirectory = {}
+
+  def __len__(self):
+    return len(self.records)
+
+  def __iter__(self):
+    return iter(self.records)
+
+  def __contains__(self, name):
+    return name in self.byName
+
+  def get(self, name, default=None):
+    return self.byName.get(name, default)
+
+  def row(self, name):
+    """Row of the module, or -1 if it is not installed."""
+    row = bisect.bisect_left(self.names, name)
+    if row < len(self.names) and self.names[row] == name:
+      return row
+    return -1
+
+  def ofKind(self, kind):
+    """The records of the modules of 'kind', in name order."""
+    return sorted(self.byKind.get(kind, ()), key=attrgetter('name'))
+
+  def inDirectory(self, directory):
+    """The records of the modules found in 'directory'."""
+    return list(self.byDirectory.get(directory, ()))
+
+  def index(self, record):
+    if record.name not in self.byName:
+      self.byName[record.name] = record
+    self.byKind.setdefault(record.kind, []).append(record)
+    self.byDirectory.setdefault(record.directory, []).append(record)
+
+  def extend(self, modules, directory=None):
+    """Add the (kind, name, path) of a scanned directory."""
+    records = [ModuleRecord(kind, name, path, directory) for kind, name, path in modules]
+    for record in records:
+      self.index(record)
+    # Both lists are sorted, which the sort takes advantage of; it is
+    # stable, so the records added first keep their rows.
+    self.records = sorted(self.records + records, key=attrgetter('name'))
+    self.names = [record.name for record in self.records]
+
+  def add(self, kind, name, path, directory=None):
+    """Add one module and return its row."""
+    record = ModuleRecord(kind, name, path, directory)
+    row = bisect.bisect_right(self.names, record.name)
+    self.names.insert(row, record.name)
+    self.records.insert(row, record)
+    self.index(record)
+    return row
+
+  def remove(self, kind, name, path):
+    """Remove one module and return the row it had, or -1."""
+    row = self.row(name)
+    while 0 <= row < len(self.names) and self.names[row] == name:
+      record = self.records[row]
+      if record.kind == kind and record.path == path:
+        del self.names[row]
+        del self.records[row]
+        self.byKind[kind].remove(record)
+        directoryRecords = self.byDirectory[record.directory]
+        directoryRecords.remove(record)
+        if not directoryRecords:
+          del self.byDirectory[record.directory]
+        if self.byName[name] is record:
+          del self.byName[name]
+          if row < len(self.names) and self.names[row] == name:
+            self.byName[name] = self.records[row]
+        return row
+      row = row + 1
+    return -1
+
+  def setLabels(self, metadata):
+    """Use the titles of 'metadata' (see ModuleMetadata.py) as labels."""
+    for name, moduleMetadata in metadata.items():
+      record = self.byName.get(name)
+      if record is not None and moduleMetadata.get('title'):
+        record.label = moduleMetadata['title']
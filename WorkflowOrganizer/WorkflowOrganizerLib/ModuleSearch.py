@@ -0,0 +1,145 @@
+import re
+import bisect
+
+# Words of a CamelCase name: 'DICOMPatcher' -> DICOM, Patcher
+camelCaseWordPattern = re.compile('[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+
+def normalizedName(name):
+  """'Crop_Volume' -> 'cropvolume'"""
+  return re.sub('[^a-z0-9]', '', name.lower())
+
+def trigrams(key):
+  return set([key[start:start+3] for start in xrange(0, len(key) - 2)])
+
+def camelCaseInitials(name):
+  """'CropVolume' -> 'cv', 'DICOMPatcher' -> 'dp'"""
+  return ''.join([word[0] for word in camelCaseWordPattern.findall(name)]).lower()
+
+#
+# ModuleSearchIndex
+#
+class ModuleSearchIndex(object):
+  """Type-ahead search over the module names.
+
+  A query matches a name by prefix, by CamelCase initials ('cv' finds
+  CropVolume) or as a substring, case-insensitively, and the results come in
+  that order. Prefixes and initials are found by bisection in sorted lists.
+  Substrings are found from the posting lists of the trigrams of the names:
+  a longer query intersects the posting lists of its trigrams, a shorter one
+  merges the posting lists of the trigrams that contain it.
+
+  'aliases' optionally maps a name to other strings it should be found by,
+  e.g. the title and categories of the module; they are matched by prefix
+  and as substrings, after the names.
+  """
+
+  def __init__(self, names, aliases=None):
+    self.names = sorted(set(names))
+    self.keys = [name.lower() for name in self.names]
+    # All the strings a name is found by, the name first
+    self.searchKeys = [[key] for key in self.keys]
+    if aliases:
+      for i, name in enumerate(self.names):
+        for alias in aliases.get(name, []):
+          alias = alias.lower()
+          if alias and alias not in self.searchKeys[i]:
+            self.searchKeys[i].append(alias)
+
+    self.sortedKeys = sorted([(key, i) for i, keys in enumerate(self.searchKeys) for key in keys])
+    self.prefixKeys = [key for key, i in self.sortedKeys]
+    self.sortedInitials = sorted([(camelCaseInitials(name), i) for i, name in enumerate(self.names)])
+    self.initialKeys = [initials for initials, i in self.sortedInitials]
+
+    self.normalizedNames = {}
+    for i, name in enumerate(self.names):
+      self.normalizedNames.setdefault(normalizedName(name), i)
+
+    self.trigrams = {}
+    self.shortNames = []
+    for i, keys in enumerate(self.searchKeys):
+      if min([len(key) for key in keys]) < 3:
+        self.shortNames.append(i)
+      grams = set()
+      for key in keys:
+        grams.update(trigrams(key))
+      for gram in grams:
+        self.trigrams.setdefault(gram, []).append(i)
+
+  def prefixMatches(self, sortedList, sortedKeys, query):
+    position = bisect.bisect_left(sortedKeys, query)
+    while position < len(sortedKeys) and sortedKeys[position].startswith(query):
+      yield sortedList[position][1]
+      position = position + 1
+
+  def substringMatches(self, query):
+    if len(query) < 3:
+      candidates = set([i for i in self.shortNames if self.containsQuery(i, query)])
+      for gram, posting in self.trigrams.iteritems():
+        if query in gram:
+          candidates.update(posting)
+      return sorted(candidates)
+    postings = []
+    for start in xrange(0, len(query) - 2):
+      posting = self.trigrams.get(query[start:start+3])
+      if posting is None:
+        return []
+      postings.append(posting)
+    postings.sort(key=len)
+    candidates = set(postings[0])
+    for posting in postings[1:]:
+      candidates.intersection_update(posting)
+      if not candidates:
+        return []
+    return sorted([i for i in candidates if self.containsQuery(i, query)])
+
+  def containsQuery(self, i, query):
+    for key in self.searchKeys[i]:
+      if query in key:
+        return True
+    return False
+
+  def search(self, query, limit=50):
+    """Return up to 'limit' module names matching 'query'."""
+    query = query.strip().lower()
+    if not query:
+      return self.names[:limit]
+    found = set()
+    results = []
+    # The substring matches are only computed if the prefix and initials
+    # matches do not fill the results.
+    for matches in (lambda: self.prefixMatches(self.sortedKeys, self.prefixKeys, query),
+                    lambda: self.prefixMatches(self.sortedInitials, self.initialKeys, query),
+                    lambda: self.substringMatches(query)):
+      for i in matches():
+        if i not in found:
+          found.add(i)
+          results.append(self.names[i])
+          if len(results) >= limit:
+            return results
+    return results
+
+  def similarNames(self, name, limit=3, minimumSimilarity=0.3):
+    """Return up to 'limit' installed names that look like 'name': the same
+    name with another case or punctuation, otherwise the names sharing the
+    most trigrams with it. Only the posting lists of the trigrams of 'name'
+    are visited, not the whole list of names.
+    """
+    key = normalizedName(name)
+    if key in self.normalizedNames:
+      return [self.names[self.normalizedNames[key]]]
+    grams = trigrams(name.lower())
+    if not grams:
+      return []
+    shared = {}
+    for gram in grams:
+      for i in self.trigrams.get(gram, []):
+        if gram in self.keys[i]: # not only in an alias
+          shared[i] = shared.get(i, 0) + 1
+    scores = []
+    for i, count in shared.items():
+      # Jaccard index of the trigram sets
+      similarity = float(count) / (len(grams) + max(len(self.keys[i]) - 2, 0) - count)
+      if similarity >= minimumSimilarity:
+        scores.append((-similarity, self.names[i]))
+    scores.sort()
+    return [candidate for score, candidate in scores[:limit]]
@@ -0,0 +1,185 @@
+"""Remote control of the workflow navigation.
+
+The WorkflowOrganizer widget can listen on a local socket: a TCP port on
+127.0.0.1, or a local (UNIX domain) socket. The protocol is line based, so a
+foot pedal or tablet only has to send one short line per command:
+
+  next                  go to the next step
+  back                  go to the previous step
+  goto STEP             go to a step, by number (from 1), label or module
+  load FILE             load a workflow file
+  status                current step
+  subscribe             receive the step changes as 'step' events
+  ping
+
+Every command gets one reply line, 'ok ...' or 'error MESSAGE'. The reply to
+a navigation command is 'ok STEP MODULE MS', where MS is the time the
+organizer took to run the command. The reply to 'load' ends with
+'missing STEP:MODULE,...' when some steps use modules that are not
+installed; no dialog is shown for a remote load. Subscribers also receive
+'step STEP MODULE LABEL' whenever the step changes, whatever the source.
+
+This file is also a test client:
+
+  python -m WorkflowOrganizerLib.Remote --address 18950 next
+  python -m WorkflowOrganizerLib.Remote --address 18950 bench 200
+"""
+import os
+import sys
+import time
+import socket
+
+from .Instrumentation import percentile
+
+navigationCommands = ('next', 'back', 'goto', 'load')
+commands = navigationCommands + ('status', 'subscribe', 'ping')
+
+def parseCommand(line):
+  """Return (command, argument) of a command line; raise ValueError if it is
+  not a known command."""
+  words = line.strip().split(None, 1)
+  if not words:
+    raise ValueError('empty command')
+  command = words[0].lower()
+  argument = words[1].strip() if len(words) > 1 else ''
+  if command not in commands:
+    raise ValueError('unknown command %s' % command)
+  if command in ('goto', 'load') and not argument:
+    raise ValueError('%s needs an argument' % command)
+  return command, argument
+
+def stepReply(stepNumber, moduleName, elapsedTime=None, missingSteps=None):
+  """Reply line giving the current step (from 1, 0 without a workflow). The
+  reply to a navigation command has the time it took in seconds, and the
+  one to 'load' the (step number, module name) of the steps whose module is
+  not installed."""
+  words = ['ok', str(stepNumber), moduleName]
+  if elapsedTime is not None:
+    words.append('%.1f' % (elapsedTime * 1000.0))
+  if missingSteps:
+    words.extend(['missing', ','.join(['%d:%s' % (number, name) for number, name in missingSteps])])
+  return ' '.join(words)
+
+def parseStepReply(line):
+  """Return (stepNumber, moduleName, elapsedTime, missingSteps) of a reply
+  made by stepReply(); raise ValueError if it is an error."""
+  words = line.split()
+  if len(words) < 3 or words[0] != 'ok':
+    raise ValueError(line)
+  elapsedTime = None
+  missingSteps = []
+  rest = words[3:]
+  if rest and rest[0] != 'missing':
+    elapsedTime = float(rest.pop(0)) / 1000.0
+  if len(rest) == 2 and rest[0] == 'missing':
+    for missingStep in rest[1].split(','):
+      number, name = missingStep.split(':', 1)
+      missingSteps.append((int(number), name))
+  return int(words[1]), words[2], elapsedTime, missingSteps
+
+def localSocketPath(name):
+  # QLocalServer puts the socket of a relative name in the temporary directory
+  if os.path.isabs(name):
+    return name
+  import tempfile
+  return os.path.join(tempfile.gettempdir(), name)
+
+#
+# RemoteClient
+#
+class RemoteClient(object):
+  """Client of the navigation server. 'address' is a TCP port number on
+  127.0.0.1, or the name or path of a local socket."""
+
+  def __init__(self, address, timeout=10.0):
+    address = str(address)
+    if address.isdigit():
+      self.socket = socket.create_connection(('127.0.0.1', int(address)), timeout)
+      self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    else:
+      self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      self.socket.settimeout(timeout)
+      self.socket.connect(localSocketPath(address))
+    self.buffer = ''
+    self.events = []
+
+  def close(self):
+    self.socket.close()
+
+  def readLine(self):
+    while '\n' not in self.buffer:
+      data = self.socket.recv(4096)
+      if not data:
+        raise IOError('connection closed')
+      self.buffer = self.buffer + data
+    line, self.buffer = self.buffer.split('\n', 1)
+    return line.rstrip('\r')
+
+  def send(self, command):
+    """Send a command and return its reply line. Events received in the
+    meantime are kept in self.events."""
+    self.socket.sendall(command + '\n')
+    while True:
+      line = self.readLine()
+      if line.startswith('step '):
+        self.events.append(line)
+      else:
+        return line
+
+  def waitForEvent(self):
+    if self.events:
+      return self.events.pop(0)
+    return self.readLine()
+
+def benchmark(client, numberOfCommands, command='next'):
+  """Send 'command' numberOfCommands times and return the round trip and
+  server times in seconds, sorted."""
+  roundTripTimes = []
+  serverTimes = []
+  for i in xrange(0, numberOfCommands):
+    startTime = time.time()
+    reply = client.send(command)
+    roundTripTimes.append(time.time() - startTime)
+    try:
+      serverTimes.append(parseStepReply(reply)[2])
+    except ValueError:
+      raise IOError(reply)
+  roundTripTimes.sort()
+  serverTimes.sort()
+  return roundTripTimes, serverTimes
+
+def main(argv):
+  from optparse import OptionParser
+  parser = OptionParser(usage="python -m WorkflowOrganizerLib.Remote --address ADDRESS COMMAND [ARGUMENT]\n"
+                              "COMMAND is a navigation server command, 'listen' to print the step events,\n"
+                              "or 'bench N' to measure the latency of N 'next' commands.")
+  parser.add_option("--address", dest="address", default="18950",
+                    help="TCP port on 127.0.0.1, or name or path of a local socket (default: 18950)")
+  (options, args) = parser.parse_args(argv)
+  if not args:
+    parser.error("expected a command")
+
+  client = RemoteClient(options.address)
+  try:
+    if args[0] == 'listen':
+      print(client.send('subscribe'))
+      while True:
+        print(client.waitForEvent())
+    elif args[0] == 'bench':
+      numberOfCommands = int(args[1]) if len(args) > 1 else 100
+      roundTripTimes, serverTimes = benchmark(client, numberOfCommands)
+      for name, times in (('round trip', roundTripTimes), ('organizer', serverTimes)):
+        print('%-10s p50 %.2f ms, p95 %.2f ms, max %.2f ms' % (name,
+          percentile(times, 0.5) * 1000.0, percentile(times, 0.95) * 1000.0, times[-1] * 1000.0))
+    else:
+      reply = client.send(' '.join(args))
+      print(reply)
+      return 0 if reply.startswith('ok') else 1
+  except KeyboardInterrupt:
+    pass
+  finally:
+    client.close()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,323 @@
+"""Run the CLI steps of a workflow file without the GUI.
+
+  python -m WorkflowOrganizerLib.Runner [options] workflow.txt
+
+The steps with an <args> line are run as a pipeline: each step waits for the
+steps listed in its <after> line, and the steps that do not depend on each
+other run at the same time on a pool of worker threads, each running the CLI
+executable in its own process. '{name}' in the arguments is replaced by the
+value given with --set name=value; '{workflow}' is the directory of the
+workflow file. The steps of the included workflows are run in place.
+"""
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import shlex
+import threading
+import subprocess
+import Queue
+
+from .Workflow import readWorkflowFile, expandWorkflow
+from .ModuleIndex import ModuleDiscovery
+
+variablePattern = re.compile(r'\{(\w+)\}')
+
+def expandVariables(text, variables):
+  def replace(match):
+    name = match.group(1)
+    if name not in variables:
+      raise ValueError('undefined variable {%s}' % name)
+    return variables[name]
+  return variablePattern.sub(replace, text)
+
+def findCLIExecutables(directories):
+  """Return a dict mapping the CLI module names to their executables.
+  'directories' is a list of (path, kinds) as returned by
+  ModuleDiscovery.moduleDirectories()."""
+  executables = {}
+  for path, kinds in directories:
+    if 'cli' not in kinds:
+      continue
+    try:
+      fileNames = os.listdir(path)
+    except OSError:
+      continue
+    for fileName in fileNames:
+      name, extension = os.path.splitext(fileName)
+      if extension not in ('', '.exe'):
+        continue
+      fullPath = os.path.join(path, fileName)
+      if name not in executables and os.path.isfile(fullPath) and os.access(fullPath, os.X_OK):
+        executables[name] = fullPath
+  return executables
+
+#
+# StepResult
+#
+class StepResult(object):
+  """Outcome of one step: status is 'done', 'failed', 'skipped' (a step it
+  depends on failed) or 'interactive' (no <args>, not run)."""
+
+  def __init__(self, index, step):
+    self.index = index
+    self.label = step.label
+    self.module = step.module
+    self.status = 'interactive'
+    self.command = None
+    self.returnCode = None
+    self.startTime = None
+    self.wallTime = None
+    self.output = ''
+
+  def toDict(self):
+    return dict([(key, getattr(self, key)) for key in
+      ('index', 'label', 'module', 'status', 'command', 'returnCode', 'startTime', 'wallTime', 'output')])
+
+#
+# WorkflowRunner
+#
+class WorkflowRunner(object):
+  """Run the CLI steps of a Workflow in dependency order.
+
+  'executables' maps CLI module names to executables, see
+  findCLIExecutables(). If 'launcher' is given (the Slicer executable), the
+  CLI executables are started through 'launcher --launch', which sets up the
+  library paths of the Slicer installation.
+  """
+
+  def __init__(self, workflow, executables, variables=None, numberOfThreads=None,
+               launcher=None, workingDirectory=None):
+    if numberOfThreads is None:
+      import multiprocessing
+      numberOfThreads = multiprocessing.cpu_count()
+    self.workflow = workflow
+    self.executables = executables
+    self.variables = variables or {}
+    self.numberOfThreads = max(1, numberOfThreads)
+    self.launcher = launcher
+    self.workingDirectory = workingDirectory
+    self.results = []
+    self.elapsedTime = 0.0
+
+  def stepIndex(self, name):
+    # A dependency is a step number (from 1) or a label
+    if name.isdigit():
+      index = int(name) - 1
+      if 0 <= index < len(self.workflow.steps):
+        return index
+      raise ValueError('no step %s' % name)
+    indices = [i for i, step in enumerate(self.workflow.steps) if step.label == name]
+    if len(indices) != 1:
+      raise ValueError('%s step labelled %s' % ('no' if not indices else 'more than one', name))
+    return indices[0]
+
+  def commandLine(self, step):
+    if step.module not in self.executables:
+      raise ValueError('%s is not an installed CLI module' % step.module)
+    arguments = [expandVariables(argument, self.variables) for argument in shlex.split(step.arguments)]
+    command = [self.executables[step.module]] + arguments
+    if self.launcher:
+      command = [self.launcher, '--launch'] + command
+    return command
+
+  def plan(self):
+    """Check the workflow and return (commands, dependencies, dependents) of
+    its CLI steps, indexed by step. Raise ValueError if a step cannot be run
+    or the dependencies have a cycle."""
+    commands = {}
+    for index, step in enumerate(self.workflow.steps):
+      if step.arguments is not None:
+        try:
+          commands[index] = self.commandLine(step)
+        except ValueError as e:
+          raise ValueError('step %d (%s): %s' % (index+1, step.label, e))
+    dependencies = dict([(index, set()) for index in commands])
+    dependents = dict([(index, []) for index in commands])
+    for index in commands:
+      step = self.workflow.steps[index]
+      for name in step.after:
+        try:
+          dependency = self.stepIndex(name)
+        except ValueError as e:
+          raise ValueError('step %d (%s): %s' % (index+1, step.label, e))
+        # Interactive steps are not run, so there is nothing to wait for
+        if dependency in commands and dependency not in dependencies[index]:
+          dependencies[index].add(dependency)
+          dependents[dependency].append(index)
+
+    # Kahn's algorithm; the steps left over are on a cycle
+    remaining = dict([(index, len(d)) for index, d in dependencies.items()])
+    ready = [index for index, count in remaining.items() if count == 0]
+    visited = 0
+    while ready:
+      index = ready.pop()
+      visited = visited + 1
+      for dependent in dependents[index]:
+        remaining[dependent] = remaining[dependent] - 1
+        if remaining[dependent] == 0:
+          ready.append(dependent)
+    if visited != len(commands):
+      cycle = sorted([index+1 for index, count in remaining.items() if count > 0])
+      raise ValueError('the dependencies of steps %s have a cycle' % ', '.join(map(str, cycle)))
+    return commands, dependencies, dependents
+
+  def runStep(self, result, command, events):
+    result.startTime = time.time()
+    try:
+      process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 cwd=self.workingDirectory)
+      result.output = process.communicate()[0]
+      result.returnCode = process.returncode
+    except OSError as e:
+      result.output = str(e)
+      result.returnCode = -1
+    result.wallTime = time.time() - result.startTime
+    result.status = 'done' if result.returnCode == 0 else 'failed'
+    events.put(result)
+
+  def run(self, stepFinished=None):
+    """Run the CLI steps and return the list of StepResult of all the steps.
+    A step whose dependency failed is skipped. stepFinished(result) is called
+    after each step."""
+    commands, dependencies, dependents = self.plan()
+    self.results = [StepResult(index, step) for index, step in enumerate(self.workflow.steps)]
+    for index, command in commands.items():
+      self.results[index].command = command
+    startTime = time.time()
+
+    remaining = dict([(index, len(d)) for index, d in dependencies.items()])
+    # The ready steps are started in <item> order
+    ready = [index for index, count in remaining.items() if count == 0]
+    heapq.heapify(ready)
+    events = Queue.Queue()
+    running = 0
+    while ready or running:
+      while ready and running < self.numberOfThreads:
+        index = heapq.heappop(ready)
+        thread = threading.Thread(target=self.runStep, args=(self.results[index], commands[index], events))
+        thread.daemon = True
+        thread.start()
+        running = running + 1
+      result = events.get()
+      running = running - 1
+      if result.status == 'done':
+        for dependent in dependents[result.index]:
+          remaining[dependent] = remaining[dependent] - 1
+          if remaining[dependent] == 0:
+            heapq.heappush(ready, dependent)
+      else:
+        self.skipDependents(result.index, dependents)
+      if stepFinished:
+        stepFinished(result)
+
+    self.elapsedTime = time.time() - startTime
+    for result in self.results:
+      if result.startTime is not None:
+        result.startTime = result.startTime - startTime
+    return self.results
+
+  def skipDependents(self, index, dependents):
+    for dependent in dependents[index]:
+      if self.results[dependent].status != 'skipped':
+        self.results[dependent].status = 'skipped'
+        self.skipDependents(dependent, dependents)
+
+  def report(self):
+    """Return the per-step wall times as text."""
+    lines = ['%-4s %-20s %-28s %-11s %9s %9s' % ('Step', 'Label', 'Module', 'Status', 'Start', 'Wall')]
+    for result in self.results:
+      if result.wallTime is None:
+        start = wall = '-'
+      else:
+        start = '%.2f s' % result.startTime
+        wall = '%.2f s' % result.wallTime
+      lines.append('%-4d %-20s %-28s %-11s %9s %9s' % (result.index+1, result.label, result.module, result.status, start, wall))
+    serialTime = sum([result.wallTime for result in self.results if result.wallTime is not None])
+    lines.append('Total %.2f s (%.2f s if run one after the other)' % (self.elapsedTime, serialTime))
+    return '\n'.join(lines)
+
+  def succeeded(self):
+    return all([result.status in ('done', 'interactive') for result in self.results])
+
+def runWorkflowFile(fileName, executables, variables=None, **kwargs):
+  """Read and run a workflow file; relative paths in the arguments are
+  relative to the workflow file unless another workingDirectory is given."""
+  workflowDirectory = os.path.dirname(os.path.abspath(fileName))
+  variables = dict(variables or {})
+  variables.setdefault('workflow', workflowDirectory)
+  kwargs.setdefault('workingDirectory', workflowDirectory)
+  runner = WorkflowRunner(expandWorkflow(readWorkflowFile(fileName)), executables, variables, **kwargs)
+  runner.run()
+  return runner
+
+def parseVariables(assignments):
+  variables = {}
+  for assignment in assignments or []:
+    if '=' not in assignment:
+      raise ValueError('expected name=value: %s' % assignment)
+    name, value = assignment.split('=', 1)
+    variables[name.strip()] = value
+  return variables
+
+def main(argv):
+  from optparse import OptionParser
+  parser = OptionParser(usage="python -m WorkflowOrganizerLib.Runner [options] workflow.txt")
+  parser.add_option("--slicer", dest="slicer", default=None,
+                    help="Slicer executable; its CLI modules are used and run through 'Slicer --launch'")
+  parser.add_option("--module-path", dest="modulePaths", action="append", default=[],
+                    help="additional directory of CLI modules (may be repeated)")
+  parser.add_option("--set", dest="assignments", action="append", default=[],
+                    help="value of a {name} in the arguments, as name=value (may be repeated)")
+  parser.add_option("--threads", dest="numberOfThreads", type="int", default=None,
+                    help="number of steps run at the same time (default: number of cores)")
+  parser.add_option("--working-directory", dest="workingDirectory", default=None,
+                    help="directory the steps are run in (default: the directory of the workflow file)")
+  parser.add_option("--report", dest="report", default=None,
+                    help="write the results and timings of the steps to this JSON file")
+  parser.add_option("--dry-run", dest="dryRun", action="store_true", default=False,
+                    help="print the command lines without running them")
+  (options, args) = parser.parse_args(argv)
+  if len(args) != 1:
+    parser.error("expected one workflow file")
+
+  appPath = os.path.dirname(os.path.abspath(options.slicer)) if options.slicer else None
+  directories = ModuleDiscovery().moduleDirectories(appPath, options.modulePaths) if appPath else \
+    [(path, ('cli',)) for path in options.modulePaths]
+  executables = findCLIExecutables(directories)
+
+  try:
+    variables = parseVariables(options.assignments)
+    variables.setdefault('workflow', os.path.dirname(os.path.abspath(args[0])))
+    runner = WorkflowRunner(expandWorkflow(readWorkflowFile(args[0])), executables, variables,
+                            options.numberOfThreads, options.slicer,
+                            options.workingDirectory or variables['workflow'])
+    if options.dryRun:
+      commands, dependencies, dependents = runner.plan()
+      for index in sorted(commands):
+        after = ', '.join([str(d+1) for d in sorted(dependencies[index])])
+        print('%d (after %s): %s' % (index+1, after or '-', ' '.join(commands[index])))
+      return 0
+    def stepFinished(result):
+      print('%s %s in %.2f s' % (result.label, result.status, result.wallTime))
+      if result.status == 'failed':
+        sys.stdout.write(result.output)
+    runner.run(stepFinished)
+  except (IOError, ValueError) as e:
+    print('WorkflowOrganizer: %s' % e)
+    return 2
+
+  print(runner.report())
+  if options.report:
+    f = open(options.report, 'w')
+    try:
+      json.dump({'workflow': os.path.abspath(args[0]), 'elapsedTime': runner.elapsedTime,
+                 'steps': [result.toDict() for result in runner.results]}, f, indent=2)
+    finally:
+      f.close()
+  return 0 if runner.succeeded() else 1
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,104 @@
+import os
+import unittest
+from __main__ import qt, slicer
+
+#
+# WorkflowOrganizerTest
+#
+class WorkflowOrganizerTest(unittest.TestCase):
+  def delayDisplay(self,message,msec=1000):
+    """This utility method displays a small dialog and waits.
+    This does two things: 1) it lets the event loop catch up
+    to the state of the test so that rendering and widget updates
+    have all taken place before the test continues and 2) it
+    shows the user/developer/tester the state of the test
+    so that we'll know when it breaks.
+    """
+    print(message)
+    self.info = qt.QDialog()
+    self.infoLayout = qt.QVBoxLayout()
+    self.info.setLayout(self.infoLayout)
+    self.label = qt.QLabel(message,self.info)
+    self.infoLayout.addWidget(self.label)
+    qt.QTimer.singleShot(msec, self.info.close)
+    self.info.exec_()
+
+  def setUp(self):
+    """ Do whatever is needed to reset the state - typically a scene clear will be enough.
+    """
+    slicer.mrmlScene.Clear(0)
+
+  def runTest(self):
+    """Run as few or as many tests as needed here.
+
+    The warm-up profile of a workflow is run too when the workflow file is
+    given in WORKFLOWORGANIZER_WARMUP, e.g.
+
+      Slicer --python-code "slicer.selfTests['WorkflowOrganizer']()"
+
+    with WORKFLOWORGANIZER_WARMUP_BASELINE naming the baseline file and
+    WORKFLOWORGANIZER_WARMUP_PROFILE=1 recording the hottest call sites.
+    """
+    self.setUp()
+    self.test_WorkflowOrganizer1()
+    if os.environ.get('WORKFLOWORGANIZER_WARMUP'):
+      self.setUp()
+      self.test_WorkflowOrganizerWarmUp()
+
+  def test_WorkflowOrganizer1(self):
+    self.delayDisplay('Test passed!')
+
+  def test_WorkflowOrganizerWarmUp(self):
+    workflowFileName = os.environ.get('WORKFLOWORGANIZER_WARMUP')
+    if not workflowFileName:
+      self.skipTest('WORKFLOWORGANIZER_WARMUP is not set')
+    self.runWarmUpProfile(workflowFileName,
+                          os.environ.get('WORKFLOWORGANIZER_WARMUP_BASELINE'),
+                          os.environ.get('WORKFLOWORGANIZER_WARMUP_PROFILE') in ('1', 'true'))
+
+  def runWarmUpProfile(self, workflowFileName, baselineFileName=None, profileCalls=False, updateBaseline=False):
+    """Enter each module of the workflow once, in order, and measure what
+    the first entry costs. Only the first entry into a module creates its
+    widget, so the profile is meaningful in a fresh Slicer session, without
+    the prefetch of the upcoming steps.
+
+    The report, slowest module first, is printed and written next to the
+    baseline as <baseline>.report.json. If the baseline file exists, the
+    test fails on the modules that regressed against it; otherwise (or with
+    updateBaseline) it is written from this run.
+    """
+    from WorkflowOrganizerLib import readWorkflowFile, expandWorkflow, WarmUpProfiler, readWarmUpBaseline
+    workflow = expandWorkflow(readWorkflowFile(workflowFileName))
+    moduleNames = []
+    for step in workflow.steps:
+      if step.module not in moduleNames:
+        moduleNames.append(step.module)
+
+    profiler = WarmUpProfiler(profileCalls)
+    moduleManager = slicer.app.moduleManager()
+    for step, moduleName in enumerate(moduleNames):
+      module = moduleManager.module(moduleName)
+      def instantiate():
+        if module is None:
+          raise RuntimeError('module is not loaded')
+        module.widgetRepresentation()
+      def enter():
+        slicer.util.selectModule(moduleName)
+        slicer.app.processEvents()
+      profiler.measure(step, moduleName, instantiate, enter)
+    slicer.util.selectModule('WorkflowOrganizer')
+
+    regressions = {}
+    baseline = readWarmUpBaseline(baselineFileName) if baselineFileName else None
+    if baseline is not None and not updateBaseline:
+      if bool(baseline.get('profileCalls')) != profileCalls:
+        print('Warm-up: the baseline was %s cProfile, not compared' % ('recorded with' if baseline.get('profileCalls') else 'recorded without'))
+      else:
+        regressions = profiler.compare(baseline)
+    print(profiler.report(workflow.title, regressions))
+    if baselineFileName:
+      profiler.exportJSON(baselineFileName + '.report.json', workflow.title, regressions)
+      if baseline is None or updateBaseline:
+        profiler.writeBaseline(baselineFileName, workflow.title)
+        print('Warm-up: wrote the baseline %s' % baselineFileName)
+    self.assertEqual(regressions, {}, 'Warm-up regressed: %s' % ', '.join(sorted(regressions.keys())))
@@ -0,0 +1,226 @@
+"""Startup profile of a workflow: start Slicer with only the modules the
+workflow needs.
+
+  python -m WorkflowOrganizerLib.StartupProfile --slicer PATH/Slicer --output DIR/name workflow.txt
+
+The modules of the steps (including the included workflows), the modules
+they depend on and the modules Slicer needs for its own user interface
+(alwaysLoadedModules) are kept; every other installed module is passed to
+Slicer with --modules-to-ignore. The loadable modules are kept unless
+--drop-loadable is given, as their dependencies are not known without
+loading them. The profile is written as name.json, and a launch script
+(name.sh or name.bat) that starts Slicer with it and loads the workflow.
+With --measure N, Slicer is started N times with and without the profile
+(--exit-after-startup) and the startup times are compared.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+
+from .Workflow import readWorkflowFile, expandWorkflow
+from .Instrumentation import percentile
+
+# Modules used by the Slicer main window, the layouts and the data dialogs
+alwaysLoadedModules = ('Annotations', 'Cameras', 'Colors', 'Data', 'Markups', 'Models', 'Reformat',
+                       'SceneViews', 'SubjectHierarchy', 'Tables', 'Terminologies', 'Transforms',
+                       'Units', 'ViewControllers', 'Volumes', 'Welcome', 'WorkflowOrganizer')
+
+def batchQuote(argument):
+  # One argument of a .bat file: % is expanded by cmd.exe even in quotes,
+  # and the program reads \" as a literal quote.
+  return '"%s"' % argument.replace('%', '%%').replace('"', '\\"')
+
+def moduleClosure(moduleNames, dependencies):
+  """Return the set of moduleNames and the modules they depend on,
+  directly or not. 'dependencies' maps a module name to the list of the
+  modules it depends on."""
+  closure = set()
+  pending = list(moduleNames)
+  while pending:
+    name = pending.pop()
+    if name in closure:
+      continue
+    closure.add(name)
+    pending.extend(dependencies.get(name, ()))
+  return closure
+
+#
+# StartupProfile
+#
+class StartupProfile(object):
+  """Modules to load and to ignore for a workflow.
+
+  'registry' is the ModuleRegistry of the installed modules and 'metadata'
+  maps module names to their metadata (see ModuleMetadata.py), which gives
+  the dependencies of the scripted modules. All the modules of 'keepKinds'
+  are loaded.
+  """
+
+  def __init__(self, workflow, registry, metadata, keepKinds=('loadable',), keep=alwaysLoadedModules):
+    self.title = workflow.title
+    self.workflowModules = sorted(set([step.module for step in workflow.steps]))
+    dependencies = dict([(name, moduleMetadata.get('dependencies') or [])
+                         for name, moduleMetadata in metadata.items()])
+    installedNames = set([record.name for record in registry])
+    required = moduleClosure(self.workflowModules + list(keep), dependencies)
+    self.missingModules = sorted([name for name in self.workflowModules if name not in installedNames])
+    loaded = required & installedNames
+    for kind in keepKinds:
+      loaded.update([record.name for record in registry.ofKind(kind)])
+    self.loadedModules = sorted(loaded)
+    self.ignoredModules = sorted(installedNames - loaded)
+    self.numberOfInstalledModules = len(installedNames)
+    self.startupTimes = None
+
+  def arguments(self):
+    """Slicer command line arguments of the profile."""
+    if not self.ignoredModules:
+      return []
+    return ['--modules-to-ignore', ','.join(self.ignoredModules)]
+
+  def toDict(self):
+    return {'title': self.title, 'workflowModules': self.workflowModules,
+            'missingModules': self.missingModules, 'loadedModules': self.loadedModules,
+            'ignoredModules': self.ignoredModules, 'installedModules': self.numberOfInstalledModules,
+            'arguments': self.arguments(), 'startupTimes': self.startupTimes}
+
+  def writeJSON(self, fileName):
+    f = open(fileName, 'w')
+    try:
+      json.dump(self.toDict(), f, indent=2)
+    finally:
+      f.close()
+
+  def writeLaunchScript(self, fileName, slicerExecutable, workflowFileName=None):
+    """Write a script starting Slicer with the profile; it opens the
+    workflow if workflowFileName is given."""
+    arguments = self.arguments()
+    if workflowFileName:
+      # repr() makes a Python literal of any file name; forward slashes
+      # keep it free of backslashes.
+      code = ("slicer.util.selectModule('WorkflowOrganizer'); "
+              "slicer.modules.workfloworganizer.widgetRepresentation().self().loadWorkflowFile(%r)"
+              % os.path.abspath(workflowFileName).replace('\\', '/'))
+      arguments = arguments + ['--python-code', code]
+    if os.name == 'nt':
+      quote = batchQuote
+    else:
+      import pipes
+      quote = pipes.quote
+    command = ' '.join([quote(argument) for argument in [slicerExecutable] + arguments])
+    description = 'Slicer startup profile of "%s": %d of %d modules' % (
+      self.title, len(self.loadedModules), self.numberOfInstalledModules)
+    f = open(fileName, 'w')
+    try:
+      if os.name == 'nt':
+        f.write('@echo off\r\nrem %s\r\n%s %%*\r\n' % (description, command))
+      else:
+        f.write('#!/bin/sh\n# %s\nexec %s "$@"\n' % (description, command))
+    finally:
+      f.close()
+    if os.name != 'nt':
+      os.chmod(fileName, 0o755)
+
+  def write(self, fileNameBase, slicerExecutable, workflowFileName=None):
+    """Write fileNameBase.json and the launch script; return their names."""
+    scriptFileName = fileNameBase + ('.bat' if os.name == 'nt' else '.sh')
+    self.writeJSON(fileNameBase + '.json')
+    self.writeLaunchScript(scriptFileName, slicerExecutable, workflowFileName)
+    return [fileNameBase + '.json', scriptFileName]
+
+def startupTime(command, timeout=600):
+  """Wall time of one Slicer startup; the command must make Slicer exit
+  after startup."""
+  kwargs = {}
+  if os.name == 'posix':
+    # A process group, so that a timeout also stops the application started
+    # by the launcher
+    kwargs['preexec_fn'] = os.setsid
+  devnull = open(os.devnull, 'w')
+  try:
+    startTime = time.time()
+    process = subprocess.Popen(command, stdout=devnull, stderr=subprocess.STDOUT, **kwargs)
+    while process.poll() is None:
+      if time.time() - startTime > timeout:
+        if os.name == 'posix':
+          os.killpg(process.pid, signal.SIGKILL)
+        else:
+          subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)])
+        process.wait()
+        raise RuntimeError('Slicer did not exit within %d s' % timeout)
+      time.sleep(0.05)
+    return time.time() - startTime
+  finally:
+    devnull.close()
+
+def measureStartupTimes(slicerExecutable, profile, repeat=3, progress=None):
+  """Start Slicer 'repeat' times with all the modules and with the profile,
+  alternately, and return {'full': [...], 'profile': [...]} in seconds.
+  progress(message) is called before each start."""
+  command = [slicerExecutable, '--no-splash', '--exit-after-startup']
+  times = {'full': [], 'profile': []}
+  for i in xrange(0, repeat):
+    for key, arguments in (('full', []), ('profile', profile.arguments())):
+      if progress:
+        progress('Starting Slicer (%s, %d of %d)' % (key, i+1, repeat))
+      times[key].append(startupTime(command + arguments))
+  return times
+
+def startupReport(times):
+  """One line comparing the median startup times."""
+  full = percentile(sorted(times['full']), 0.5)
+  profile = percentile(sorted(times['profile']), 0.5)
+  return 'Startup time: %.1f s with all the modules, %.1f s with the profile (%.1f s, %.0f%% less)' % (
+    full, profile, full - profile, 100.0 * (full - profile) / full if full > 0 else 0.0)
+
+def main(argv):
+  from optparse import OptionParser
+  from .ModuleIndex import ModuleDiscovery
+  from .ModuleRegistry import ModuleRegistry
+  parser = OptionParser(usage="python -m WorkflowOrganizerLib.StartupProfile --slicer PATH/Slicer --output DIR/name workflow.txt")
+  parser.add_option("--slicer", dest="slicer", default=None, help="Slicer executable")
+  parser.add_option("--module-path", dest="modulePaths", action="append", default=[],
+                    help="additional module directory, as in Modules/AdditionalPaths (may be repeated)")
+  parser.add_option("--output", dest="output", default=None,
+                    help="file name of the profile, without extension")
+  parser.add_option("--keep", dest="keep", action="append", default=[],
+                    help="also load this module (may be repeated)")
+  parser.add_option("--drop-loadable", dest="dropLoadable", action="store_true", default=False,
+                    help="ignore the loadable modules the workflow does not use too")
+  parser.add_option("--measure", dest="measure", type="int", default=0,
+                    help="compare the startup times of N starts with and without the profile")
+  (options, args) = parser.parse_args(argv)
+  if len(args) != 1 or not options.slicer or not options.output:
+    parser.error("expected --slicer, --output and one workflow file")
+
+  slicerExecutable = os.path.abspath(options.slicer)
+  discovery = ModuleDiscovery()
+  discovery.discover(discovery.moduleDirectories(os.path.dirname(slicerExecutable), options.modulePaths))
+  registry = ModuleRegistry()
+  registry.extend(discovery.moduleFiles)
+  try:
+    workflow = expandWorkflow(readWorkflowFile(args[0]))
+  except (IOError, ValueError) as e:
+    print('WorkflowOrganizer: %s' % e)
+    return 2
+  profile = StartupProfile(workflow, registry, discovery.extractMetadata(),
+                           () if options.dropLoadable else ('loadable',),
+                           alwaysLoadedModules + tuple(options.keep))
+  print('%d of %d modules loaded, %d ignored' % (
+    len(profile.loadedModules), profile.numberOfInstalledModules, len(profile.ignoredModules)))
+  if profile.missingModules:
+    print('Not installed: %s' % ', '.join(profile.missingModules))
+  if options.measure > 0:
+    def progress(message):
+      print(message)
+    profile.startupTimes = measureStartupTimes(slicerExecutable, profile, options.measure, progress)
+    print(startupReport(profile.startupTimes))
+  for fileName in profile.write(options.output, slicerExecutable, args[0]):
+    print('Wrote %s' % fileName)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,367 @@
+import os
+import collections
+
+#
+# Workflow file
+#
+# A workflow file lists the steps of a workflow, one <item> per line:
+#
+#   <items>
+#   <title>Prostate Biopsy</title>
+#   # module name and label name
+#   <item>Data,Data</item>
+#   <item>Volumes,Volumes</item>
+#   <item>Volumes,Intra-op,intraop/T2.nrrd;intraop/needle.nrrd</item>
+#   </items>
+#
+# An item may list the data files of its step after the label, separated by
+# ';'. Relative paths are relative to the workflow file, and stay relative
+# when the workflow is saved.
+#
+# The steps of CLI modules can be run without the GUI by Runner.py. Their
+# command line arguments are given by an <args> line after the item, and the
+# steps they must wait for by an <after> line (labels or step numbers,
+# separated by ';'):
+#
+#   <item>ResampleScalarVolume,Resample</item>
+#   <args>--spacing 1,1,1 {case}/T2.nrrd {output}/T2iso.nrrd</args>
+#   <item>BRAINSFit,Register</item>
+#   <args>--fixedVolume {output}/T2iso.nrrd --movingVolume {case}/pre.nrrd</args>
+#   <after>Resample</after>
+#
+# A workflow may include the steps of another workflow file, e.g. a
+# registration segment shared by several procedures, with an <include> line
+# giving the file and optionally the label of the segment:
+#
+#   <include>common/registration.txt,Registration</include>
+#
+# The included file is only read when its steps are needed, and is parsed
+# once for all the workflows that include it (see WorkflowCache). Step
+# numbers in <after> lines count the steps of the included files in place.
+#
+# Any line containing '#' is a comment.
+#
+
+defaultWorkflowTitle = "Workflow Organizer"
+# Unsaved edits of a workflow file are autosaved next to it
+autosaveSuffix = ".autosave"
+
+class WorkflowStep(object):
+  """One <item> of a workflow file."""
+
+  def __init__(self, module, label, data=None, arguments=None, after=None, dataPaths=None):
+    self.module = module
+    self.label = label
+    self.data = data if data is not None else []
+    # The data files as written in the workflow file
+    self.dataPaths = dataPaths if dataPaths is not None else list(self.data)
+    # Command line of a CLI step, None for the interactive steps
+    self.arguments = arguments
+    # Labels or step numbers of the steps to run before this one
+    self.after = after if after is not None else []
+
+class WorkflowInclude(object):
+  """One <include> of a workflow file, before the step number 'position' of
+  the including workflow. 'ancestors' are the files it was included from,
+  to detect include cycles, and 'path' is the file name as written in the
+  including workflow."""
+
+  def __init__(self, fileName, label=None, position=0, ancestors=(), path=None):
+    self.fileName = fileName
+    self.path = path or fileName
+    self.label = label or os.path.splitext(os.path.basename(fileName))[0]
+    self.position = position
+    self.ancestors = ancestors
+
+class Workflow(object):
+  """Parsed content of a workflow file. 'title' is None when the file has no
+  <title> line. 'steps' are the steps of the file itself; the included
+  workflows are listed in 'includes'."""
+
+  def __init__(self, title=None, steps=None, includes=None):
+    self.title = title
+    self.steps = steps if steps is not None else []
+    self.includes = includes if includes is not None else []
+
+  def entries(self):
+    """The steps and includes in the order of the file."""
+    if not self.includes:
+      return list(self.steps)
+    entries = []
+    includes = sorted(self.includes, key=lambda include: include.position)
+    i = 0
+    for position, step in enumerate(self.steps):
+      while i < len(includes) and includes[i].position <= position:
+        entries.append(includes[i])
+        i = i + 1
+      entries.append(step)
+    return entries + includes[i:]
+
+def resolvePath(fileName, baseDirectory):
+  if baseDirectory is not None and not os.path.isabs(fileName):
+    return os.path.normpath(os.path.join(baseDirectory, fileName))
+  return fileName
+
+def formatPath(fileName, path, baseDirectory):
+  """Path of fileName to write in a workflow file of baseDirectory. 'path'
+  is the path as it was read: an absolute path is written as is, and a
+  relative one is kept relative, to baseDirectory if it is given."""
+  if os.path.isabs(path) or baseDirectory is None or not os.path.isabs(fileName):
+    return path
+  try:
+    return os.path.relpath(fileName, baseDirectory).replace(os.sep, '/')
+  except ValueError:
+    # On another drive on Windows
+    return fileName
+
+def parseWorkflow(lines, baseDirectory=None):
+  """Parse the lines of a workflow file into a Workflow. Relative data file
+  names are made absolute with baseDirectory."""
+  workflow = Workflow()
+  for l in lines:
+    if(l.find('#') != -1): # Skip the comment lines
+      continue
+
+    splitText = l.split(',')
+    if((l.find("<item>") >= 0 or l.find("<Item>") >= 0) and len(splitText) >= 2): # If the line has ',', it is an item.
+      moduleName = splitText[0].replace('<item>', '').replace('<Item>', '').strip()
+      label = splitText[1].replace('</item>', '').replace('</Item>', '').strip()
+      dataPaths = []
+      if len(splitText) >= 3:
+        for fileName in ','.join(splitText[2:]).replace('</item>', '').replace('</Item>', '').split(';'):
+          fileName = fileName.strip()
+          if fileName:
+            dataPaths.append(fileName)
+      data = [resolvePath(fileName, baseDirectory) for fileName in dataPaths]
+      workflow.steps.append(WorkflowStep(moduleName, label, data, dataPaths=dataPaths))
+
+    elif(l.find("<include>") >= 0):
+      splitText = l.replace('<include>', '').replace('</include>', '').split(',', 1)
+      fileName = splitText[0].strip()
+      if fileName:
+        label = splitText[1].strip() if len(splitText) > 1 else None
+        workflow.includes.append(WorkflowInclude(resolvePath(fileName, baseDirectory), label, len(workflow.steps), path=fileName))
+
+    elif(l.find("<args>") >= 0 and workflow.steps):
+      workflow.steps[-1].arguments = l.replace('<args>', '').replace('</args>', '').strip()
+
+    elif(l.find("<after>") >= 0 and workflow.steps):
+      after = l.replace('<after>', '').replace('</after>', '').split(';')
+      workflow.steps[-1].after += [name.strip() for name in after if name.strip()]
+
+    elif(l.find("<title>") >= 0 or l.find("<Title>") >= 0):
+      title = l.replace('<title>', '').replace('<Title>', '').replace('</title>', '').replace('</Title>', '').strip()
+      workflow.title = title or defaultWorkflowTitle
+
+  return workflow
+
+def formatHeader(title):
+  """Return the lines of a workflow file before the items."""
+  return ["<items>",
+          "<title>%s</title>" % (title or defaultWorkflowTitle),
+          "# module name, label name and data files"]
+
+def formatEntry(entry, baseDirectory=None):
+  """Return the lines of one step or include of a workflow file written in
+  baseDirectory."""
+  if isinstance(entry, WorkflowInclude):
+    return ["<include>%s,%s</include>" % (formatPath(entry.fileName, entry.path, baseDirectory), entry.label)]
+  item = "<item>%s,%s" % (entry.module, entry.label)
+  if entry.data:
+    item += "," + ";".join([formatPath(fileName, path, baseDirectory)
+                            for fileName, path in zip(entry.data, entry.dataPaths)])
+  lines = [item + "</item>"]
+  if entry.arguments is not None:
+    lines.append("<args>%s</args>" % entry.arguments)
+  if entry.after:
+    lines.append("<after>%s</after>" % ";".join(entry.after))
+  return lines
+
+def formatWorkflow(workflow, baseDirectory=None):
+  """Return the content of the workflow file of 'workflow', to be written
+  in baseDirectory."""
+  lines = formatHeader(workflow.title)
+  for entry in workflow.entries():
+    lines.extend(formatEntry(entry, baseDirectory))
+  lines.append("</items>")
+  return "\n".join(lines)
+
+def validateWorkflow(workflow, installedModules, similarNames=None):
+  """Check the modules of all the steps in one pass. 'installedModules' is a
+  dict, set or ModuleRegistry of the installed module names. Return the list of
+  (stepIndex, moduleName, suggestions) of the steps whose module is not
+  installed, stepIndex counting the includes too, as workflow.entries();
+  the suggestions come from similarNames(moduleName), e.g.
+  ModuleSearchIndex.similarNames.
+  """
+  missingSteps = []
+  suggestions = {}
+  for stepIndex, step in enumerate(workflow.entries()):
+    if isinstance(step, WorkflowInclude) or step.module in installedModules:
+      continue
+    if step.module not in suggestions:
+      suggestions[step.module] = similarNames(step.module) if similarNames else []
+    missingSteps.append((stepIndex, step.module, suggestions[step.module]))
+  return missingSteps
+
+def readWorkflowFile(fileName):
+  f = open(fileName, "rb")
+  try:
+    return parseWorkflow(f.readlines(), os.path.dirname(os.path.abspath(fileName)))
+  finally:
+    f.close()
+
+def fileSignature(fileName):
+  try:
+    s = os.stat(fileName)
+  except OSError:
+    return None
+  return (s.st_mtime, s.st_size)
+
+#
+# WorkflowCache
+#
+class WorkflowCache(object):
+  """Parsed workflow files, shared by all the workflows that include them.
+  A file is parsed again only when its mtime or size changed. The cached
+  workflows must not be modified."""
+
+  def __init__(self):
+    self.workflows = {}
+    self.hits = 0
+    self.misses = 0
+
+  def workflow(self, fileName):
+    """Return the parsed workflow of fileName; raise IOError if it cannot
+    be read."""
+    fileName = os.path.abspath(fileName)
+    signature = fileSignature(fileName)
+    cached = self.workflows.get(fileName)
+    if cached is not None and cached[0] == signature:
+      self.hits = self.hits + 1
+      return cached[1]
+    self.misses = self.misses + 1
+    workflow = readWorkflowFile(fileName)
+    self.workflows[fileName] = (signature, workflow)
+    return workflow
+
+def includeEntries(include, cache):
+  """Return the steps and includes of an included workflow, in order. The
+  includes are new WorkflowInclude objects whose ancestors include 'include';
+  raise ValueError on an include cycle and IOError if the file cannot be
+  read."""
+  workflow = cache.workflow(include.fileName)
+  ancestors = include.ancestors + (os.path.abspath(include.fileName),)
+  entries = []
+  for entry in workflow.entries():
+    if isinstance(entry, WorkflowInclude):
+      if os.path.abspath(entry.fileName) in ancestors:
+        raise ValueError('include cycle through %s' % entry.fileName)
+      entry = WorkflowInclude(entry.fileName, entry.label, entry.position, ancestors, entry.path)
+    entries.append(entry)
+  return entries
+
+def expandWorkflow(workflow, cache=None):
+  """Return a Workflow with the steps of all the included workflows in
+  place, e.g. to run it. Step numbers in the <after> lines of an included
+  workflow are renumbered."""
+  if cache is None:
+    cache = WorkflowCache()
+  expanded = Workflow(workflow.title)
+  def expand(entries, offset):
+    for entry in entries:
+      if isinstance(entry, WorkflowInclude):
+        expand(includeEntries(entry, cache), len(expanded.steps))
+        continue
+      after = [str(int(name) + offset) if name.isdigit() else name for name in entry.after]
+      expanded.steps.append(WorkflowStep(entry.module, entry.label, entry.data, entry.arguments, after, entry.dataPaths))
+  expand(workflow.entries(), 0)
+  return expanded
+
+def isWorkflowFile(lines):
+  for l in lines:
+    if l.find("<items>") >= 0 or l.find("<Items>") >= 0:
+      return True
+  return False
+
+#
+# WorkflowLibrary
+#
+class WorkflowLibrary(object):
+  """Directory of workflow files.
+
+  catalog() lists the title and the number of steps of every workflow file
+  of the directory; a file is only parsed again when its mtime or size
+  changed. workflow() returns the parsed workflow of a file from a bounded
+  LRU cache, so switching between recently used workflows does not read the
+  disk again.
+  """
+
+  def __init__(self, directory, cacheSize=16):
+    self.directory = directory
+    self.cacheSize = cacheSize
+    self.entries = {}
+    self.workflows = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def fileSignature(self, fileName):
+    return fileSignature(fileName)
+
+  def catalog(self):
+    """Return the list of (fileName, title, numberOfSteps) sorted by title."""
+    try:
+      names = os.listdir(self.directory)
+    except OSError:
+      names = []
+    entries = {}
+    for name in names:
+      fileName = os.path.join(self.directory, name)
+      if name.endswith(autosaveSuffix) or not os.path.isfile(fileName):
+        continue
+      signature = self.fileSignature(fileName)
+      entry = self.entries.get(fileName)
+      if entry is None or entry[0] != signature:
+        workflow = self.readWorkflow(fileName, signature)
+        if workflow is None:
+          entry = (signature, None, 0)
+        else:
+          entry = (signature, workflow.title or defaultWorkflowTitle, len(workflow.steps))
+      entries[fileName] = entry
+    self.entries = entries
+    catalog = [(fileName, title, numberOfSteps)
+               for fileName, (signature, title, numberOfSteps) in entries.items() if title is not None]
+    catalog.sort(key=lambda entry: (entry[1].lower(), entry[0]))
+    return catalog
+
+  def workflow(self, fileName):
+    """Return the parsed workflow of fileName, or None if it is not a workflow file."""
+    signature = self.fileSignature(fileName)
+    cached = self.workflows.get(fileName)
+    if cached is not None and cached[0] == signature:
+      self.hits = self.hits + 1
+      # most recently used last
+      del self.workflows[fileName]
+      self.workflows[fileName] = cached
+      return cached[1]
+    self.misses = self.misses + 1
+    return self.readWorkflow(fileName, signature)
+
+  def readWorkflow(self, fileName, signature):
+    try:
+      f = open(fileName, "rb")
+      try:
+        lines = f.readlines()
+      finally:
+        f.close()
+    except IOError:
+      return None
+    if not isWorkflowFile(lines):
+      return None
+    workflow = parseWorkflow(lines, os.path.dirname(os.path.abspath(fileName)))
+    if fileName in self.workflows:
+      del self.workflows[fileName]
+    self.workflows[fileName] = (signature, workflow)
+    while len(self.workflows) > self.cacheSize:
+      self.workflows.popitem(last=False)
+    return workflow
@@ -0,0 +1,7 @@
+from .ModuleIndex import ModuleIndexCache, ModuleDiscovery
+from .ModuleRegistry import ModuleRecord, ModuleRegistry
+from .ModuleSearch import ModuleSearchIndex
+from .Workflow import Workflow, WorkflowStep, WorkflowInclude, WorkflowCache, WorkflowLibrary, parseWorkflow, formatWorkflow, formatHeader, formatEntry, readWorkflowFile, validateWorkflow, includeEntries, expandWorkflow
+from .Instrumentation import TransitionRecorder, ResourceRecorder, WarmUpProfiler, readWarmUpBaseline
+from .DataPrefetch import DataPrefetcher
+from .Autosave import BackgroundFileWriter, writeFileAtomically